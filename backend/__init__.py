@@ -0,0 +1,72 @@
+"""Clients of the services the worker depends on, picked at start-up.
+
+BACKEND=production, the default, connects to Redis, S3, Mongo and the
+feature extraction server as always. BACKEND=local swaps in the stand-ins of
+backend.local, so the worker and the detect package run without any of
+them: a fake Redis, a directory for S3 (LOCAL_STORAGE_DIR), dict backed
+collections and random feature vectors. Models are then read from MODEL_DIR.
+"""
+
+import os
+
+BACKEND_PRODUCTION = 'production'
+BACKEND_LOCAL = 'local'
+BACKEND = os.environ.get('BACKEND', BACKEND_PRODUCTION)
+
+def is_local():
+  return BACKEND == BACKEND_LOCAL
+
+def get_env(name, local_default=''):
+  """os.environ[name], which only the production backend requires."""
+  if is_local():
+    return os.environ.get(name, local_default)
+  return os.environ[name]
+
+def create_log(options, tag):
+  if is_local():
+    from backend import local
+    return local.LocalLog(tag)
+  from bluelens_log import Logging
+  return Logging(options, tag=tag)
+
+def create_redis(server, password):
+  if is_local():
+    from backend import local
+    return local.redis
+  import redis
+  return redis.StrictRedis(server, decode_responses=False, port=6379, password=password)
+
+def create_uploader(aws_access_key, aws_secret_access_key, pool_size):
+  if is_local():
+    from backend import local
+    return local.LocalUploader()
+  from worker.image_uploader import ImageUploader
+  return ImageUploader(aws_access_key, aws_secret_access_key, pool_size=pool_size)
+
+def create_fetcher(**kwargs):
+  if is_local():
+    from backend import local
+    return local.LocalFetcher()
+  from worker.image_fetcher import ImageFetcher
+  return ImageFetcher(**kwargs)
+
+def create_apis():
+  """Return the (product, object, feature, image) API objects."""
+  if is_local():
+    from backend import local
+    return (local.LocalApi('products', local.get_collection('products')),
+            local.LocalApi('objects', local.get_collection('objects')),
+            local.LocalApi('features', local.get_collection('features')),
+            local.LocalApi('images', local.get_collection('images')))
+  from stylelens_product.products import Products
+  from stylelens_object.objects import Objects
+  from stylelens_object.features import Features
+  from stylelens_image.images import Images
+  return Products(), Objects(), Features(), Images()
+
+def create_feature_extractor():
+  if is_local():
+    from backend import local
+    return local.LocalFeatureExtractor()
+  from detect.feature_extract import FeatureExtractor
+  return FeatureExtractor()
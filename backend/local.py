@@ -0,0 +1,337 @@
+"""In-process and local filesystem stand-ins for Redis, S3, Mongo and the
+feature extraction server.
+
+Each one implements only what this repo calls on the real client. State is
+per process, so workers forked with WORKER_PROCESSES > 1 don't share it.
+"""
+
+from __future__ import print_function
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+from bson.objectid import ObjectId
+
+from worker.bulk_writer import Update
+
+LOCAL_STORAGE_DIR = os.environ.get('LOCAL_STORAGE_DIR', '/tmp/bl-object-classifier-storage')
+LOCAL_LOG_LEVEL = os.environ.get('LOCAL_LOG_LEVEL', 'INFO')
+LOCAL_CRAWL_VERSION = os.environ.get('LOCAL_CRAWL_VERSION', 'local')
+FEATURE_SIZE = 2048
+
+logging.basicConfig(level=getattr(logging, LOCAL_LOG_LEVEL))
+
+class LocalLog(object):
+  """bluelens_log.Logging interface on top of the logging module."""
+  def __init__(self, tag):
+    self.__logger = logging.getLogger(tag)
+
+  def debug(self, msg):
+    self.__logger.debug(msg)
+
+  def info(self, msg):
+    self.__logger.info(msg)
+
+  def warn(self, msg):
+    self.__logger.warning(msg)
+
+  def error(self, msg):
+    self.__logger.error(msg)
+
+class FakeRedisPipeline(object):
+  """Queues commands and runs them all under the lock of its FakeRedis."""
+  def __init__(self, redis):
+    self.__redis = redis
+    self.__commands = []
+
+  def __getattr__(self, name):
+    command = getattr(self.__redis, name)
+
+    def queue(*args, **kwargs):
+      self.__commands.append((command, args, kwargs))
+      return self
+    return queue
+
+  def execute(self):
+    commands = self.__commands
+    self.__commands = []
+    with self.__redis.lock:
+      return [command(*args, **kwargs) for command, args, kwargs in commands]
+
+class FakeRedis(object):
+  """The redis.StrictRedis commands the worker uses, on dicts in memory.
+
+  Values are kept as bytes like a StrictRedis without decode_responses
+  returns them. Expiry is accepted and ignored.
+  """
+  def __init__(self):
+    self.lock = threading.RLock()
+    self.__changed = threading.Condition(self.lock)
+    self.__lists = {}
+    self.__sets = {}
+    self.__hashes = {}
+    self.__values = {}
+
+  def encode(self, value):
+    if isinstance(value, bytes):
+      return value
+    return str(value).encode('utf-8')
+
+  def pipeline(self, transaction=True):
+    return FakeRedisPipeline(self)
+
+  def lpush(self, name, *values):
+    with self.lock:
+      items = self.__lists.setdefault(name, [])
+      for value in values:
+        items.insert(0, self.encode(value))
+      self.__changed.notify_all()
+      return len(items)
+
+  def rpush(self, name, *values):
+    with self.lock:
+      items = self.__lists.setdefault(name, [])
+      items.extend(self.encode(value) for value in values)
+      self.__changed.notify_all()
+      return len(items)
+
+  def llen(self, name):
+    with self.lock:
+      return len(self.__lists.get(name, []))
+
+  def lrange(self, name, start, end):
+    with self.lock:
+      items = self.__lists.get(name, [])
+      return list(items[start:None if end == -1 else end + 1])
+
+  def ltrim(self, name, start, end):
+    with self.lock:
+      items = self.__lists.get(name, [])
+      self.__lists[name] = items[start:None if end == -1 else end + 1]
+      return True
+
+  def blpop(self, keys, timeout=0):
+    if not isinstance(keys, (list, tuple)):
+      keys = [keys]
+    deadline = time.time() + timeout if timeout else None
+    with self.lock:
+      while True:
+        for key in keys:
+          items = self.__lists.get(key)
+          if items:
+            return key, items.pop(0)
+        if deadline is None:
+          self.__changed.wait()
+        else:
+          remaining = deadline - time.time()
+          if remaining <= 0:
+            return None
+          self.__changed.wait(remaining)
+
+  def sadd(self, name, *values):
+    with self.lock:
+      members = self.__sets.setdefault(name, set())
+      added = len(set(self.encode(value) for value in values) - members)
+      members.update(self.encode(value) for value in values)
+      return added
+
+  def sismember(self, name, value):
+    with self.lock:
+      return self.encode(value) in self.__sets.get(name, set())
+
+  def hset(self, name, key, value):
+    with self.lock:
+      self.__hashes.setdefault(name, {})[self.encode(key)] = self.encode(value)
+      return 1
+
+  def hget(self, name, key):
+    with self.lock:
+      return self.__hashes.get(name, {}).get(self.encode(key))
+
+  def set(self, name, value):
+    with self.lock:
+      self.__values[name] = self.encode(value)
+      return True
+
+  def setex(self, name, time, value):
+    return self.set(name, value)
+
+  def get(self, name):
+    with self.lock:
+      return self.__values.get(name)
+
+  def expire(self, name, time):
+    return True
+
+class BulkWriteResult(object):
+  def __init__(self, upserted_ids):
+    self.upserted_ids = upserted_ids
+
+class LocalCollection(object):
+  """Dict backed collection taking the Update bulk writes of BulkWriter."""
+  def __init__(self):
+    self.documents = {}
+    self.__lock = threading.Lock()
+
+  def find_one(self, query):
+    with self.__lock:
+      return self.match(query)
+
+  def match(self, query):
+    if '_id' in query:
+      document = self.documents.get(query['_id'])
+      return document if document is not None and self.matches(document, query) else None
+    for document in self.documents.values():
+      if self.matches(document, query):
+        return document
+    return None
+
+  def matches(self, document, query):
+    return all(document.get(key) == value for key, value in query.items())
+
+  def insert_one(self, document):
+    with self.__lock:
+      document = dict(document)
+      document.setdefault('_id', ObjectId())
+      self.documents[document['_id']] = document
+      return document['_id']
+
+  def update_one(self, query, update, upsert=False):
+    with self.__lock:
+      return self.apply(query, update, upsert)
+
+  def apply(self, query, update, upsert):
+    document = self.match(query)
+    if document is not None:
+      document.update(update.get('$set', {}))
+      return None
+    if not upsert:
+      return None
+    document = dict(query)
+    document.update(update.get('$set', {}))
+    document.update(update.get('$setOnInsert', {}))
+    document.setdefault('_id', ObjectId())
+    self.documents[document['_id']] = document
+    return document['_id']
+
+  def bulk_write(self, requests, ordered=True):
+    for request in requests:
+      if not isinstance(request, Update):
+        raise TypeError('unsupported bulk write operation: ' + type(request).__name__)
+    upserted_ids = {}
+    with self.__lock:
+      for i, request in enumerate(requests):
+        upserted_id = self.apply(request.query, request.document, request.upsert)
+        if upserted_id is not None:
+          upserted_ids[i] = upserted_id
+    return BulkWriteResult(upserted_ids)
+
+  def delete_one(self, query):
+    with self.__lock:
+      document = self.match(query)
+      if document is not None:
+        del self.documents[document['_id']]
+
+class LocalApi(object):
+  """The stylelens API methods the worker calls, on one LocalCollection.
+
+  The collection is also available under its name, like on the real APIs.
+  """
+  def __init__(self, collection_name, collection):
+    self.collection = collection
+    setattr(self, collection_name, collection)
+
+  def update_product_by_id(self, product_id, product):
+    self.collection.update_one({'_id': ObjectId(product_id)}, {'$set': product})
+
+  def delete_product(self, product_id):
+    self.collection.delete_one({'_id': ObjectId(product_id)})
+
+class LocalUploader(object):
+  """ImageUploader interface writing to <storage_dir>/<bucket>/<key>."""
+  def __init__(self, storage_dir=LOCAL_STORAGE_DIR):
+    self.storage_dir = storage_dir
+
+  def put(self, bucket, key, data):
+    path = os.path.join(self.storage_dir, bucket, key)
+    dir = os.path.dirname(path)
+    if not os.path.exists(dir):
+      try:
+        os.makedirs(dir)
+      except OSError:
+        pass
+    with open(path, 'wb') as f:
+      f.write(data)
+    return 'file://' + os.path.abspath(path)
+
+  def upload(self, bucket, key, data, is_public=False):
+    future = Future()
+    try:
+      future.set_result(self.put(bucket, key, data))
+    except Exception as e:
+      future.set_exception(e)
+    return future
+
+class LocalFetcher(object):
+  """ImageFetcher interface over local paths and file:// URLs."""
+  def __init__(self):
+    self.__files = {}
+    self.__lock = threading.Lock()
+
+  def download(self, url):
+    path = url[len('file://'):] if url.startswith('file://') else url
+    with open(path, 'rb') as f:
+      return f.read()
+
+  def submit(self, url):
+    future = Future()
+    try:
+      future.set_result(self.fetch(url))
+    except Exception as e:
+      future.set_exception(e)
+    return future
+
+  def prefetch(self, urls):
+    pass
+
+  def fetch(self, url):
+    with self.__lock:
+      data = self.__files.get(url)
+    if data is None:
+      data = self.download(url)
+      with self.__lock:
+        self.__files[url] = data
+    return data
+
+  def release(self, urls):
+    with self.__lock:
+      for url in urls:
+        self.__files.pop(url, None)
+
+class LocalFeatureExtractor(object):
+  """Deterministic float32 vectors in place of the feature extraction server."""
+  def __init__(self, feature_size=FEATURE_SIZE):
+    self.feature_size = feature_size
+    self.__random = np.random.RandomState(0)
+    self.__lock = threading.Lock()
+
+  def extract_feature(self, image):
+    return self.extract_features([image])[0].tobytes()
+
+  def extract_features(self, images):
+    with self.__lock:
+      return self.__random.rand(len(images), self.feature_size).astype(np.float32)
+
+redis = FakeRedis()
+# Set by the crawler in production, read by the worker at start-up
+redis.hset('bl:crawl:version', 'latest', LOCAL_CRAWL_VERSION)
+collections = {}
+
+def get_collection(name):
+  if name not in collections:
+    collections[name] = LocalCollection()
+  return collections[name]
@@ -0,0 +1,213 @@
+"""Offline throughput benchmark of the detect package and main.analyze_product.
+
+Builds ObjectDetector from local frozen graphs, replays a directory of images
+and reports images/sec, latency percentiles and the RSS growth and peak of
+every phase (from /proc, so Linux only), plus the
+percentiles of every timed stage. It runs on BACKEND=local, so the feature
+server, S3, Mongo and Redis are the in-process stand-ins of backend.local.
+
+  python -m benchmark.run_benchmark --model-dir /path/to/models \\
+      --images object_detection/test_images
+
+The model dir holds top/, bottom/ and full/, each with
+frozen_inference_graph.pb and label_map.pbtxt (and pipeline.config for
+--pre-resize), or a copy of the model bucket's layout.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import pickle
+import sys
+import threading
+import time
+
+import numpy as np
+
+BENCHMARK_ENV = {
+  'SPAWN_ID': 'benchmark',
+  'METRICS_PORT': '0',
+  'LOCAL_LOG_LEVEL': 'ERROR',
+  'LOCAL_STORAGE_DIR': '/tmp/bl-object-classifier-benchmark',
+  'DETECT_CACHE': 'false',
+  'DETECT_PHASH': 'false',
+  'PRODUCT_INDEX': 'false',
+  'FETCH_HTTP_CACHE': 'false',
+}
+
+PERCENTILES = [50, 95, 99]
+RSS_SAMPLE_INTERVAL = 0.005
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+def setup_env(model_dir):
+  for key, value in BENCHMARK_ENV.items():
+    os.environ.setdefault(key, value)
+  os.environ['BACKEND'] = 'local'
+  os.environ['MODEL_DIR'] = model_dir
+
+def load_images(image_dir):
+  paths = sorted(os.path.join(image_dir, name) for name in os.listdir(image_dir)
+                 if name.lower().endswith(IMAGE_EXTENSIONS))
+  if len(paths) == 0:
+    raise IOError('no images in ' + image_dir)
+  return paths
+
+def current_rss_mb():
+  # The second field of statm is the number of resident pages
+  with open('/proc/self/statm') as f:
+    return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024.0 * 1024.0)
+
+class RssMonitor(object):
+  """Samples the RSS on a thread of its own, for the peak of every phase.
+
+  ru_maxrss only ever grows, so every phase after the first would just
+  repeat the peak of an earlier one.
+  """
+  def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+    self.interval = interval
+    self.start_rss = self.peak_rss = current_rss_mb()
+    self.__lock = threading.Lock()
+    thread = threading.Thread(target=self.run)
+    thread.daemon = True
+    thread.start()
+
+  def run(self):
+    while True:
+      rss = current_rss_mb()
+      with self.__lock:
+        self.peak_rss = max(self.peak_rss, rss)
+      time.sleep(self.interval)
+
+  def start_phase(self):
+    rss = current_rss_mb()
+    with self.__lock:
+      self.start_rss = self.peak_rss = rss
+
+  def format(self):
+    rss = current_rss_mb()
+    with self.__lock:
+      start_rss = self.start_rss
+      peak_rss = max(self.peak_rss, rss)
+    return 'rss=%.0fMB (%+.0fMB) peak_rss=%.0fMB (%+.0fMB)' % (
+      rss, rss - start_rss, peak_rss, peak_rss - start_rss)
+
+def make_recording_registry():
+  from util import metrics
+
+  class RecordingRegistry(metrics.Registry):
+    """Registry keeping every observed value, for exact percentiles."""
+    def __init__(self):
+      metrics.Registry.__init__(self)
+      self.values = {}
+
+    def observe(self, stage, value):
+      metrics.Registry.observe(self, stage, value)
+      self.values.setdefault(stage, []).append(value)
+
+    def reset(self):
+      metrics.Registry.reset(self)
+      self.values = {}
+
+  metrics.REGISTRY = RecordingRegistry()
+  return metrics.REGISTRY
+
+def format_percentiles(values):
+  return ' '.join('p%d=%.1fms' % (p, np.percentile(values, p) * 1000) for p in PERCENTILES)
+
+def report(name, latencies, elapsed, registry, monitor):
+  print('%-10s images=%d %.2f img/s %s %s' % (
+    name, len(latencies), len(latencies) / elapsed, format_percentiles(latencies), monitor.format()))
+  for stage in sorted(registry.values):
+    print('  %-22s n=%-6d %s' % (stage, len(registry.values[stage]), format_percentiles(registry.values[stage])))
+
+def run_phase(name, func, items, registry, monitor):
+  registry.reset()
+  monitor.start_phase()
+  latencies = []
+  start_time = time.time()
+  for item in items:
+    item_start = time.time()
+    func(item)
+    latencies.append(time.time() - item_start)
+  report(name, latencies, time.time() - start_time, registry, monitor)
+
+def make_product(path, i):
+  from bson.objectid import ObjectId
+  return {'_id': ObjectId(),
+          'name': 'benchmark product ' + str(i),
+          'main_image': path,
+          'main_image_mobile_full': path,
+          'main_image_mobile_thumb': path,
+          'product_url': 'http://localhost/' + str(i),
+          'product_no': str(i),
+          'price': 0,
+          'host_code': 'benchmark',
+          'host_group': 'benchmark',
+          'host_url': 'http://localhost',
+          'host_name': 'benchmark'}
+
+def setup_worker(main, detector):
+  main.version_id = main.get_latest_crawl_version()
+  main.obj_detector = detector
+
+def main(argv):
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--model-dir', required=True)
+  parser.add_argument('--images', default=os.path.join('object_detection', 'test_images'))
+  parser.add_argument('--repeat', type=int, default=10, help='times every image is replayed')
+  parser.add_argument('--execution-mode', default='serial', choices=['serial', 'parallel', 'merged'])
+  parser.add_argument('--decode-min-size', type=int, default=0)
+  parser.add_argument('--pre-resize', action='store_true')
+  parser.add_argument('--batch-size', type=int, default=1, help='also run getObjectsBatch if above 1')
+  parser.add_argument('--skip-product', action='store_true', help='skip the main.analyze_product phase')
+  args = parser.parse_args(argv)
+
+  setup_env(args.model_dir)
+  registry = make_recording_registry()
+  monitor = RssMonitor()
+
+  from detect import object_detect
+
+  paths = load_images(args.images)
+  datas = []
+  for path in paths:
+    with open(path, 'rb') as f:
+      datas.append(f.read())
+
+  monitor.start_phase()
+  start_time = time.time()
+  detector = object_detect.ObjectDetector(execution_mode=args.execution_mode,
+                                          decode_min_size=args.decode_min_size,
+                                          pre_resize=args.pre_resize)
+  print('load       %.2fs %s' % (time.time() - start_time, monitor.format()))
+
+  monitor.start_phase()
+  start_time = time.time()
+  detector.warm_up()
+  print('warm_up    %.2fs %s' % (time.time() - start_time, monitor.format()))
+
+  replay = datas * args.repeat
+  run_phase('detect', detector.getObjectsFromData, replay, registry, monitor)
+
+  if args.batch_size > 1:
+    batches = [replay[i:i + args.batch_size] for i in range(0, len(replay), args.batch_size)]
+    registry.reset()
+    monitor.start_phase()
+    latencies = []
+    start_time = time.time()
+    for batch in batches:
+      batch_start = time.time()
+      detector.getObjectsBatch(batch)
+      # Every image of a batch waits for the whole batch
+      latencies.extend([time.time() - batch_start] * len(batch))
+    report('batch', latencies, time.time() - start_time, registry, monitor)
+
+  if not args.skip_product:
+    import main as worker
+    setup_worker(worker, detector)
+    products = [pickle.dumps(make_product(path, i)) for i, path in enumerate(paths * args.repeat)]
+    run_phase('product', worker.analyze_product, products, registry, monitor)
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,66 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import io
+import os
+import grpc
+import numpy as np
+from PIL import Image
+from stylelens_feature.grpc import feature_extract_pb2
+from stylelens_feature.grpc import feature_extract_pb2_grpc
+
+FEATURE_GRPC_HOST = os.environ['FEATURE_GRPC_HOST']
+FEATURE_GRPC_PORT = os.environ['FEATURE_GRPC_PORT']
+
+# Same input the stylelens_feature client sends: a 300x300 bounded JPEG
+FEATURE_IMAGE_WIDTH = 300
+FEATURE_IMAGE_HEIGHT = 300
+FEATURE_DTYPE = np.float32
+
+class FeatureExtractor(object):
+  """In-memory client for the feature extraction gRPC server.
+
+  Unlike stylelens_feature.ExtractFeature it takes PIL images rather than
+  file names, never touches the disk and keeps one channel open for the life
+  of the detector, so it is safe to use from several threads. The channel is
+  only opened on first use, since gRPC channels do not survive a fork.
+  """
+  def __init__(self):
+    self.__channel = None
+    self.__stub = None
+
+  def get_stub(self):
+    if self.__stub is None:
+      self.__channel = grpc.insecure_channel(FEATURE_GRPC_HOST + ':' + FEATURE_GRPC_PORT)
+      self.__stub = feature_extract_pb2_grpc.ExtractStub(self.__channel)
+    return self.__stub
+
+  def encode_image(self, image):
+    im = image.copy()
+    size = FEATURE_IMAGE_WIDTH, FEATURE_IMAGE_HEIGHT
+    im.thumbnail(size, Image.ANTIALIAS)
+    buf = io.BytesIO()
+    im.save(buf, format='JPEG')
+    return buf.getvalue()
+
+  def extract_feature(self, image):
+    request = feature_extract_pb2.FeatureRequest(file_data=self.encode_image(image))
+    response = self.get_stub().GetFeature(request)
+    return response.vector
+
+  def extract_features(self, images):
+    """Extract the features of several images as one batch.
+
+    All requests are in flight on the shared channel at the same time, so the
+    batch costs about one round trip instead of one per image.
+
+    Returns:
+      a float32 array of shape [len(images), feature_size], in input order.
+    """
+    futures = []
+    for image in images:
+      request = feature_extract_pb2.FeatureRequest(file_data=self.encode_image(image))
+      futures.append(self.get_stub().GetFeature.future(request))
+    vectors = [np.frombuffer(future.result().vector, dtype=FEATURE_DTYPE) for future in futures]
+    return np.stack(vectors)
@@ -0,0 +1,60 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+BATCH_SIZE = 8
+BATCH_LATENCY = 0.01
+
+class MicroBatcher(object):
+  """Coalesces items submitted from many threads into batches for one function.
+
+  A single thread takes the first waiting item, then keeps collecting for at
+  most max_latency seconds or until max_batch_size items are there, and calls
+  func with the list. func returns one result per item; results that are
+  exceptions are raised to the submitter of that item only.
+  """
+  def __init__(self, func, max_batch_size=BATCH_SIZE, max_latency=BATCH_LATENCY):
+    self.__func = func
+    self.max_batch_size = max_batch_size
+    self.max_latency = max_latency
+    self.__queue = queue.Queue()
+    self.__thread = threading.Thread(target=self.run)
+    self.__thread.daemon = True
+    self.__thread.start()
+
+  def submit(self, item):
+    future = Future()
+    self.__queue.put((item, future))
+    return future
+
+  def get_batch(self):
+    batch = [self.__queue.get()]
+    deadline = time.time() + self.max_latency
+    while len(batch) < self.max_batch_size:
+      timeout = deadline - time.time()
+      if timeout <= 0:
+        break
+      try:
+        batch.append(self.__queue.get(timeout=timeout))
+      except queue.Empty:
+        break
+    return batch
+
+  def run(self):
+    while True:
+      batch = self.get_batch()
+      items = [item for item, future in batch]
+      try:
+        results = self.__func(items)
+      except Exception as e:
+        results = [e] * len(batch)
+      for (item, future), result in zip(batch, results):
+        if isinstance(result, Exception):
+          future.set_exception(result)
+        else:
+          future.set_result(result)
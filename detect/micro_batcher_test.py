@@ -0,0 +1,62 @@
+import time
+import unittest
+
+from detect.micro_batcher import MicroBatcher
+
+TIMEOUT = 5.0
+
+class Recorder(object):
+  """Batch function that records its batches."""
+  def __init__(self):
+    self.batches = []
+
+  def __call__(self, items):
+    self.batches.append(list(items))
+    return [ValueError(item) if item < 0 else item * 10 for item in items]
+
+class MicroBatcherTest(unittest.TestCase):
+  def setUp(self):
+    self.recorder = Recorder()
+
+  def test_batches_up_to_max_batch_size(self):
+    batcher = MicroBatcher(self.recorder, max_batch_size=3, max_latency=0.5)
+    futures = [batcher.submit(i) for i in range(7)]
+    self.assertEqual([future.result(TIMEOUT) for future in futures], [i * 10 for i in range(7)])
+    # Full batches go without waiting, the last one once the latency is up
+    self.assertEqual(self.recorder.batches, [[0, 1, 2], [3, 4, 5], [6]])
+
+  def test_batch_closes_after_max_latency(self):
+    batcher = MicroBatcher(self.recorder, max_batch_size=100, max_latency=0.05)
+    start_time = time.time()
+    self.assertEqual(batcher.submit(1).result(TIMEOUT), 10)
+    self.assertLess(time.time() - start_time, 1.0)
+
+    # Items submitted within the latency share a batch
+    futures = [batcher.submit(i) for i in range(4)]
+    self.assertEqual([future.result(TIMEOUT) for future in futures], [0, 10, 20, 30])
+    self.assertEqual(self.recorder.batches, [[1], [0, 1, 2, 3]])
+
+  def test_failed_item_is_raised_to_its_submitter_only(self):
+    batcher = MicroBatcher(self.recorder, max_batch_size=3, max_latency=0.05)
+    futures = [batcher.submit(i) for i in [1, -1, 2]]
+    self.assertEqual(futures[0].result(TIMEOUT), 10)
+    with self.assertRaises(ValueError):
+      futures[1].result(TIMEOUT)
+    self.assertEqual(futures[2].result(TIMEOUT), 20)
+
+  def test_failed_batch_is_raised_to_every_submitter(self):
+    def fail(items):
+      raise IOError('session closed')
+
+    batcher = MicroBatcher(fail, max_batch_size=2, max_latency=0.05)
+    futures = [batcher.submit(i) for i in range(2)]
+    for future in futures:
+      with self.assertRaises(IOError):
+        future.result(TIMEOUT)
+
+    # The batcher thread carries on with the next batches
+    batcher = MicroBatcher(self.recorder, max_batch_size=2, max_latency=0.05)
+    self.assertEqual(batcher.submit(3).result(TIMEOUT), 30)
+
+if __name__ == '__main__':
+  unittest.main()
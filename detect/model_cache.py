@@ -0,0 +1,126 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import hashlib
+import mmap
+import os
+import shutil
+import tempfile
+
+import boto3
+
+MODEL_CACHE_DIR = os.environ.get('MODEL_CACHE_DIR', '/tmp/bl-model-cache')
+# Load the models from this directory instead of S3, e.g. for benchmarks
+MODEL_DIR = os.environ.get('MODEL_DIR')
+CHECKSUM_SUFFIX = '.sha256'
+CHUNK_SIZE = 1024 * 1024
+
+def file_digest(path, algorithm='sha256'):
+  h = hashlib.new(algorithm)
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+      h.update(chunk)
+  return h.hexdigest()
+
+def parse_from_file(message, path):
+  """ParseFromString a protobuf message straight from a memory mapped file."""
+  with open(path, 'rb') as f:
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      try:
+        message.ParseFromString(mm)
+      except TypeError:
+        # The pure python protobuf implementation only takes bytes
+        message.ParseFromString(mm[:])
+    finally:
+      mm.close()
+  return message
+
+def get_etag(path):
+  """Return the ETag of the S3 object a path from ModelCache.get was cached from."""
+  return os.path.basename(os.path.dirname(path))
+
+class ModelCache(object):
+  """Local on-disk cache of model files kept in S3.
+
+  Files are stored under <cache_dir>/<bucket>/<key>/<etag>/, so a new upload
+  of a model gets a new entry while pods keep reusing an unchanged one. Every
+  entry has a sha256 sidecar written after a verified download, and the file
+  is checked against it before being handed out. Mount a node volume at
+  MODEL_CACHE_DIR to keep the cache across pod restarts.
+  """
+  def __init__(self, aws_access_key, aws_secret_access_key, cache_dir=MODEL_CACHE_DIR):
+    self.__s3 = boto3.client('s3', aws_access_key_id=aws_access_key, aws_secret_access_key=aws_secret_access_key)
+    self.cache_dir = cache_dir
+
+  def get_path(self, bucket, key, etag):
+    return os.path.join(self.cache_dir, bucket, key, etag, os.path.basename(key))
+
+  def is_valid(self, path):
+    checksum_file = path + CHECKSUM_SUFFIX
+    if not os.path.exists(path) or not os.path.exists(checksum_file):
+      return False
+    with open(checksum_file) as f:
+      checksum = f.read().strip()
+    return file_digest(path) == checksum
+
+  def download(self, bucket, key, etag, path):
+    dir = os.path.dirname(path)
+    if not os.path.exists(dir):
+      os.makedirs(dir)
+
+    # Download next to the final path and rename, so a crashed or concurrent
+    # download never leaves a half written file in place
+    fd, tmp_path = tempfile.mkstemp(dir=dir)
+    try:
+      with os.fdopen(fd, 'wb') as data:
+        self.__s3.download_fileobj(bucket, key, data)
+      # Single part uploads have the MD5 of the content as their ETag
+      if '-' not in etag and file_digest(tmp_path, 'md5') != etag:
+        raise IOError('checksum mismatch: ' + key)
+      with open(path + CHECKSUM_SUFFIX, 'w') as f:
+        f.write(file_digest(tmp_path))
+      shutil.move(tmp_path, path)
+    finally:
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+  def get(self, bucket, key):
+    """Return the local path of an up to date copy of s3://bucket/key."""
+    head = self.__s3.head_object(Bucket=bucket, Key=key)
+    etag = head['ETag'].strip('"')
+    path = self.get_path(bucket, key, etag)
+    if not self.is_valid(path):
+      self.download(bucket, key, etag, path)
+    return path
+
+  def get_etag(self, path):
+    return get_etag(path)
+
+class LocalModelCache(object):
+  """Model files from a local directory, with the interface of ModelCache.
+
+  A key is looked up as <model_dir>/<key> first, then by its last two parts,
+  so both a copy of the bucket layout and plain <model_dir>/<type>/<file>
+  directories work.
+  """
+  def __init__(self, model_dir):
+    self.model_dir = model_dir
+
+  def get(self, bucket, key):
+    path = os.path.join(self.model_dir, key)
+    if not os.path.exists(path):
+      path = os.path.join(self.model_dir, *key.split('/')[-2:])
+    if not os.path.exists(path):
+      raise IOError('no local model file: ' + key)
+    return path
+
+  def get_etag(self, path):
+    stat = os.stat(path)
+    return '%d-%d' % (stat.st_size, int(stat.st_mtime))
+
+def create(aws_access_key, aws_secret_access_key):
+  if MODEL_DIR:
+    return LocalModelCache(MODEL_DIR)
+  return ModelCache(aws_access_key, aws_secret_access_key)
@@ -1,40 +1,368 @@
 from __future__ import print_function
 
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
 from detect.object_detect_top import TopObjectDetect
 from detect.object_detect_bottom import BottomObjectDetect
 from detect.object_detect_full import FullObjectDetect
+from detect.object_detect_multi import MultiHeadObjectDetect
+from detect.object_detect_base import OD_SCORE_MIN
+from detect.result_cache import ResultCache
+from detect.result_cache import make_model_version
+from detect.result_cache import RESULT_CACHE_SIZE
+from detect.result_cache import RESULT_CACHE_EXPIRE
+from detect import phash
+from util import image_util
+from util import metrics
+import backend
+
+EXECUTION_MODE_SERIAL = 'serial'
+EXECUTION_MODE_PARALLEL = 'parallel'
+EXECUTION_MODE_MERGED = 'merged'
+
+OD_EXECUTION_MODE = os.environ.get('OD_EXECUTION_MODE', EXECUTION_MODE_SERIAL)
+# Detection runs on a JPEG draft decode of at least this size, the object
+# crops are still cut from a full decode of the images that have boxes
+OD_DECODE_MIN_SIZE = int(os.environ.get('OD_DECODE_MIN_SIZE', 0))
+OD_PRE_RESIZE = os.environ.get('OD_PRE_RESIZE', 'false') == 'true'
+DETECT_CACHE = os.environ.get('DETECT_CACHE', 'true') == 'true'
+DETECT_CACHE_SIZE = int(os.environ.get('DETECT_CACHE_SIZE', RESULT_CACHE_SIZE))
+DETECT_CACHE_REDIS = os.environ.get('DETECT_CACHE_REDIS', 'true') == 'true'
+DETECT_CACHE_EXPIRE = int(os.environ.get('DETECT_CACHE_EXPIRE', RESULT_CACHE_EXPIRE))
+# Off by default: near duplicates reuse the boxes and feature vectors of the
+# first copy seen, so a wrong match ends up in the similarity search
+DETECT_PHASH = os.environ.get('DETECT_PHASH', 'false') == 'true'
+DETECT_PHASH_DISTANCE = int(os.environ.get('DETECT_PHASH_DISTANCE', phash.PHASH_MAX_DISTANCE))
+DETECT_PHASH_SIZE = int(os.environ.get('DETECT_PHASH_SIZE', phash.PHASH_INDEX_SIZE))
+
+MODEL_NAMES = ['top', 'bottom', 'full']
+
+# (width, height) of the synthetic images used by warm_up, roughly the sizes
+# of the product photos we get
+WARM_UP_SIZES = [(640, 640), (1000, 1500)]
 
 class ObjectDetector(object):
-  def __init__(self):
-    self.top_od = TopObjectDetect()
-    self.bottom_od = BottomObjectDetect()
-    self.full_od = FullObjectDetect()
+  def __init__(self, execution_mode=EXECUTION_MODE_SERIAL, decode_min_size=None, create_sessions=True,
+               pre_resize=False):
+    self.top_od = TopObjectDetect(create_session=False)
+    self.bottom_od = BottomObjectDetect(create_session=False)
+    self.full_od = FullObjectDetect(create_session=False)
+    self.detectors = [self.top_od, self.bottom_od, self.full_od]
+
+    # Models are downloaded and parsed here, all three at once, but the
+    # sessions can be created later, e.g. in processes forked after the
+    # models were loaded
+    with ThreadPoolExecutor(max_workers=len(self.detectors)) as executor:
+      self.graph_defs = list(executor.map(lambda od: od.load_graph_def(), self.detectors))
+    self.multi_od = None
+
+    # With pre_resize the image is shrunk to what the models' own resizers
+    # would make of it before it is fed, if every model says what that is
+    self.image_resizers = None
+    if pre_resize:
+      image_resizers = [od.load_image_resizer() for od in self.detectors]
+      if all(image_resizer is not None for image_resizer in image_resizers):
+        self.image_resizers = image_resizers
+
+    self.feature_extractor = backend.create_feature_extractor()
+    self.decode_min_size = decode_min_size
+
+    # Results of the same image only match while the models and the way the
+    # image is fed to them stay the same
+    self.model_version = make_model_version(decode_min_size,
+                                            self.image_resizers is not None,
+                                            *[od.model_version for od in self.detectors])
+    # Set to a ResultCache to skip detection of images seen before, and to
+    # a NearDuplicateIndex to also skip it for resized or re-encoded copies
+    self.result_cache = None
+    self.duplicate_index = None
+    self.execution_mode = execution_mode
+    self.executor = None
+    if execution_mode == EXECUTION_MODE_PARALLEL:
+      # TF releases the GIL inside sess.run, so the three sessions really
+      # run side by side on a CPU-only pod
+      self.executor = ThreadPoolExecutor(max_workers=len(self.detectors))
+
+    if create_sessions:
+      self.create_sessions()
+
+  def create_sessions(self):
+    if self.execution_mode == EXECUTION_MODE_MERGED:
+      self.multi_od = MultiHeadObjectDetect(list(zip(MODEL_NAMES, self.graph_defs)))
+    else:
+      for od, od_graph_def in zip(self.detectors, self.graph_defs):
+        od.create_session(od_graph_def)
+    # The graphs have been imported, the parsed definitions aren't needed
+    self.graph_defs = None
 
   def getObjects(self, file):
     with open(file, 'rb') as fid:
       image_data = fid.read()
-    top_objects = self.top_od.detect(image_data)
-    bottom_objects = self.bottom_od.detect(image_data)
-    full_objects = self.full_od.detect(image_data)
+    return self.getObjectsFromData(image_data)
+
+  def getObjectsFromData(self, image_data):
+    objects = self.getObjectsBatch([image_data])[0]
+    if isinstance(objects, Exception):
+      raise objects
+    return objects
+
+  def getObjectsBatch(self, image_datas):
+    """Detect the objects of several encoded images at once.
+
+    Images that reach the models at the same size go through every session
+    in one batched sess.run, and the features of all their boxes are
+    extracted in one batch too. With pre_resize and fixed_shape_resizer
+    models that is every image.
+
+    Returns:
+      a list with, per image, its objects or the exception it failed with.
+    """
+    results = [None] * len(image_datas)
+    pending = []
+    for i, image_data in enumerate(image_datas):
+      try:
+        image = self.prepare_image(image_data)
+      except Exception as e:
+        results[i] = e
+        continue
+      if image['objects'] is not None:
+        results[i] = image['objects']
+      else:
+        pending.append((i, image))
+
+    # Only arrays of one shape can be stacked into a batch
+    groups = {}
+    for i, image in pending:
+      groups.setdefault(image['input'].shape, []).append((i, image))
+
+    detected = []
+    for shape, group in groups.items():
+      try:
+        images_np = np.stack([image['input'] for i, image in group])
+        objs_list = self.detect_batch(images_np, [image['image_pil'] for i, image in group])
+      except Exception as e:
+        for i, image in group:
+          results[i] = e
+        continue
+      detected.extend((i, image, objs) for (i, image), objs in zip(group, objs_list))
+
+    cropped = []
+    for i, image, objs in detected:
+      if image['draft'] and len(objs) > 0:
+        try:
+          self.crop_boxes(self.decode_full_image(image['image_data']), objs,
+                          image['scale_x'], image['scale_y'])
+        except Exception as e:
+          results[i] = e
+          continue
+      cropped.append((i, image, objs))
+    detected = cropped
+
+    try:
+      self.extract_features([obj for i, image, objs in detected for obj in objs])
+    except Exception as e:
+      for i, image, objs in detected:
+        results[i] = e
+      return results
+
+    for i, image, objs in detected:
+      objects = self.make_objects(objs, image['scale_x'], image['scale_y'])
+      if image['cache_key'] is not None:
+        self.result_cache.put(image['cache_key'], objects)
+      if image['hash'] is not None:
+        self.duplicate_index.put(image['hash'], image['original_size'], image['colors'], objects)
+      results[i] = objects
+    return results
+
+  def prepare_image(self, image_data):
+    """Decode an image and look it up in the caches.
+
+    Returns:
+      a dict with the cached 'objects' of the image if there are any, and
+      otherwise everything detection and caching its result need.
+    """
+    image = {'objects': None, 'cache_key': None, 'hash': None}
+    cached_objects = None
+    if self.result_cache is not None:
+      image['cache_key'] = self.result_cache.make_key(image_data)
+      cached_objects = self.result_cache.get(image['cache_key'])
+      if cached_objects is not None:
+        metrics.inc('result_cache_hit')
 
-    objs = []
-    objs.extend(top_objects)
-    objs.extend(bottom_objects)
-    objs.extend(full_objects)
+    # Decode once and share the array, since every detector only reads it.
+    # The PIL image all boxes are cropped from is also built only once
+    with metrics.timer('decode'):
+      image_np, original_size = image_util.decode_image(image_data, min_size=self.decode_min_size)
+      image_pil = Image.fromarray(image_np)
 
+    # Boxes come back in the (possibly draft scaled) decoded resolution
+    scale_x = float(original_size[0]) / image_np.shape[1]
+    scale_y = float(original_size[1]) / image_np.shape[0]
+    image['draft'] = image_np.shape[1] != original_size[0] or image_np.shape[0] != original_size[1]
+
+    if cached_objects is None and self.duplicate_index is not None:
+      image['hash'] = phash.dhash(image_pil)
+      image['colors'] = phash.color_signature(image_pil)
+      cached_objects = self.duplicate_index.get(image['hash'], original_size, image['colors'])
+      if cached_objects is not None:
+        metrics.inc('duplicate_index_hit')
+
+    if cached_objects is not None:
+      if image['draft']:
+        image['objects'] = self.crop_objects(self.decode_full_image(image_data), cached_objects)
+      else:
+        image['objects'] = self.crop_objects(image_pil, cached_objects)
+      return image
+
+    # The models get the resized array, while post processing crops the
+    # normalized boxes out of the full decoded image
+    with metrics.timer('resize'):
+      image['input'] = self.resize_for_models(image_pil, image_np)
+    image['image_pil'] = image_pil
+    image['image_data'] = image_data
+    image['original_size'] = original_size
+    image['scale_x'] = scale_x
+    image['scale_y'] = scale_y
+    return image
+
+  def resize_for_models(self, image_pil, image_np):
+    if self.image_resizers is None:
+      return image_np
+    size = image_util.get_model_input_size(image_pil.size, self.image_resizers)
+    return image_util.resize_image(image_pil, size)
+
+  def detect(self, image_np, image_pil):
+    return self.detect_batch(np.expand_dims(image_np, axis=0), [image_pil])[0]
+
+  def detect_batch(self, images_np, images_pil):
+    """Return the boxes of every image of a [batch, height, width, 3] array."""
+    if self.execution_mode == EXECUTION_MODE_PARALLEL:
+      return self.detect_parallel(images_np, images_pil)
+    elif self.execution_mode == EXECUTION_MODE_MERGED:
+      return self.detect_merged(images_np, images_pil)
+    else:
+      return self.detect_serial(images_np, images_pil)
+
+  def warm_up(self, sizes=WARM_UP_SIZES):
+    """Run synthetic images through every session and the feature extractor.
+
+    The first sess.run of a graph pays for graph optimization and allocator
+    growth, and the first feature request for the channel setup. Doing that
+    here keeps it out of the latency of the first real products.
+    """
+    image_pil = None
+    for width, height in sizes:
+      image_np = np.random.randint(0, 256, size=(height, width, 3)).astype(np.uint8)
+      image_pil = Image.fromarray(image_np)
+      self.detect(self.resize_for_models(image_pil, image_np), image_pil)
+
+    # Noise rarely yields boxes, so the extractor gets an image of its own
+    if image_pil is not None:
+      self.feature_extractor.extract_features([image_pil])
+
+  def post_process(self, results, images_pil):
+    # Per image, the boxes of every detector in top/bottom/full order
+    objs_list = [[] for image_pil in images_pil]
+    with metrics.timer('post_process'):
+      for od, (boxes, scores, classes, num_detections) in zip(self.detectors, results):
+        for objs, image_pil, image_boxes, image_scores, image_classes in \
+            zip(objs_list, images_pil, boxes, scores, classes):
+          objs.extend(od.post_process(image_pil, image_boxes, image_scores, image_classes))
+    return objs_list
+
+  def detect_serial(self, images_np, images_pil):
+    results = []
+    for name, od in zip(MODEL_NAMES, self.detectors):
+      with metrics.timer('run_' + name):
+        results.append(od.run_batch(images_np))
+    return self.post_process(results, images_pil)
+
+  def detect_parallel(self, images_np, images_pil):
+    futures = [self.executor.submit(metrics.timed('run_' + name, od.run_batch), images_np)
+               for name, od in zip(MODEL_NAMES, self.detectors)]
+
+    # Post processing stays on this thread, in the same top/bottom/full order
+    # as the serial path
+    return self.post_process([future.result() for future in futures], images_pil)
+
+  def detect_merged(self, images_np, images_pil):
+    with metrics.timer('run_merged'):
+      results = self.multi_od.run_batch(images_np)
+    return self.post_process(results, images_pil)
+
+  def extract_features(self, objs):
+    # One batch for the boxes of all three detectors
+    if len(objs) == 0:
+      return
+    with metrics.timer('extract_features'):
+      features = self.feature_extractor.extract_features([obj['image'] for obj in objs])
+    for obj, feature in zip(objs, features):
+      obj['feature'] = feature.tobytes()
+
+  def decode_full_image(self, image_data):
+    # Only the detectors see the draft decoded image. The crops that are
+    # featurized and uploaded are cut from the full resolution
+    with metrics.timer('decode_full'):
+      return Image.open(io.BytesIO(image_data)).convert('RGB')
+
+  def crop_boxes(self, image_pil, objs, scale_x, scale_y):
+    # Recrops the boxes of a draft decoded image from the full resolution one
+    for obj in objs:
+      left, right, top, bottom = obj['box']
+      obj['image'] = image_pil.crop((left * scale_x, top * scale_y, right * scale_x, bottom * scale_y))
+
+  def crop_objects(self, image_pil, cached_objects, scale_x=1.0, scale_y=1.0):
+    # Cached locations are in the original resolution, like make_objects'
+    objects = []
+    for cached_object in cached_objects:
+      object = dict(cached_object)
+      location = object['location']
+      object['image'] = image_pil.crop((location['left'] / scale_x,
+                                        location['top'] / scale_y,
+                                        location['right'] / scale_x,
+                                        location['bottom'] / scale_y))
+      objects.append(object)
+    return objects
+
+  def make_objects(self, objs, scale_x=1.0, scale_y=1.0):
     objects = []
     for obj in objs:
       object = {}
       location = {}
-      location['left'] = obj['box'][0]
-      location['right'] = obj['box'][1]
-      location['top'] = obj['box'][2]
-      location['bottom'] = obj['box'][3]
+      location['left'] = obj['box'][0] * scale_x
+      location['right'] = obj['box'][1] * scale_x
+      location['top'] = obj['box'][2] * scale_y
+      location['bottom'] = obj['box'][3] * scale_y
       object['class_code'] = obj.get('class_code')
       object['class_name'] = obj.get('class_name')
       object['score'] = float(obj.get('score'))
       object['feature'] = obj.get('feature')
+      object['image'] = obj.get('image')
       object['location'] = location
       objects.append(object)
 
     return objects
+
+def create_detector(rconn, create_sessions=True):
+  """ObjectDetector with the caches the OD_* and DETECT_* env vars ask for."""
+  detector = ObjectDetector(execution_mode=OD_EXECUTION_MODE,
+                            decode_min_size=OD_DECODE_MIN_SIZE,
+                            create_sessions=create_sessions,
+                            pre_resize=OD_PRE_RESIZE)
+  if DETECT_CACHE:
+    # The score threshold is applied inside the detectors, so it is part of
+    # what a cached result depends on too
+    model_version = make_model_version(detector.model_version, OD_SCORE_MIN)
+    detector.result_cache = ResultCache(model_version,
+                                        rconn=rconn if DETECT_CACHE_REDIS else None,
+                                        size=DETECT_CACHE_SIZE,
+                                        expire=DETECT_CACHE_EXPIRE)
+  if DETECT_PHASH:
+    detector.duplicate_index = phash.NearDuplicateIndex(max_distance=DETECT_PHASH_DISTANCE,
+                                                        size=DETECT_PHASH_SIZE)
+  return detector
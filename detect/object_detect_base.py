@@ -0,0 +1,173 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import numpy as np
+import os
+import tensorflow as tf
+from detect import model_cache
+import backend
+
+from util import label_map_util
+from util import config_util
+
+NUM_CLASSES = 1
+
+AWS_BUCKET = 'bluelens-style-model'
+AWS_BUCKET_FOLDER = 'object_detection'
+AWS_ACCESS_KEY = backend.get_env('AWS_ACCESS_KEY')
+AWS_SECRET_ACCESS_KEY = backend.get_env('AWS_SECRET_ACCESS_KEY')
+REDIS_SERVER = backend.get_env('REDIS_SERVER')
+REDIS_PASSWORD = backend.get_env('REDIS_PASSWORD')
+RELEASE_MODE = backend.get_env('RELEASE_MODE')
+OD_SCORE_MIN = float(backend.get_env('OD_SCORE_MIN', '0.5'))
+
+MODEL_FILE = 'frozen_inference_graph.pb'
+LABEL_MAP_FILE = 'label_map.pbtxt'
+PIPELINE_CONFIG_FILE = 'pipeline.config'
+OUTPUT_TENSORS = ['detection_boxes:0', 'detection_scores:0', 'detection_classes:0', 'num_detections:0']
+options = {
+  'REDIS_SERVER': REDIS_SERVER,
+  'REDIS_PASSWORD': REDIS_PASSWORD
+}
+models = model_cache.create(AWS_ACCESS_KEY, AWS_SECRET_ACCESS_KEY)
+
+class ObjectDetect(object):
+  """One of the top/bottom/full detection models.
+
+  Subclasses only set the MODEL_TYPE folder the model is stored under, and
+  CLASS_CODE if every box of the model gets the same class code instead of
+  the one from its label map.
+  """
+  MODEL_TYPE = None
+  CLASS_CODE = None
+
+  def __init__(self, create_session=True):
+    self.log = backend.create_log(options, 'bl-detect:' + type(self).__name__)
+    label_map_file = self.load_labelemap()
+    label_map = label_map_util.load_labelmap(label_map_file)
+    self.log.debug(label_map)
+    categories = label_map_util.convert_label_map_to_categories(label_map, max_num_classes=NUM_CLASSES,
+                                                                use_display_name=True)
+    self.__category_index = label_map_util.create_category_index(categories)
+    self.__detection_graph = None
+    self.__sess = None
+    self.model_version = None
+    # Without a session the detector only does post processing until
+    # create_session() is called, or for good when its graph is run as one
+    # head of a MultiHeadObjectDetect
+    if create_session:
+      self.create_session()
+
+    self.log.info('_init_ done')
+
+  def create_session(self, od_graph_def=None):
+    if od_graph_def is None:
+      od_graph_def = self.load_graph_def()
+    self.__detection_graph = tf.Graph()
+    with self.__detection_graph.as_default():
+      tf.import_graph_def(od_graph_def, name='')
+      self.__sess = tf.Session(graph=self.__detection_graph)
+
+  def load_graph_def(self):
+    model_file = self.load_model()
+    self.model_version = models.get_etag(model_file)
+    return model_cache.parse_from_file(tf.GraphDef(), model_file)
+
+  def get_key(self, file):
+    return os.path.join(AWS_BUCKET_FOLDER, RELEASE_MODE, self.MODEL_TYPE, file)
+
+  def load_labelemap(self):
+    self.log.info('load_labelmap')
+    key = self.get_key(LABEL_MAP_FILE)
+    print(key)
+    try:
+      return models.get(AWS_BUCKET, key)
+    except:
+      self.log.error('download error')
+      return None
+
+  def load_image_resizer(self):
+    # The exporter writes pipeline.config next to the frozen graph. Older
+    # model releases were uploaded without it, so it is optional
+    self.log.info('load_image_resizer')
+    key = self.get_key(PIPELINE_CONFIG_FILE)
+    try:
+      config_file = models.get(AWS_BUCKET, key)
+      pipeline_config = config_util.load_pipeline_config(config_file)
+    except:
+      self.log.warn('no pipeline config: ' + key)
+      return None
+    return config_util.get_image_resizer_config(pipeline_config)
+
+  def load_model(self):
+    self.log.info('load_model')
+    key = self.get_key(MODEL_FILE)
+    print(key)
+    try:
+      return models.get(AWS_BUCKET, key)
+    except:
+      self.log.error('download error')
+      return None
+
+  def run_batch(self, images_np):
+    # images_np is [batch, height, width, 3], so the images must all have
+    # the same size. Only runs the session, so it is safe to call from a
+    # worker thread
+    graph = self.__detection_graph
+    image_tensor = graph.get_tensor_by_name('image_tensor:0')
+    fetches = [graph.get_tensor_by_name(tensor) for tensor in OUTPUT_TENSORS]
+    return self.__sess.run(fetches, feed_dict={image_tensor: images_np})
+
+  def post_process(self, image_pil, boxes, scores, classes):
+    out_boxes = self.take_object(
+      image_pil,
+      np.squeeze(boxes),
+      np.squeeze(scores),
+      np.squeeze(classes).astype(np.int32))
+
+    # log.debug(out_boxes)
+    return out_boxes
+
+  def take_object(self, image_pil, boxes, scores, classes):
+    max_boxes_to_save = 3
+    boxes = boxes[:max_boxes_to_save]
+    scores = scores[:max_boxes_to_save]
+    classes = classes[:max_boxes_to_save]
+
+    keep = scores > OD_SCORE_MIN
+    pixel_boxes = self.crop_bounding_boxes(image_pil, boxes[keep])
+
+    # Every crop comes from the same PIL image, converted once by the caller
+    taken_boxes = []
+    for box, score, class_id in zip(pixel_boxes, scores[keep], classes[keep]):
+      if class_id in self.__category_index.keys():
+        class_name = self.__category_index[class_id]['name']
+        class_code = str(self.__category_index[class_id]['id'])
+      else:
+        class_name = 'na'
+        class_code = 'na'
+      left, right, top, bottom = box.tolist()
+
+      cropped_img = self.crop_image(image_pil, left, right, top, bottom)
+      item = {}
+
+      item['box'] = [left, right, top, bottom]
+      item['class_name'] = class_name
+      item['class_code'] = class_code if self.CLASS_CODE is None else self.CLASS_CODE
+      item['score'] = score
+      item['image'] = cropped_img
+      taken_boxes.append(item)
+    return taken_boxes
+
+  def crop_image(self, image, left, right, top, bottom):
+    area = (left, top, left + abs(left-right), top + abs(bottom-top))
+    return image.crop(area)
+
+  def crop_bounding_boxes(self, image, boxes, use_normalized_coordinates=True):
+    # [ymin, xmin, ymax, xmax] rows to [left, right, top, bottom] rows
+    boxes = boxes[:, [1, 3, 0, 2]]
+    if use_normalized_coordinates:
+      im_width, im_height = image.size
+      boxes = boxes * np.array([im_width, im_width, im_height, im_height])
+    return boxes
@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from PIL import Image
+
+# Read when backend and the detectors are imported
+os.environ['BACKEND'] = 'local'
+os.environ['LOCAL_LOG_LEVEL'] = 'ERROR'
+
+from detect import model_cache
+from detect import object_detect_base
+from detect.object_detect_top import TopObjectDetect
+from detect.object_detect_bottom import BottomObjectDetect
+from detect.object_detect_full import FullObjectDetect
+
+LABEL_MAP = "item {\n  id: 1\n  name: '%s'\n  display_name: '%s'\n}\n"
+
+def take_object_per_box(category_index, image_pil, boxes, scores, classes, class_code_override=None):
+  """The per-box loop take_object had before it was vectorized."""
+  taken_boxes = []
+  for i in range(min(3, boxes.shape[0])):
+    if scores[i] > object_detect_base.OD_SCORE_MIN:
+      if classes[i] in category_index.keys():
+        class_name = category_index[classes[i]]['name']
+        class_code = str(category_index[classes[i]]['id'])
+      else:
+        class_name = 'na'
+        class_code = 'na'
+      ymin, xmin, ymax, xmax = tuple(boxes[i].tolist())
+      im_width, im_height = image_pil.size
+      left, right, top, bottom = xmin * im_width, xmax * im_width, ymin * im_height, ymax * im_height
+      item = {}
+      item['box'] = [left, right, top, bottom]
+      item['class_name'] = class_name
+      item['class_code'] = class_code if class_code_override is None else class_code_override
+      item['score'] = scores[i]
+      item['image'] = image_pil.crop((left, top, left + abs(left - right), top + abs(bottom - top)))
+      taken_boxes.append(item)
+  return taken_boxes
+
+class ObjectDetectTest(unittest.TestCase):
+  def setUp(self):
+    self.model_dir = tempfile.mkdtemp()
+    for model_type in ['top', 'bottom', 'full']:
+      os.makedirs(os.path.join(self.model_dir, model_type))
+      with open(os.path.join(self.model_dir, model_type, object_detect_base.LABEL_MAP_FILE), 'w') as f:
+        f.write(LABEL_MAP % (model_type, model_type.title()))
+    self.models = object_detect_base.models
+    object_detect_base.models = model_cache.LocalModelCache(self.model_dir)
+
+    rng = np.random.RandomState(0)
+    self.image_pil = Image.fromarray(rng.randint(0, 256, (480, 640, 3)).astype(np.uint8))
+    ymin, xmin = rng.uniform(0, 0.5, 10), rng.uniform(0, 0.5, 10)
+    self.boxes = np.stack([ymin, xmin, ymin + rng.uniform(0.1, 0.5, 10), xmin + rng.uniform(0.1, 0.5, 10)],
+                          axis=1).astype(np.float32)
+    # Below, at and above the threshold within the top 3, then more boxes
+    # that are cut whatever their scores
+    self.scores = np.array([0.9, object_detect_base.OD_SCORE_MIN, 0.7, 0.99, 0.95, 0.2, 0.8, 0.6, 0.9, 0.9],
+                           dtype=np.float32)
+    self.classes = np.array([1, 1, 2, 1, 1, 1, 1, 1, 1, 1], dtype=np.int32)
+
+  def tearDown(self):
+    object_detect_base.models = self.models
+    shutil.rmtree(self.model_dir)
+
+  def assert_same_objects(self, objs, expected):
+    self.assertEqual(len(objs), len(expected))
+    for obj, expected_obj in zip(objs, expected):
+      np.testing.assert_allclose(obj['box'], expected_obj['box'], rtol=1e-6)
+      self.assertEqual(obj['class_name'], expected_obj['class_name'])
+      self.assertEqual(obj['class_code'], expected_obj['class_code'])
+      self.assertEqual(obj['score'], expected_obj['score'])
+      self.assertEqual(obj['image'].size, expected_obj['image'].size)
+      self.assertEqual(obj['image'].tobytes(), expected_obj['image'].tobytes())
+
+  def check_detector(self, od, class_code_override):
+    objs = od.take_object(self.image_pil, self.boxes, self.scores, self.classes)
+    expected = take_object_per_box(od._ObjectDetect__category_index, self.image_pil,
+                                   self.boxes, self.scores, self.classes, class_code_override)
+    self.assert_same_objects(objs, expected)
+    return objs
+
+  def test_top(self):
+    objs = self.check_detector(TopObjectDetect(create_session=False), None)
+    # Only the first and third box are within the top 3 and above the threshold
+    self.assertEqual([obj['class_name'] for obj in objs], ['top', 'na'])
+    self.assertEqual([obj['class_code'] for obj in objs], ['1', 'na'])
+    np.testing.assert_allclose(objs[0]['box'], [self.boxes[0, 1] * 640, self.boxes[0, 3] * 640,
+                                                self.boxes[0, 0] * 480, self.boxes[0, 2] * 480], rtol=1e-6)
+
+  def test_bottom(self):
+    objs = self.check_detector(BottomObjectDetect(create_session=False), '2')
+    self.assertEqual([obj['class_code'] for obj in objs], ['2', '2'])
+    self.assertEqual(objs[0]['class_name'], 'bottom')
+
+  def test_full(self):
+    objs = self.check_detector(FullObjectDetect(create_session=False), '3')
+    self.assertEqual([obj['class_code'] for obj in objs], ['3', '3'])
+
+  def test_post_process_takes_batch_rows(self):
+    od = TopObjectDetect(create_session=False)
+    objs = od.post_process(self.image_pil, self.boxes[np.newaxis], self.scores[np.newaxis],
+                           self.classes[np.newaxis].astype(np.float32))
+    expected = take_object_per_box(od._ObjectDetect__category_index, self.image_pil,
+                                   self.boxes, self.scores, self.classes)
+    self.assert_same_objects(objs, expected)
+
+  def test_no_boxes(self):
+    od = TopObjectDetect(create_session=False)
+    self.assertEqual(od.take_object(self.image_pil, np.zeros((0, 4), np.float32),
+                                    np.zeros(0, np.float32), np.zeros(0, np.int32)), [])
+
+  def test_model_type_key(self):
+    od = BottomObjectDetect(create_session=False)
+    self.assertEqual(od.get_key('x.pb').split('/')[-2:], ['bottom', 'x.pb'])
+
+if __name__ == '__main__':
+  unittest.main()
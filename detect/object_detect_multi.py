@@ -0,0 +1,59 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import tensorflow as tf
+import backend
+
+REDIS_SERVER = backend.get_env('REDIS_SERVER')
+REDIS_PASSWORD = backend.get_env('REDIS_PASSWORD')
+
+IMAGE_TENSOR = 'image_tensor:0'
+OUTPUT_TENSORS = ['detection_boxes:0',
+                  'detection_scores:0',
+                  'detection_classes:0',
+                  'num_detections:0']
+
+options = {
+  'REDIS_SERVER': REDIS_SERVER,
+  'REDIS_PASSWORD': REDIS_PASSWORD
+}
+log = backend.create_log(options, 'bl-detect:MultiHeadObjectDetect')
+
+class MultiHeadObjectDetect(object):
+  def __init__(self, heads):
+    """Import several frozen detection graphs into a single graph.
+
+    Args:
+      heads: list of (name, GraphDef) tuples. Each graph is imported under
+        its own name scope and all of them are fed by one shared
+        image_tensor placeholder.
+    """
+    self.__names = [name for name, _ in heads]
+    self.__detection_graph = tf.Graph()
+    self.__fetches = []
+    with self.__detection_graph.as_default():
+      self.__image_tensor = tf.placeholder(tf.uint8, shape=[None, None, None, 3], name='image_tensor')
+      for name, od_graph_def in heads:
+        tf.import_graph_def(od_graph_def,
+                            input_map={IMAGE_TENSOR: self.__image_tensor},
+                            name=name)
+        self.__fetches.append(
+          [self.__detection_graph.get_tensor_by_name(name + '/' + tensor) for tensor in OUTPUT_TENSORS])
+
+      self.__sess = tf.Session(graph=self.__detection_graph)
+
+    log.info('_init_ done: ' + str(self.__names))
+
+  def run_batch(self, images_np):
+    """Run every head on a [batch, height, width, 3] array of same sized images.
+
+    All heads run in a single sess.run call.
+
+    Returns:
+      list of (boxes, scores, classes, num_detections) tuples, in the order
+      the heads were given.
+    """
+    results = self.__sess.run(self.__fetches,
+                              feed_dict={self.__image_tensor: images_np})
+    return [tuple(result) for result in results]
@@ -19,7 +19,7 @@ DESCRIPTOR = _descriptor.FileDescriptor(
   name='object_detect.proto',
   package='objectdetect',
   syntax='proto3',
-  serialized_pb=_b('\n\x13object_detect.proto\x12\x0cobjectdetect\"D\n\x08Location\x12\x0c\n\x04left\x18\x01 \x01(\x02\x12\r\n\x05right\x18\x02 \x01(\x02\x12\x0b\n\x03top\x18\x03 \x01(\x02\x12\x0e\n\x06\x62ottom\x18\x04 \x01(\x02\"\"\n\rDetectRequest\x12\x11\n\tfile_data\x18\x01 \x01(\x0c\"\x7f\n\x0b\x44\x65tectReply\x12(\n\x08location\x18\x01 \x01(\x0b\x32\x16.objectdetect.Location\x12\x12\n\nclass_name\x18\x02 \x01(\t\x12\x12\n\nclass_code\x18\x03 \x01(\t\x12\r\n\x05score\x18\x04 \x01(\x02\x12\x0f\n\x07\x66\x65\x61ture\x18\x05 \x01(\x0c\x32R\n\x06\x44\x65tect\x12H\n\nGetObjects\x12\x1b.objectdetect.DetectRequest\x1a\x19.objectdetect.DetectReply\"\x00\x30\x01\x42\x31\n\x13io.stylelens.detectB\x11ObjectDetectProtoP\x01\xa2\x02\x04STYLb\x06proto3')
+  serialized_pb=_b('\n\x13object_detect.proto\x12\x0cobjectdetect\"D\n\x08Location\x12\x0c\n\x04left\x18\x01 \x01(\x02\x12\r\n\x05right\x18\x02 \x01(\x02\x12\x0b\n\x03top\x18\x03 \x01(\x02\x12\x0e\n\x06\x62ottom\x18\x04 \x01(\x02\"\"\n\rDetectRequest\x12\x11\n\tfile_data\x18\x01 \x01(\x0c\"\x7f\n\x0b\x44\x65tectReply\x12(\n\x08location\x18\x01 \x01(\x0b\x32\x16.objectdetect.Location\x12\x12\n\nclass_name\x18\x02 \x01(\t\x12\x12\n\nclass_code\x18\x03 \x01(\t\x12\r\n\x05score\x18\x04 \x01(\x02\x12\x0f\n\x07\x66\x65\x61ture\x18\x05 \x01(\x0c\"<\n\x13TaggedDetectRequest\x12\x12\n\nrequest_id\x18\x01 \x01(\t\x12\x11\n\tfile_data\x18\x02 \x01(\x0c\"I\n\x12\x44\x65tectBatchRequest\x12\x33\n\x08requests\x18\x01 \x03(\x0b\x32!.objectdetect.TaggedDetectRequest\"n\n\x11TaggedDetectReply\x12\x12\n\nrequest_id\x18\x01 \x01(\t\x12(\n\x05reply\x18\x02 \x01(\x0b\x32\x19.objectdetect.DetectReply\x12\x0c\n\x04\x64one\x18\x03 \x01(\x08\x12\r\n\x05\x65rror\x18\x04 \x01(\t2\x82\x02\n\x06\x44\x65tect\x12H\n\nGetObjects\x12\x1b.objectdetect.DetectRequest\x1a\x19.objectdetect.DetectReply\"\x00\x30\x01\x12X\n\x0c\x44\x65tectStream\x12!.objectdetect.TaggedDetectRequest\x1a\x1f.objectdetect.TaggedDetectReply\"\x00(\x01\x30\x01\x12T\n\x0b\x44\x65tectBatch\x12 .objectdetect.DetectBatchRequest\x1a\x1f.objectdetect.TaggedDetectReply\"\x00\x30\x01\x42\x31\n\x13io.stylelens.detectB\x11ObjectDetectProtoP\x01\xa2\x02\x04STYLb\x06proto3')
 )
 
 
@@ -166,10 +166,136 @@ _DETECTREPLY = _descriptor.Descriptor(
   serialized_end=270,
 )
 
+
+_TAGGEDDETECTREQUEST = _descriptor.Descriptor(
+  name='TaggedDetectRequest',
+  full_name='objectdetect.TaggedDetectRequest',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='request_id', full_name='objectdetect.TaggedDetectRequest.request_id', index=0,
+      number=1, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b("").decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='file_data', full_name='objectdetect.TaggedDetectRequest.file_data', index=1,
+      number=2, type=12, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b(""),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=272,
+  serialized_end=332,
+)
+
+
+_DETECTBATCHREQUEST = _descriptor.Descriptor(
+  name='DetectBatchRequest',
+  full_name='objectdetect.DetectBatchRequest',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='requests', full_name='objectdetect.DetectBatchRequest.requests', index=0,
+      number=1, type=11, cpp_type=10, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=334,
+  serialized_end=407,
+)
+
+
+_TAGGEDDETECTREPLY = _descriptor.Descriptor(
+  name='TaggedDetectReply',
+  full_name='objectdetect.TaggedDetectReply',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='request_id', full_name='objectdetect.TaggedDetectReply.request_id', index=0,
+      number=1, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b("").decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='reply', full_name='objectdetect.TaggedDetectReply.reply', index=1,
+      number=2, type=11, cpp_type=10, label=1,
+      has_default_value=False, default_value=None,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='done', full_name='objectdetect.TaggedDetectReply.done', index=2,
+      number=3, type=8, cpp_type=7, label=1,
+      has_default_value=False, default_value=False,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='error', full_name='objectdetect.TaggedDetectReply.error', index=3,
+      number=4, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b("").decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=409,
+  serialized_end=519,
+)
+
 _DETECTREPLY.fields_by_name['location'].message_type = _LOCATION
+_DETECTBATCHREQUEST.fields_by_name['requests'].message_type = _TAGGEDDETECTREQUEST
+_TAGGEDDETECTREPLY.fields_by_name['reply'].message_type = _DETECTREPLY
 DESCRIPTOR.message_types_by_name['Location'] = _LOCATION
 DESCRIPTOR.message_types_by_name['DetectRequest'] = _DETECTREQUEST
 DESCRIPTOR.message_types_by_name['DetectReply'] = _DETECTREPLY
+DESCRIPTOR.message_types_by_name['TaggedDetectRequest'] = _TAGGEDDETECTREQUEST
+DESCRIPTOR.message_types_by_name['DetectBatchRequest'] = _DETECTBATCHREQUEST
+DESCRIPTOR.message_types_by_name['TaggedDetectReply'] = _TAGGEDDETECTREPLY
 _sym_db.RegisterFileDescriptor(DESCRIPTOR)
 
 Location = _reflection.GeneratedProtocolMessageType('Location', (_message.Message,), dict(
@@ -193,6 +319,27 @@ DetectReply = _reflection.GeneratedProtocolMessageType('DetectReply', (_message.
   ))
 _sym_db.RegisterMessage(DetectReply)
 
+TaggedDetectRequest = _reflection.GeneratedProtocolMessageType('TaggedDetectRequest', (_message.Message,), dict(
+  DESCRIPTOR = _TAGGEDDETECTREQUEST,
+  __module__ = 'object_detect_pb2'
+  # @@protoc_insertion_point(class_scope:objectdetect.TaggedDetectRequest)
+  ))
+_sym_db.RegisterMessage(TaggedDetectRequest)
+
+DetectBatchRequest = _reflection.GeneratedProtocolMessageType('DetectBatchRequest', (_message.Message,), dict(
+  DESCRIPTOR = _DETECTBATCHREQUEST,
+  __module__ = 'object_detect_pb2'
+  # @@protoc_insertion_point(class_scope:objectdetect.DetectBatchRequest)
+  ))
+_sym_db.RegisterMessage(DetectBatchRequest)
+
+TaggedDetectReply = _reflection.GeneratedProtocolMessageType('TaggedDetectReply', (_message.Message,), dict(
+  DESCRIPTOR = _TAGGEDDETECTREPLY,
+  __module__ = 'object_detect_pb2'
+  # @@protoc_insertion_point(class_scope:objectdetect.TaggedDetectReply)
+  ))
+_sym_db.RegisterMessage(TaggedDetectReply)
+
 
 DESCRIPTOR.has_options = True
 DESCRIPTOR._options = _descriptor._ParseOptions(descriptor_pb2.FileOptions(), _b('\n\023io.stylelens.detectB\021ObjectDetectProtoP\001\242\002\004STYL'))
@@ -203,8 +350,8 @@ _DETECT = _descriptor.ServiceDescriptor(
   file=DESCRIPTOR,
   index=0,
   options=None,
-  serialized_start=272,
-  serialized_end=354,
+  serialized_start=522,
+  serialized_end=780,
   methods=[
   _descriptor.MethodDescriptor(
     name='GetObjects',
@@ -215,6 +362,24 @@ _DETECT = _descriptor.ServiceDescriptor(
     output_type=_DETECTREPLY,
     options=None,
   ),
+  _descriptor.MethodDescriptor(
+    name='DetectStream',
+    full_name='objectdetect.Detect.DetectStream',
+    index=1,
+    containing_service=None,
+    input_type=_TAGGEDDETECTREQUEST,
+    output_type=_TAGGEDDETECTREPLY,
+    options=None,
+  ),
+  _descriptor.MethodDescriptor(
+    name='DetectBatch',
+    full_name='objectdetect.Detect.DetectBatch',
+    index=2,
+    containing_service=None,
+    input_type=_DETECTBATCHREQUEST,
+    output_type=_TAGGEDDETECTREPLY,
+    options=None,
+  ),
 ])
 _sym_db.RegisterServiceDescriptor(_DETECT)
 
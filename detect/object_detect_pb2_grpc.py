@@ -19,6 +19,16 @@ class DetectStub(object):
         request_serializer=object__detect__pb2.DetectRequest.SerializeToString,
         response_deserializer=object__detect__pb2.DetectReply.FromString,
         )
+    self.DetectStream = channel.stream_stream(
+        '/objectdetect.Detect/DetectStream',
+        request_serializer=object__detect__pb2.TaggedDetectRequest.SerializeToString,
+        response_deserializer=object__detect__pb2.TaggedDetectReply.FromString,
+        )
+    self.DetectBatch = channel.unary_stream(
+        '/objectdetect.Detect/DetectBatch',
+        request_serializer=object__detect__pb2.DetectBatchRequest.SerializeToString,
+        response_deserializer=object__detect__pb2.TaggedDetectReply.FromString,
+        )
 
 
 class DetectServicer(object):
@@ -32,6 +42,20 @@ class DetectServicer(object):
     context.set_details('Method not implemented!')
     raise NotImplementedError('Method not implemented!')
 
+  def DetectStream(self, request_iterator, context):
+    """Many images over one call, replies are tagged with their request_id
+    """
+    context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+    context.set_details('Method not implemented!')
+    raise NotImplementedError('Method not implemented!')
+
+  def DetectBatch(self, request, context):
+    # missing associated documentation comment in .proto file
+    pass
+    context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+    context.set_details('Method not implemented!')
+    raise NotImplementedError('Method not implemented!')
+
 
 def add_DetectServicer_to_server(servicer, server):
   rpc_method_handlers = {
@@ -40,6 +64,16 @@ def add_DetectServicer_to_server(servicer, server):
           request_deserializer=object__detect__pb2.DetectRequest.FromString,
           response_serializer=object__detect__pb2.DetectReply.SerializeToString,
       ),
+      'DetectStream': grpc.stream_stream_rpc_method_handler(
+          servicer.DetectStream,
+          request_deserializer=object__detect__pb2.TaggedDetectRequest.FromString,
+          response_serializer=object__detect__pb2.TaggedDetectReply.SerializeToString,
+      ),
+      'DetectBatch': grpc.unary_stream_rpc_method_handler(
+          servicer.DetectBatch,
+          request_deserializer=object__detect__pb2.DetectBatchRequest.FromString,
+          response_serializer=object__detect__pb2.TaggedDetectReply.SerializeToString,
+      ),
   }
   generic_handler = grpc.method_handlers_generic_handler(
       'objectdetect.Detect', rpc_method_handlers)
@@ -0,0 +1,120 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from PIL import Image
+from object_detection.protos import image_resizer_pb2
+
+# Read when backend and the detectors are imported
+os.environ['BACKEND'] = 'local'
+os.environ['LOCAL_LOG_LEVEL'] = 'ERROR'
+
+from detect import model_cache
+from detect import object_detect
+from detect import object_detect_base
+
+LABEL_MAP = "item {\n  id: 1\n  name: 'object'\n}\n"
+# A serialized GraphDef with only versions { producer: 1 } set
+GRAPH_DEF = b'\x22\x02\x08\x01'
+
+def encode(size, format):
+  width, height = size
+  image = Image.fromarray(np.random.RandomState(width).randint(0, 256, (height, width, 3)).astype(np.uint8))
+  buf = io.BytesIO()
+  image.save(buf, format=format)
+  return buf.getvalue()
+
+class FakeDetectBatch(object):
+  """Finds one box per image, covering the middle of its left half."""
+  def __init__(self):
+    self.shapes = []
+
+  def __call__(self, images_np, images_pil):
+    self.shapes.append(images_np.shape)
+    objs_list = []
+    for image_pil in images_pil:
+      width, height = image_pil.size
+      left, right, top, bottom = width * 0.25, width * 0.5, height * 0.25, height * 0.75
+      objs_list.append([{'box': [left, right, top, bottom],
+                         'class_name': 'object',
+                         'class_code': '1',
+                         'score': 0.9,
+                         'image': image_pil.crop((left, top, right, bottom))}])
+    return objs_list
+
+class GetObjectsBatchTest(unittest.TestCase):
+  def setUp(self):
+    self.model_dir = tempfile.mkdtemp()
+    for model_type in object_detect.MODEL_NAMES:
+      os.makedirs(os.path.join(self.model_dir, model_type))
+      with open(os.path.join(self.model_dir, model_type, object_detect_base.LABEL_MAP_FILE), 'w') as f:
+        f.write(LABEL_MAP)
+      # Sessions aren't created, the graphs are only parsed
+      with open(os.path.join(self.model_dir, model_type, object_detect_base.MODEL_FILE), 'wb') as f:
+        f.write(GRAPH_DEF)
+    self.models = object_detect_base.models
+    object_detect_base.models = model_cache.LocalModelCache(self.model_dir)
+    self.detect_batch = FakeDetectBatch()
+
+  def tearDown(self):
+    object_detect_base.models = self.models
+    shutil.rmtree(self.model_dir)
+
+  def create_detector(self, **kwargs):
+    detector = object_detect.ObjectDetector(create_sessions=False, **kwargs)
+    detector.detect_batch = self.detect_batch
+    return detector
+
+  def assert_location(self, obj, size):
+    width, height = size
+    self.assertAlmostEqual(obj['location']['left'], width * 0.25, delta=0.01)
+    self.assertAlmostEqual(obj['location']['right'], width * 0.5, delta=0.01)
+    self.assertAlmostEqual(obj['location']['top'], height * 0.25, delta=0.01)
+    self.assertAlmostEqual(obj['location']['bottom'], height * 0.75, delta=0.01)
+
+  def test_images_are_grouped_by_shape(self):
+    sizes = [(64, 48), (32, 24), (64, 48), (48, 64)]
+    detector = self.create_detector()
+    results = detector.getObjectsBatch([encode(size, 'PNG') for size in sizes])
+    self.assertEqual(sorted(self.detect_batch.shapes), [(1, 24, 32, 3), (1, 64, 48, 3), (2, 48, 64, 3)])
+    for objects, size in zip(results, sizes):
+      self.assertEqual(len(objects), 1)
+      self.assert_location(objects[0], size)
+      self.assertIn('feature', objects[0])
+
+  def test_failed_image_only_fails_itself(self):
+    detector = self.create_detector()
+    results = detector.getObjectsBatch([encode((64, 48), 'PNG'), b'not an image', encode((64, 48), 'PNG')])
+    self.assertIsInstance(results[1], Exception)
+    self.assertEqual(len(results[0]), 1)
+    self.assertEqual(len(results[2]), 1)
+    self.assertEqual(self.detect_batch.shapes, [(2, 48, 64, 3)])
+
+  def test_draft_boxes_map_back_to_the_original_resolution(self):
+    detector = self.create_detector(decode_min_size=300)
+    objects, = detector.getObjectsBatch([encode((1600, 1200), 'JPEG')])
+    # The models see the draft, a quarter of the size
+    self.assertEqual(self.detect_batch.shapes, [(1, 300, 400, 3)])
+    self.assertEqual(len(objects), 1)
+    self.assert_location(objects[0], (1600, 1200))
+    # and the crop is cut from the full decode
+    self.assertEqual(objects[0]['image'].size, (400, 600))
+
+  def test_pre_resized_images_share_a_batch(self):
+    image_resizer = image_resizer_pb2.ImageResizer()
+    image_resizer.fixed_shape_resizer.width = 30
+    image_resizer.fixed_shape_resizer.height = 20
+    detector = self.create_detector()
+    detector.image_resizers = [image_resizer]
+    sizes = [(64, 48), (32, 24), (48, 64)]
+    results = detector.getObjectsBatch([encode(size, 'PNG') for size in sizes])
+    self.assertEqual(self.detect_batch.shapes, [(3, 20, 30, 3)])
+    # Boxes are taken from the decoded image, so they are still in its size
+    for objects, size in zip(results, sizes):
+      self.assert_location(objects[0], size)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,133 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import binascii
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+PHASH_MAX_DISTANCE = 4
+PHASH_INDEX_SIZE = 10000
+# Copies of one photo keep their aspect ratio, crops and paddings don't
+PHASH_MAX_ASPECT_DIFF = 0.02
+# dHash only sees brightness, so colour variants of one product photo hash
+# alike. Copies keep the mean colour of every cell of a coarse grid within a
+# few levels, a product in another colour doesn't
+PHASH_COLOR_GRID = 4
+PHASH_MAX_COLOR_DIFF = 12
+
+def dhash(image, hash_size=8):
+  """Return the difference hash of a PIL image as a hash_size**2 bit int.
+
+  Every bit tells whether a pixel of the grayscale thumbnail is brighter
+  than its left neighbour, which survives resizing and re-encoding.
+  """
+  small = image.convert('L').resize((hash_size + 1, hash_size), Image.ANTIALIAS)
+  pixels = np.asarray(small, dtype=np.int16)
+  bits = pixels[:, 1:] > pixels[:, :-1]
+  return int(binascii.hexlify(np.packbits(bits).tobytes()), 16)
+
+def color_signature(image, grid=PHASH_COLOR_GRID):
+  """Return the mean RGB of every cell of a grid x grid split of a PIL image."""
+  small = image.convert('RGB').resize((grid, grid), Image.BOX)
+  return np.asarray(small, dtype=np.int16)
+
+def hamming_distance(a, b):
+  return bin(a ^ b).count('1')
+
+class BKTree(object):
+  """Burkhard-Keller tree of int hashes under the Hamming distance."""
+  def __init__(self):
+    self.root = None
+
+  def add(self, h):
+    if self.root is None:
+      self.root = (h, {})
+      return
+    node = self.root
+    while True:
+      value, children = node
+      distance = hamming_distance(h, value)
+      if distance == 0:
+        return
+      child = children.get(distance)
+      if child is None:
+        children[distance] = (h, {})
+        return
+      node = child
+
+  def find(self, h, max_distance):
+    """Return (distance, hash) of every stored hash within max_distance."""
+    found = []
+    if self.root is None:
+      return found
+    nodes = [self.root]
+    while nodes:
+      value, children = nodes.pop()
+      distance = hamming_distance(h, value)
+      if distance <= max_distance:
+        found.append((distance, value))
+      # Only subtrees within max_distance of distance can hold a match
+      for d in range(distance - max_distance, distance + max_distance + 1):
+        child = children.get(d)
+        if child is not None:
+          nodes.append(child)
+    return found
+
+class NearDuplicateIndex(object):
+  """Detection results of images kept by perceptual hash.
+
+  Locations are stored relative to the image size, so the result of one copy
+  of a photo can be scaled onto another copy at a different resolution. A
+  hash only matches if the aspect ratio and color_signature match too. The
+  BK-tree can't drop entries, so once size entries are stored it is rebuilt
+  from the newer half of them.
+  """
+  def __init__(self, max_distance=PHASH_MAX_DISTANCE, size=PHASH_INDEX_SIZE):
+    self.max_distance = max_distance
+    self.__size = size
+    self.__results = OrderedDict()
+    self.__tree = BKTree()
+    self.__lock = threading.Lock()
+
+  def get(self, h, image_size, colors):
+    """Return the objects of the nearest copy, located on image_size, or None."""
+    width, height = image_size
+    aspect = float(width) / height
+    with self.__lock:
+      candidates = sorted(self.__tree.find(h, self.max_distance))
+      for distance, value in candidates:
+        entry = self.__results.get(value)
+        if entry is None or abs(entry[0] - aspect) > PHASH_MAX_ASPECT_DIFF:
+          continue
+        if np.abs(entry[1] - colors).max() > PHASH_MAX_COLOR_DIFF:
+          continue
+        return [self.scale_object(obj, width, height) for obj in entry[2]]
+    return None
+
+  def put(self, h, image_size, colors, objects):
+    width, height = image_size
+    aspect = float(width) / height
+    normalized = [self.scale_object(obj, 1.0 / width, 1.0 / height) for obj in objects]
+    with self.__lock:
+      self.__results.pop(h, None)
+      self.__results[h] = (aspect, colors, normalized)
+      self.__tree.add(h)
+      if len(self.__results) > self.__size:
+        while len(self.__results) > self.__size // 2:
+          self.__results.popitem(last=False)
+        self.__tree = BKTree()
+        for value in self.__results:
+          self.__tree.add(value)
+
+  def scale_object(self, obj, scale_x, scale_y):
+    object = dict((k, v) for k, v in obj.items() if k != 'image')
+    location = obj['location']
+    object['location'] = {'left': location['left'] * scale_x,
+                          'right': location['right'] * scale_x,
+                          'top': location['top'] * scale_y,
+                          'bottom': location['bottom'] * scale_y}
+    return object
@@ -0,0 +1,115 @@
+import io
+import random
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from detect import phash
+
+def make_photo(color=(200, 30, 30), size=(300, 400)):
+  width, height = size
+  pixels = np.full((height, width, 3), 240, dtype=np.uint8)
+  pixels[height // 4:height * 3 // 4, width // 4:width * 3 // 4] = color
+  pixels[height * 3 // 8:height * 5 // 8, width // 3:width * 2 // 3] = [c // 2 for c in color]
+  return Image.fromarray(pixels)
+
+def reencode(image, size):
+  buf = io.BytesIO()
+  image.resize(size, Image.BILINEAR).save(buf, format='JPEG', quality=70)
+  return Image.open(io.BytesIO(buf.getvalue())).convert('RGB')
+
+def make_object(left, right, top, bottom):
+  return {'class_code': '1',
+          'score': 0.9,
+          'feature': b'\x00' * 8,
+          'location': {'left': left, 'right': right, 'top': top, 'bottom': bottom}}
+
+class BKTreeTest(unittest.TestCase):
+  def test_find_matches_brute_force(self):
+    rng = random.Random(0)
+    hashes = [rng.getrandbits(64) for i in range(500)]
+    tree = phash.BKTree()
+    for h in hashes:
+      tree.add(h)
+    for i in range(50):
+      # Queries near stored hashes and far from all of them
+      query = hashes[i] ^ (1 << rng.randrange(64)) if i % 2 else rng.getrandbits(64)
+      for max_distance in [0, 4, 16]:
+        expected = sorted((phash.hamming_distance(query, h), h) for h in hashes
+                          if phash.hamming_distance(query, h) <= max_distance)
+        self.assertEqual(sorted(tree.find(query, max_distance)), expected)
+
+  def test_duplicates_are_stored_once(self):
+    tree = phash.BKTree()
+    tree.add(5)
+    tree.add(5)
+    self.assertEqual(tree.find(5, 0), [(0, 5)])
+
+  def test_empty(self):
+    self.assertEqual(phash.BKTree().find(0, 64), [])
+
+class DhashTest(unittest.TestCase):
+  def test_survives_resizing_and_reencoding(self):
+    image = make_photo()
+    copy = reencode(image, (150, 200))
+    self.assertLessEqual(phash.hamming_distance(phash.dhash(image), phash.dhash(copy)),
+                         phash.PHASH_MAX_DISTANCE)
+
+  def test_hash_size(self):
+    self.assertLess(phash.dhash(make_photo()), 1 << 64)
+    self.assertLess(phash.dhash(make_photo(), hash_size=4), 1 << 16)
+
+class NearDuplicateIndexTest(unittest.TestCase):
+  def setUp(self):
+    self.index = phash.NearDuplicateIndex()
+    self.image = make_photo()
+    self.index.put(phash.dhash(self.image), self.image.size, phash.color_signature(self.image),
+                   [make_object(75, 225, 100, 300)])
+
+  def get(self, image):
+    return self.index.get(phash.dhash(image), image.size, phash.color_signature(image))
+
+  def test_copy_is_scaled(self):
+    objects = self.get(reencode(self.image, (150, 200)))
+    self.assertEqual(len(objects), 1)
+    location = objects[0]['location']
+    self.assertAlmostEqual(location['left'], 37.5)
+    self.assertAlmostEqual(location['right'], 112.5)
+    self.assertAlmostEqual(location['top'], 50)
+    self.assertAlmostEqual(location['bottom'], 150)
+    self.assertEqual(objects[0]['feature'], b'\x00' * 8)
+
+  def test_other_aspect_ratio_misses(self):
+    self.assertIsNone(self.get(self.image.resize((300, 300), Image.BILINEAR)))
+
+  def test_colour_variant_misses(self):
+    variant = make_photo(color=(30, 30, 200))
+    # Only the colour differs, which dHash barely sees
+    self.assertLessEqual(phash.hamming_distance(phash.dhash(self.image), phash.dhash(variant)),
+                         phash.PHASH_MAX_DISTANCE)
+    self.assertIsNone(self.get(variant))
+
+  def test_other_image_misses(self):
+    other = Image.fromarray(np.random.RandomState(0).randint(0, 256, (400, 300, 3)).astype(np.uint8))
+    self.assertIsNone(self.get(other))
+
+  def test_images_are_not_stored(self):
+    objects = [make_object(0, 10, 0, 10)]
+    objects[0]['image'] = self.image
+    index = phash.NearDuplicateIndex()
+    index.put(1, (100, 100), phash.color_signature(self.image), objects)
+    self.assertNotIn('image', index.get(1, (100, 100), phash.color_signature(self.image))[0])
+
+  def test_rebuild_keeps_newer_half(self):
+    colors = phash.color_signature(self.image)
+    index = phash.NearDuplicateIndex(max_distance=0, size=4)
+    for h in range(5):
+      index.put(h << 8, (100, 100), colors, [make_object(h, h, h, h)])
+    for h in range(3):
+      self.assertIsNone(index.get(h << 8, (100, 100), colors))
+    for h in range(3, 5):
+      self.assertEqual(index.get(h << 8, (100, 100), colors)[0]['location']['left'], h)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,78 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+from util import payload
+
+RESULT_CACHE_SIZE = 1024
+RESULT_CACHE_EXPIRE = 60*60*24*30
+RESULT_CACHE_PREFIX = 'bl:object:detect:result:'
+
+def make_model_version(*parts):
+  """Fold everything detection results depend on into one short version."""
+  h = hashlib.sha1()
+  for part in parts:
+    h.update(str(part).encode('utf-8'))
+    h.update(b'|')
+  return h.hexdigest()[:16]
+
+class ResultCache(object):
+  """Detection results keyed by image content hash and model version.
+
+  Results are kept in a local LRU and, if a Redis connection is given, in
+  Redis too with an expiry, so pods share what any of them has detected.
+  Only boxes, classes, scores and features are stored; the crops are cut
+  from the image again on a hit, which is cheap next to inference.
+  """
+  def __init__(self, model_version, rconn=None, size=RESULT_CACHE_SIZE, expire=RESULT_CACHE_EXPIRE):
+    self.model_version = model_version
+    self.__rconn = rconn
+    self.__size = size
+    self.__expire = expire
+    self.__results = OrderedDict()
+    self.__lock = threading.Lock()
+
+  def make_key(self, image_data):
+    return RESULT_CACHE_PREFIX + self.model_version + ':' + hashlib.sha1(image_data).hexdigest()
+
+  def get(self, key):
+    with self.__lock:
+      objects = self.__results.pop(key, None)
+      if objects is not None:
+        self.__results[key] = objects
+        return objects
+
+    if self.__rconn is None:
+      return None
+    # The cache is only a shortcut, a failing Redis means detecting again
+    try:
+      value = self.__rconn.get(key)
+      if value is None:
+        return None
+      objects = payload.loads_message(value)
+    except Exception:
+      return None
+    self.put_local(key, objects)
+    return objects
+
+  def put(self, key, objects):
+    objects = [dict((k, v) for k, v in obj.items() if k != 'image') for obj in objects]
+    self.put_local(key, objects)
+    if self.__rconn is not None:
+      try:
+        self.__rconn.setex(key, self.__expire, payload.dumps_message(objects))
+      except Exception:
+        pass
+
+  def put_local(self, key, objects):
+    if self.__size <= 0:
+      return
+    with self.__lock:
+      self.__results.pop(key, None)
+      self.__results[key] = objects
+      while len(self.__results) > self.__size:
+        self.__results.popitem(last=False)
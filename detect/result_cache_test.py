@@ -0,0 +1,106 @@
+import hashlib
+import unittest
+
+from detect import result_cache
+from detect.result_cache import ResultCache, make_model_version
+
+IMAGE = b'\xff\xd8 image \xff\xd9'
+
+def make_objects():
+  return [{'class_code': '1',
+           'score': 0.9,
+           'feature': b'\x01\x02\x03\x04',
+           'location': {'left': 1, 'right': 2, 'top': 3, 'bottom': 4},
+           'image': object()}]
+
+class FakeRedis(object):
+  def __init__(self):
+    self.values = {}
+
+  def get(self, name):
+    return self.values.get(name)
+
+  def setex(self, name, time, value):
+    self.values[name] = value
+
+class BrokenRedis(object):
+  def get(self, name):
+    raise IOError('connection refused')
+
+  def setex(self, name, time, value):
+    raise IOError('connection refused')
+
+class ModelVersionTest(unittest.TestCase):
+  def test_depends_on_every_part(self):
+    version = make_model_version('graph', 300, 0.5)
+    self.assertEqual(make_model_version('graph', 300, 0.5), version)
+    self.assertNotEqual(make_model_version('other', 300, 0.5), version)
+    self.assertNotEqual(make_model_version('graph', 0, 0.5), version)
+    self.assertNotEqual(make_model_version('graph', 300, 0.3), version)
+
+  def test_parts_are_separated(self):
+    self.assertNotEqual(make_model_version('ab', 'c'), make_model_version('a', 'bc'))
+
+class ResultCacheTest(unittest.TestCase):
+  def test_key_depends_on_model_version_and_content(self):
+    cache = ResultCache('v1')
+    key = cache.make_key(IMAGE)
+    self.assertEqual(key, result_cache.RESULT_CACHE_PREFIX + 'v1:' + hashlib.sha1(IMAGE).hexdigest())
+    self.assertEqual(cache.make_key(IMAGE), key)
+    self.assertNotEqual(cache.make_key(IMAGE + b'\x00'), key)
+    self.assertNotEqual(ResultCache('v2').make_key(IMAGE), key)
+
+  def test_put_get_drops_images(self):
+    cache = ResultCache('v1')
+    key = cache.make_key(IMAGE)
+    self.assertIsNone(cache.get(key))
+    cache.put(key, make_objects())
+    objects = cache.get(key)
+    self.assertEqual(len(objects), 1)
+    self.assertNotIn('image', objects[0])
+    self.assertEqual(objects[0]['location'], {'left': 1, 'right': 2, 'top': 3, 'bottom': 4})
+
+  def test_evicts_least_recently_used(self):
+    cache = ResultCache('v1', size=2)
+    cache.put('a', [])
+    cache.put('b', [])
+    # Reading 'a' makes 'b' the oldest
+    self.assertEqual(cache.get('a'), [])
+    cache.put('c', [])
+    self.assertEqual(cache.get('a'), [])
+    self.assertIsNone(cache.get('b'))
+    self.assertEqual(cache.get('c'), [])
+
+  def test_shared_through_redis(self):
+    rconn = FakeRedis()
+    key = ResultCache('v1').make_key(IMAGE)
+    ResultCache('v1', rconn=rconn).put(key, make_objects())
+
+    # Another pod has nothing locally, even with the local cache turned off
+    objects = ResultCache('v1', rconn=rconn, size=0).get(key)
+    self.assertEqual(len(objects), 1)
+    self.assertEqual(objects[0]['class_code'], '1')
+    self.assertAlmostEqual(objects[0]['score'], 0.9)
+    self.assertEqual(objects[0]['feature'], b'\x01\x02\x03\x04')
+    self.assertNotIn('image', objects[0])
+
+    # A new model version never sees results of the old one
+    cache = ResultCache('v2', rconn=rconn)
+    self.assertIsNone(cache.get(cache.make_key(IMAGE)))
+
+  def test_redis_failures_are_misses(self):
+    cache = ResultCache('v1', rconn=BrokenRedis())
+    key = cache.make_key(IMAGE)
+    self.assertIsNone(cache.get(key))
+    cache.put(key, make_objects())
+    self.assertEqual(len(cache.get(key)), 1)
+
+  def test_unreadable_redis_value_is_a_miss(self):
+    rconn = FakeRedis()
+    cache = ResultCache('v1', rconn=rconn)
+    key = cache.make_key(IMAGE)
+    rconn.setex(key, 60, b'garbage')
+    self.assertIsNone(cache.get(key))
+
+if __name__ == '__main__':
+  unittest.main()
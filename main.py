@@ -1,24 +1,32 @@
 from __future__ import print_function
 
 import os
+import signal
 from threading import Timer
 
 from PIL import Image
+import io
 import time
 import uuid
-import urllib.request
 from collections import Counter
-import pickle
+from concurrent import futures
 from bluelens_spawning_pool import spawning_pool
-from detect.object_detect import ObjectDetector
-from stylelens_product.products import Products
-from stylelens_object.objects import Objects
-from stylelens_object.features import Features
-from stylelens_image.images import Images
-from stylelens_s3 import s3
-import redis
-
-from bluelens_log import Logging
+from detect.object_detect import create_detector
+from detect.micro_batcher import BATCH_SIZE
+from worker.image_fetcher import FETCH_CACHE_SIZE
+from worker.http_cache import HttpCache
+from worker.http_cache import HTTP_CACHE_DIR
+from worker.http_cache import HTTP_CACHE_SIZE
+from worker.bulk_writer import BulkWriter
+from worker.product_index import ProductIndex
+from worker.product_index import PRODUCT_INDEX_EXPIRE
+from worker.pipeline import Pipeline
+from worker.pipeline import Stage
+import shutil
+from bson.objectid import ObjectId
+from util import payload
+from util import metrics
+import backend
 
 AWS_OBJ_IMAGE_BUCKET = 'bluelens-style-object'
 AWS_MOBILE_IMAGE_BUCKET = 'bluelens-style-mainimage'
@@ -27,17 +35,46 @@ OBJECT_IMAGE_WIDTH = 380
 OBJECT_IMAGE_HEITH = 380
 HEALTH_CHECK_TIME = 60*20
 
-SPAWN_ID = os.environ['SPAWN_ID']
-REDIS_SERVER = os.environ['REDIS_SERVER']
-REDIS_PASSWORD = os.environ['REDIS_PASSWORD']
-RELEASE_MODE = os.environ['RELEASE_MODE']
-AWS_ACCESS_KEY = os.environ['AWS_ACCESS_KEY'].replace('"', '')
-AWS_SECRET_ACCESS_KEY = os.environ['AWS_SECRET_ACCESS_KEY'].replace('"', '')
-FEATURE_GRPC_HOST = os.environ['FEATURE_GRPC_HOST']
-FEATURE_GRPC_PORT = os.environ['FEATURE_GRPC_PORT']
-OD_SCORE_MIN = os.environ['OD_SCORE_MIN']
-
-MAX_PROCESS_NUM = int(os.environ['MAX_PROCESS_NUM'])
+SPAWN_ID = backend.get_env('SPAWN_ID', 'local')
+REDIS_SERVER = backend.get_env('REDIS_SERVER')
+REDIS_PASSWORD = backend.get_env('REDIS_PASSWORD')
+RELEASE_MODE = backend.get_env('RELEASE_MODE', 'dev')
+AWS_ACCESS_KEY = backend.get_env('AWS_ACCESS_KEY').replace('"', '')
+AWS_SECRET_ACCESS_KEY = backend.get_env('AWS_SECRET_ACCESS_KEY').replace('"', '')
+FEATURE_GRPC_HOST = backend.get_env('FEATURE_GRPC_HOST')
+FEATURE_GRPC_PORT = backend.get_env('FEATURE_GRPC_PORT')
+
+MAX_PROCESS_NUM = int(backend.get_env('MAX_PROCESS_NUM', '0'))
+PRODUCT_BATCH_SIZE = int(os.environ.get('PRODUCT_BATCH_SIZE', 1))
+PRODUCT_BATCH_LINGER = float(os.environ.get('PRODUCT_BATCH_LINGER', 0.2))
+PRODUCT_BATCH_POLL = 0.02
+FETCH_TIMEOUT = float(os.environ.get('FETCH_TIMEOUT', 10))
+FETCH_RETRIES = int(os.environ.get('FETCH_RETRIES', 2))
+FETCH_POOL_SIZE = int(os.environ.get('FETCH_POOL_SIZE', 8))
+UPLOAD_POOL_SIZE = int(os.environ.get('UPLOAD_POOL_SIZE', 8))
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 9102))
+METRICS_DIR = os.environ.get('METRICS_DIR', '/tmp/bl-object-classifier-metrics')
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 0.01))
+PRODUCT_INDEX = os.environ.get('PRODUCT_INDEX', 'true') == 'true'
+PRODUCT_INDEX_TTL = int(os.environ.get('PRODUCT_INDEX_TTL', PRODUCT_INDEX_EXPIRE))
+# Formats other services read; switch once they read the binary ones
+QUEUE_PAYLOAD_FORMAT = os.environ.get('QUEUE_PAYLOAD_FORMAT', payload.FORMAT_PICKLE)
+FEATURE_VECTOR_FORMAT = os.environ.get('FEATURE_VECTOR_FORMAT', payload.VECTOR_FLOAT32)
+FETCH_HTTP_CACHE = os.environ.get('FETCH_HTTP_CACHE', 'true') == 'true'
+FETCH_HTTP_CACHE_DIR = os.environ.get('FETCH_HTTP_CACHE_DIR', HTTP_CACHE_DIR)
+FETCH_HTTP_CACHE_SIZE = int(os.environ.get('FETCH_HTTP_CACHE_SIZE', HTTP_CACHE_SIZE))
+WORKER_MODE = os.environ.get('WORKER_MODE', 'serial')
+WORKER_PROCESSES = int(os.environ.get('WORKER_PROCESSES', 1))
+OD_WARM_UP = os.environ.get('OD_WARM_UP', 'true') == 'true'
+READINESS_FILE = os.environ.get('READINESS_FILE', '/tmp/bl-object-classifier.ready')
+PIPELINE_QUEUE_SIZE = int(os.environ.get('PIPELINE_QUEUE_SIZE', 16))
+PIPELINE_DETECT_BATCH_SIZE = int(os.environ.get('PIPELINE_DETECT_BATCH_SIZE', BATCH_SIZE))
+PIPELINE_DETECT_LINGER = float(os.environ.get('PIPELINE_DETECT_LINGER', 0))
+PIPELINE_FETCH_WORKERS = int(os.environ.get('PIPELINE_FETCH_WORKERS', FETCH_POOL_SIZE))
+PIPELINE_CROP_WORKERS = int(os.environ.get('PIPELINE_CROP_WORKERS', 2))
+PIPELINE_UPLOAD_WORKERS = int(os.environ.get('PIPELINE_UPLOAD_WORKERS', UPLOAD_POOL_SIZE))
+
+WORKER_MODE_PIPELINE = 'pipeline'
 
 REDIS_PRODUCT_CLASSIFY_QUEUE = 'bl_product_classify_queue'
 REDIS_PRODUCT_CLASSIFY_TEXT_QUEUE = 'bl:product:classify:text:queue'
@@ -51,81 +88,218 @@ options = {
   'REDIS_SERVER': REDIS_SERVER,
   'REDIS_PASSWORD': REDIS_PASSWORD
 }
-log = Logging(options, tag='bl-object-classifier')
-rconn = redis.StrictRedis(REDIS_SERVER, decode_responses=False, port=6379, password=REDIS_PASSWORD)
-
-storage = s3.S3(AWS_ACCESS_KEY, AWS_SECRET_ACCESS_KEY)
+log = backend.create_log(options, 'bl-object-classifier')
+rconn = backend.create_redis(REDIS_SERVER, REDIS_PASSWORD)
+
+def create_uploader():
+  return backend.create_uploader(AWS_ACCESS_KEY, AWS_SECRET_ACCESS_KEY, UPLOAD_POOL_SIZE)
+
+def create_fetcher():
+  http_cache = None
+  if FETCH_HTTP_CACHE:
+    http_cache = HttpCache(FETCH_HTTP_CACHE_DIR, max_entries=FETCH_HTTP_CACHE_SIZE)
+  return backend.create_fetcher(timeout=FETCH_TIMEOUT,
+                                retries=FETCH_RETRIES,
+                                pool_size=FETCH_POOL_SIZE,
+                                cache_size=max(FETCH_CACHE_SIZE, PRODUCT_BATCH_SIZE * 2, PIPELINE_QUEUE_SIZE * 6),
+                                http_cache=http_cache)
+
+uploader = create_uploader()
+fetcher = create_fetcher()
+product_index = ProductIndex(rconn, expire=PRODUCT_INDEX_TTL) if PRODUCT_INDEX else None
+# Per item log lines go to Redis too, so only a sample of them is logged
+log_sampled = metrics.Sampler(LOG_SAMPLE_RATE)
 
 heart_bit = True
+ready = False
 
-product_api = Products()
-object_api = Objects()
-feature_api = Features()
-image_api = Images()
+product_api, object_api, feature_api, image_api = backend.create_apis()
 version_id = None
 obj_detector = None
 
 def analyze_product(p_data):
   # log.info('analyze_product')
-  product = pickle.loads(p_data)
-
   try:
-    main_class_code, main_objects = analyze_main_image(product)
+    product = payload.loads(p_data)
   except Exception as e:
-    log.error('analyze_product:main_image' + str(e))
+    log.error('analyze_product:loads' + str(e))
     return
-
-  #Todo Need to uncomment when we can analyze sub images
-  # try:
-  #   sub_class_code, sub_objects = analyze_sub_images(product['sub_images_mobile'])
-  # except Exception as e:
-  #   log.error('analyze_product:sub_image' + str(e))
-  #   image_id, obj_ids = save_image_to_db(product, main_class_code, main_objects)
-  #   update_image_id_to_object_db(obj_ids, image_id)
-  #   save_main_image_as_object(product, image_id)
-  #   set_product_is_classified(product)
-  #   return
-  # save_objects = []
-  # for obj in sub_objects:
-  #   if obj['class_code'] == main_class_code:
-  #     save_objects.append(obj)
-
-  image_id, obj_ids = save_image_to_db(product, main_class_code, main_objects)
-  if image_id is None:
-    set_product_is_classified(product)
+  if is_product_done(product):
     return
+  # main_image is only needed after detection, so it downloads meanwhile
+  fetcher.prefetch(get_image_urls(product))
+
+  try:
+    try:
+      main_class_code, main_objects = analyze_main_image(product)
+    except Exception as e:
+      log.error('analyze_product:main_image' + str(e))
+      return
 
-  update_image_id_to_object_db(obj_ids, image_id)
-  save_main_image_as_object(product, image_id)
+    save_products([(product, main_class_code, main_objects)])
+  finally:
+    fetcher.release(get_image_urls(product))
 
-  #Todo Need to uncomment when we can analyze sub images
-  # if len(save_objects) > 0:
-  #   save_objects_to_db(str(product['_id']), image_id, main_class_code, save_objects)
+def analyze_products(values):
+  # log.info('analyze_products')
+  products = []
+  for value in values:
+    try:
+      products.append(payload.loads(value))
+    except Exception as e:
+      log.error('analyze_products:loads' + str(e))
+  products = filter_products_not_done(products)
 
-  set_product_is_classified(product)
+  # Images of the whole batch download in the background while the first
+  # products are already in detection
+  for product in products:
+    fetcher.prefetch(get_image_urls(product))
 
-  data = {}
-  data['product_id'] = str(product['_id'])
-  data['image_id'] = image_id
-  data['product_name'] = product.get('name')
-  data['category'] = product.get('cate')
-  data['tags'] = product.get('tags')
-  push_image_to_queue(data)
+  # Run detection for the whole batch at once, then persist the results of
+  # all products together
+  try:
+    analyzed = analyze_main_images(products)
+  except Exception as e:
+    log.error('analyze_products:main_image' + str(e))
+    analyzed = []
+
+  try:
+    save_products(analyzed)
+  except Exception as e:
+    log.error('analyze_products:save_products' + str(e))
+
+  for product in products:
+    fetcher.release(get_image_urls(product))
+
+def is_product_done(product):
+  if product_index is None:
+    return False
+  return product_index.is_done(version_id, str(product['_id']))
+
+def filter_products_not_done(products):
+  if product_index is None:
+    return products
+  done = product_index.filter_done(version_id, [str(product['_id']) for product in products])
+  return [product for product in products if str(product['_id']) not in done]
+
+def mark_products_done(products):
+  if product_index is None or len(products) == 0:
+    return
+  try:
+    product_index.mark_done(version_id, [str(product['_id']) for product in products])
+  except Exception as e:
+    log.warn('mark_products_done: ' + str(e))
+
+def get_image_urls(product):
+  return [product.get('main_image_mobile_full'), product.get('main_image')]
+
+def save_products(analyzed):
+  # log.info('save_products')
+  #Todo Need to save sub image objects too when we can analyze sub images
+  # (see analyze_sub_images)
+  image_writer = BulkWriter(image_api.images)
+  object_writer = BulkWriter(object_api.objects)
+  feature_writer = BulkWriter(feature_api.features)
+  product_writer = BulkWriter(product_api.products)
+
+  # Ids are generated here rather than by the upserts, so objects and their
+  # image can point at each other without a second update pass
+  staged = []
+  for product, class_code, objects in analyzed:
+    upload_objects(objects)
+    object_ids = [ObjectId() for obj in objects]
+    image_id = ObjectId()
+    image = make_image(product, class_code, [str(id) for id in object_ids])
+    query = {'host_code': image['host_code'],
+             'product_no': image['product_no'],
+             'version_id': image['version_id']}
+    image_writer.update(query, image, insert_id=image_id)
+    staged.append((product, objects, object_ids, str(image_id)))
+
+  # Products only count as done once everything of theirs was written
+  persisted = True
+  try:
+    with metrics.timer('db_add_image'):
+      upserted = image_writer.flush()
+  except Exception as e:
+    log.warn("Exception when calling add_image: %s\n" % e)
+    upserted = {}
+    persisted = False
+  if len(image_writer.write_errors) > 0:
+    log.warn("Exception when calling add_image: %s\n" % image_writer.write_errors)
+  # Images and products are written one per product, in staged order
+  failed = set(error.get('index') for error in image_writer.write_errors)
+
+  # Only new images get a main object and go on to the text classifier
+  main_objects = {}
+  for i, (product, objects, object_ids, image_id) in enumerate(staged):
+    if i in upserted:
+      main_object = make_main_object(product, image_id)
+      if main_object is not None:
+        main_objects[i] = (main_object, upload_to_storage(main_object))
+
+  product_updates = []
+  for i, (product, objects, object_ids, image_id) in enumerate(staged):
+    for obj, object_id in zip(objects, object_ids):
+      set_storage_url(obj, obj.pop('upload'))
+      make_object(obj, product)
+      if i in upserted:
+        obj['image_id'] = image_id
+      feature = obj.pop('feature')
+      object_writer.update({'name': obj['name']}, obj, insert_id=object_id)
+      feature_writer.update({'object_id': str(object_id)}, make_feature(str(object_id), feature))
+
+    if i in main_objects:
+      main_object, upload = main_objects[i]
+      set_storage_url(main_object, upload)
+      object_writer.update({'name': main_object['name']}, main_object, insert_id=ObjectId())
+
+    # A product whose image wasn't written is left unclassified for a retry
+    if persisted and i not in failed:
+      p = {}
+      p['is_classified'] = True
+      p['is_available'] = True
+      product_updates.append(i)
+      product_writer.update({'_id': ObjectId(str(product['_id']))}, p, upsert=False)
+
+  for name, writer in [('add_object', object_writer),
+                       ('add_feature', feature_writer),
+                       ('update_product', product_writer)]:
+    try:
+      with metrics.timer('db_' + name):
+        writer.flush()
+    except Exception as e:
+      log.warn("Exception when calling %s: %s\n" % (name, e))
+      persisted = False
+    if len(writer.write_errors) > 0:
+      log.warn("Exception when calling %s: %s\n" % (name, writer.write_errors))
+      if writer is not product_writer:
+        persisted = False
+
+  if persisted:
+    failed.update(product_updates[error.get('index')] for error in product_writer.write_errors)
+    mark_products_done([product for i, (product, objects, object_ids, image_id) in enumerate(staged)
+                        if i not in failed])
+
+  datas = []
+  for i, (product, objects, object_ids, image_id) in enumerate(staged):
+    if i in upserted:
+      data = {}
+      data['product_id'] = str(product['_id'])
+      data['image_id'] = image_id
+      data['product_name'] = product.get('name')
+      data['category'] = product.get('cate')
+      data['tags'] = product.get('tags')
+      datas.append(data)
+  with metrics.timer('queue_push'):
+    push_images_to_queue(datas)
+  metrics.inc('products', len(staged))
   # color = analyze_color(p_dict)
 
 def get_latest_crawl_version():
   value = rconn.hget(REDIS_CRAWL_VERSION, REDIS_CRAWL_VERSION_LATEST)
   return value.decode('utf-8')
 
-def set_product_is_classified(product):
-  try:
-    p = {}
-    p['is_classified'] = True
-    p['is_available'] = True
-    product_api.update_product_by_id(str(product['_id']), p)
-  except Exception as e:
-    log.error(str(e))
-
 def set_product_is_unavailable(product):
   try:
     p = {}
@@ -135,71 +309,31 @@ def set_product_is_unavailable(product):
   except Exception as e:
     log.error(str(e))
 
-def save_objects_to_db(product_id, image_id, class_code, objects):
+def make_feature(object_id, feature):
   global version_id
 
-  for obj in objects:
-    object = {}
-    object['image_id'] = image_id
-    object['product_id'] = product_id
-    object['storage'] = 's3'
-    object['bucket'] = AWS_OBJ_IMAGE_BUCKET
-    object['is_main'] = False
-    object['class_code'] = class_code
-    object['name'] = obj['name']
-    object['version_id'] = version_id
-    # object['feature'] = obj['feature']
-
-    save_to_storage(object)
-
-    object_id = save_object_to_db(object)
-    save_feature_to_db(object_id, obj['feature'], version_id)
-    # push_object_to_queue(object)
-  # obj_img.show()
-
-def save_feature_to_db(object_id, feature, version_id):
   data = {}
-
   data['object_id'] = object_id
-  data['vector'] = feature
+  data['vector'] = payload.encode_vector(feature, FEATURE_VECTOR_FORMAT)
+  # Readers decode by this, a float32 blob can look like a headed one
+  data['vector_format'] = FEATURE_VECTOR_FORMAT
   data['version_id'] = version_id
-  try:
-    feature_id = feature_api.add_feature(data)
-    if feature_id is not None:
-      return feature_id
-    else:
-      return None
-  except Exception as e:
-    log.warn("Exception when calling save_feature_to_db: %s\n" % e)
+  return data
 
-def update_image_id_to_object_db(object_ids, image_id):
-  # log.info('update_image_id_to_object_db')
-  try:
-    for id in object_ids:
-      obj = {}
-      obj['image_id'] = image_id
-      object_api.update_object_by_id(id, obj)
-  except Exception as e:
-    log.warn("Exception when calling update_object_by_id: %s\n" % e)
-
-def save_image_to_db(product, class_code, objects):
-  # log.info('save_image_to_db')
+def make_object(obj, product):
   global version_id
 
-  object_ids = []
-  for obj in objects:
-    save_to_storage(obj)
-    obj['product_id'] = str(product['_id'])
-    obj['version_id'] = version_id
-    obj['host_code'] = product['host_code']
-    obj['host_group'] = product['host_group']
-    obj['storage'] = 's3'
-    obj['is_main'] = False
-    obj['bucket'] = AWS_OBJ_IMAGE_BUCKET
-    feature = obj.pop('feature')
-    object_id = save_object_to_db(obj)
-    object_ids.append(object_id)
-    save_feature_to_db(object_id, feature, version_id)
+  obj['product_id'] = str(product['_id'])
+  obj['version_id'] = version_id
+  obj['host_code'] = product['host_code']
+  obj['host_group'] = product['host_group']
+  obj['storage'] = 's3'
+  obj['is_main'] = False
+  obj['bucket'] = AWS_OBJ_IMAGE_BUCKET
+  return obj
+
+def make_image(product, class_code, object_ids):
+  global version_id
 
   image = {}
   image['product_id'] = str(product['_id'])
@@ -225,18 +359,7 @@ def save_image_to_db(product, class_code, objects):
   # image['color_code'] = ''
   # image['sex_code'] = ''
   # image['age_code'] = ''
-
-  try:
-    api_response = image_api.add_image(image)
-    if api_response is not None:
-      if 'upserted' in api_response:
-        image_id = str(api_response['upserted'])
-        return image_id, object_ids
-    # log.debug(api_response)
-  except Exception as e:
-    log.warn("Exception when calling add_image: %s\n" % e)
-
-  return None, None
+  return image
 
 def analyze_color(product):
   # log.debug('analyze_color')
@@ -264,6 +387,34 @@ def analyze_main_image(product):
     log.error('analyze_main_image2: ' + str(e))
     return
 
+  return select_main_class(objects), objects
+
+def analyze_main_images(products):
+  # log.info('analyze_main_images')
+  start_time = time.time()
+  fetched = []
+  for product in products:
+    try:
+      fetched.append((product, fetcher.fetch(product['main_image_mobile_full'])))
+    except Exception as e:
+      log.error('object_detect fetch: ' + str(e))
+
+  analyzed = []
+  objects_list = detect_objects_batch([image_data for product, image_data in fetched],
+                                      [product for product, image_data in fetched])
+  for (product, image_data), objects in zip(fetched, objects_list):
+    if objects is None:
+      continue
+    try:
+      class_code, detected_objects = make_detected_objects(objects)
+    except Exception as e:
+      log.error('analyze_main_images: ' + str(e))
+      continue
+    analyzed.append((product, select_main_class(detected_objects), detected_objects))
+  metrics.observe('object_detect_batch', time.time() - start_time)
+  return analyzed
+
+def select_main_class(objects):
   final_class = None
   score = 0.0
   if len(objects) > 0:
@@ -271,8 +422,7 @@ def analyze_main_image(product):
       if obj['score'] > score:
         score = obj['score']
         final_class = obj['class_code']
-
-  return final_class, objects
+  return final_class
 
 def analyze_sub_images(images):
   # log.info('analyze_sub_images')
@@ -317,55 +467,76 @@ def object_detect(image_path, product):
   start_time = time.time()
   #log.info(image_path)
   try:
-    f = urllib.request.urlopen(image_path)
+    image_data = fetcher.fetch(image_path)
   except Exception as e:
-    log.error('object_detect urlopen: ' + str(e))
+    log.error('object_detect fetch: ' + str(e))
     return
-  im = Image.open(f).convert('RGB')
-  tmp_img = 'tmp.jpg'
-  im.save(tmp_img)
 
-  classes = []
-  detected_objects = []
-  global obj_detector
-  try:
-    objects = obj_detector.getObjects(tmp_img)
-    for obj in objects:
-      #log.info(obj.class_name + ':' + str(obj.score))
-      location = obj.get('location')
-
-      left =   location.get('left')
-      right =  location.get('right')
-      top =    location.get('top')
-      bottom = location.get('bottom')
-      area = (left, top, left + abs(left-right), top + abs(bottom-top))
-      obj_img = im.crop(area)
-      size = OBJECT_IMAGE_WIDTH, OBJECT_IMAGE_HEITH
-      obj_img.thumbnail(size, Image.ANTIALIAS)
-
-      id = str(uuid.uuid4())
-      tmp_obj_img = id + '.jpg'
-      obj_img.save(tmp_obj_img)
-      classes.append(obj.get('class_code'))
-      image_obj = {}
-      image_obj['class_code'] = obj.get('class_code')
-      image_obj['name'] = id
-      image_obj['score'] = obj.get('score')
-      image_obj['feature'] = obj.get('feature')
-      box = {}
-      box['left'] = left
-      box['right'] = right
-      box['top'] = top
-      box['bottom'] = bottom
-      image_obj['box'] = box
-      detected_objects.append(image_obj)
+  objects = detect_objects(image_data, product)
+  if objects is None:
+    return
 
+  final_class, detected_objects = make_detected_objects(objects)
+  elapsed_time = time.time() - start_time
+  metrics.observe('object_detect', elapsed_time)
+  if log_sampled():
+    log.info('total object_detection time: ' + str(elapsed_time))
+  return final_class, detected_objects
+
+def detect_objects(image_data, product):
+  return detect_objects_batch([image_data], [product])[0]
+
+def detect_objects_batch(image_datas, products):
+  # Per product, its objects or None if detection failed for it
+  if len(image_datas) == 0:
+    return []
+  try:
+    results = obj_detector.getObjectsBatch(image_datas)
   except Exception as e:
-    log.error('object_detect:' + str(e))
-    if 'StatusCode.UNKNOWN' in str(e):
-      # delete_product_from_db(str(product['_id']))
-      set_product_is_unavailable(product)
-    return
+    results = [e] * len(image_datas)
+
+  objects_list = []
+  for product, objects in zip(products, results):
+    if isinstance(objects, Exception):
+      log.error('object_detect:' + str(objects))
+      if 'StatusCode.UNKNOWN' in str(objects):
+        # delete_product_from_db(str(product['_id']))
+        set_product_is_unavailable(product)
+      objects = None
+    objects_list.append(objects)
+  return objects_list
+
+def make_detected_objects(objects):
+  classes = []
+  detected_objects = []
+  for obj in objects:
+    #log.info(obj.class_name + ':' + str(obj.score))
+    location = obj.get('location')
+
+    left =   location.get('left')
+    right =  location.get('right')
+    top =    location.get('top')
+    bottom = location.get('bottom')
+    # The detector hands back the crop it used for the feature vector
+    obj_img = obj.get('image')
+    size = OBJECT_IMAGE_WIDTH, OBJECT_IMAGE_HEITH
+    obj_img.thumbnail(size, Image.ANTIALIAS)
+
+    id = str(uuid.uuid4())
+    classes.append(obj.get('class_code'))
+    image_obj = {}
+    image_obj['class_code'] = obj.get('class_code')
+    image_obj['name'] = id
+    image_obj['score'] = obj.get('score')
+    image_obj['feature'] = obj.get('feature')
+    image_obj['image_data'] = encode_jpeg(obj_img)
+    box = {}
+    box['left'] = left
+    box['right'] = right
+    box['top'] = top
+    box['bottom'] = bottom
+    image_obj['box'] = box
+    detected_objects.append(image_obj)
 
   final_class = None
 
@@ -378,8 +549,6 @@ def object_detect(image_path, product):
       #log.debug('Decided class_code:' + final_class)
     except Exception as e:
       log.warn(str(e))
-  elapsed_time = time.time() - start_time
-  log.info('total object_detection time: ' + str(elapsed_time))
   return final_class, detected_objects
 
 def delete_product_from_db(product_id):
@@ -389,15 +558,15 @@ def delete_product_from_db(product_id):
   except Exception as e:
     log.error(str(e))
 
-def save_main_image_as_object(product, image_id):
-  # log.info('save_main_image_as_object')
+def make_main_object(product, image_id):
+  # log.info('make_main_object')
   global version_id
   try:
-    f = urllib.request.urlopen(product['main_image'])
+    image_data = fetcher.fetch(product['main_image'])
   except Exception as e:
     log.error(str(e))
     return
-  im = Image.open(f).convert('RGB')
+  im = Image.open(io.BytesIO(image_data)).convert('RGB')
   size = OBJECT_IMAGE_WIDTH, OBJECT_IMAGE_HEITH
   im.thumbnail(size, Image.ANTIALIAS)
 
@@ -413,23 +582,18 @@ def save_main_image_as_object(product, image_id):
   object['version_id'] = version_id
   id = str(uuid.uuid4())
   object['name'] = id
-  im.save(id + '.jpg')
-  save_to_storage(object)
-  save_object_to_db(object)
+  object['image_data'] = encode_jpeg(im)
+  return object
   # push_object_to_queue(object)
 
-def push_image_to_queue(data):
-  # log.info('push_image_to_queue')
-  rconn.lpush(REDIS_PRODUCT_CLASSIFY_TEXT_QUEUE, pickle.dumps(data))
-
-def save_object_to_db(obj):
-  # log.info('save_object_to_db')
-  try:
-    object_id = object_api.add_object(obj)
-    # log.debug(object_id)
-  except Exception as e:
-    log.warn("Exception when calling add_object: %s\n" % e)
-  return object_id
+def push_images_to_queue(datas):
+  # log.info('push_images_to_queue')
+  if len(datas) == 0:
+    return
+  pipe = rconn.pipeline(transaction=False)
+  for data in datas:
+    pipe.lpush(REDIS_PRODUCT_CLASSIFY_TEXT_QUEUE, payload.dumps(data, QUEUE_PAYLOAD_FORMAT, payload.SCHEMA_IMAGE))
+  pipe.execute()
 
 def check_health():
   global  heart_bit
@@ -442,6 +606,9 @@ def check_health():
 
 def delete_pod():
   log.info('exit: ' + SPAWN_ID)
+  if backend.is_local():
+    # No pod to delete, the process just exits
+    return
 
   data = {}
   data['namespace'] = RELEASE_MODE
@@ -452,33 +619,255 @@ def delete_pod():
   spawn.setServerPassword(REDIS_PASSWORD)
   spawn.delete(data)
 
-def save_to_storage(obj):
-  # log.debug('save_to_storage')
+def encode_jpeg(im):
+  buf = io.BytesIO()
+  im.save(buf, format='JPEG')
+  return buf.getvalue()
+
+def upload_to_storage(obj):
+  # log.debug('upload_to_storage')
+  file = obj['name'] + '.jpg'
+  key = os.path.join(RELEASE_MODE, obj['class_code'], file)
+  is_public = True
+  return uploader.upload(AWS_OBJ_IMAGE_BUCKET, key, obj.pop('image_data'), is_public=is_public)
+
+def upload_objects(objects):
+  # Starts the uploads that haven't been started by an earlier stage
+  for obj in objects:
+    if 'upload' not in obj:
+      obj['upload'] = upload_to_storage(obj)
+
+def set_storage_url(obj, upload):
+  try:
+    obj['image_url'] = upload.result()
+  except Exception as e:
+    log.error('set_storage_url: ' + str(e))
+
+def drain_products(rconn, size):
+  # LRANGE + LTRIM run in one MULTI/EXEC so the taken products are removed
+  # from the queue atomically, in a single round trip
+  pipe = rconn.pipeline()
+  pipe.lrange(REDIS_PRODUCT_CLASSIFY_QUEUE, 0, size - 1)
+  pipe.ltrim(REDIS_PRODUCT_CLASSIFY_QUEUE, size, -1)
+  values, _ = pipe.execute()
+  return values
+
+def pop_products(rconn, size):
+  # Block until at least one product arrives, then linger briefly to fill
+  # up the batch with whatever else gets queued
+  with metrics.timer('queue_wait'):
+    key, value = rconn.blpop([REDIS_PRODUCT_CLASSIFY_QUEUE])
+  values = [value]
+  deadline = time.time() + PRODUCT_BATCH_LINGER
+  while len(values) < size:
+    values.extend(drain_products(rconn, size - len(values)))
+    if len(values) >= size or time.time() >= deadline:
+      break
+    time.sleep(PRODUCT_BATCH_POLL)
+  return values
+
+def fetch_stage(value):
+  global heart_bit
+  # Every product taken on counts, including the ones that are skipped or
+  # fail later on; the fetch workers only stall when the pipeline does
+  heart_bit = True
+  product = payload.loads(value)
+  if is_product_done(product):
+    return
+  fetcher.prefetch(get_image_urls(product))
   try:
-    file = obj['name'] + '.jpg'
-    key = os.path.join(RELEASE_MODE, obj['class_code'], file)
-    is_public = True
-    path = storage.upload_file_to_bucket(AWS_OBJ_IMAGE_BUCKET, file, key, is_public=is_public)
-    obj['image_url'] = path
+    image_data = fetcher.fetch(product['main_image_mobile_full'])
   except Exception as e:
-    log.error('save_to_storage: ' + str(e))
+    log.error('object_detect fetch: ' + str(e))
+    fetcher.release(get_image_urls(product))
+    return
+  return product, image_data
+
+def detect_stage(items):
+  # Whatever was fetched while the previous batch ran goes through the
+  # detector as one batch
+  products = [product for product, image_data in items]
+  objects_list = detect_objects_batch([image_data for product, image_data in items], products)
+  detected = []
+  for product, objects in zip(products, objects_list):
+    if objects is None:
+      fetcher.release(get_image_urls(product))
+      detected.append(None)
+    else:
+      detected.append((product, objects))
+  return detected
+
+def crop_stage(item):
+  product, objects = item
+  class_code, detected_objects = make_detected_objects(objects)
+  return product, select_main_class(detected_objects), detected_objects
+
+def upload_stage(item):
+  product, class_code, objects = item
+  upload_objects(objects)
+  # Wait here so the persist stage only ever sees landed uploads; failures
+  # are logged there by set_storage_url
+  futures.wait([obj['upload'] for obj in objects])
+  return item
+
+def persist_stage(items):
+  try:
+    save_products(items)
+  finally:
+    for product, class_code, objects in items:
+      fetcher.release(get_image_urls(product))
+
+def report_pipeline_error(stage, e):
+  log.error('pipeline:' + stage + ': ' + str(e))
+
+def start_pipeline(rconn):
+  # Network bound stages get several threads; detection stays on a single
+  # thread that owns the sessions
+  stages = [Stage('fetch', fetch_stage, workers=PIPELINE_FETCH_WORKERS),
+            Stage('detect', detect_stage, workers=1,
+                  batch_size=PIPELINE_DETECT_BATCH_SIZE, linger=PIPELINE_DETECT_LINGER),
+            Stage('crop', crop_stage, workers=PIPELINE_CROP_WORKERS),
+            Stage('upload', upload_stage, workers=PIPELINE_UPLOAD_WORKERS),
+            Stage('persist', persist_stage, workers=1,
+                  batch_size=PRODUCT_BATCH_SIZE, linger=PRODUCT_BATCH_LINGER)]
+  pipeline = Pipeline(stages, queue_size=PIPELINE_QUEUE_SIZE, on_error=report_pipeline_error)
+  pipeline.start()
 
-  # log.debug('save_to_storage done')
+  while True:
+    with metrics.timer('queue_wait'):
+      key, value = rconn.blpop([REDIS_PRODUCT_CLASSIFY_QUEUE])
+    if value is not None:
+      # Blocks while the pipeline is full, so no more products are taken off
+      # the queue than the pod can work on
+      pipeline.put(value)
+
+def warm_up():
+  if not OD_WARM_UP:
+    return
+  start_time = time.time()
+  try:
+    obj_detector.warm_up()
+  except Exception as e:
+    log.warn('warm_up: ' + str(e))
+  log.info('warm_up time: ' + str(time.time() - start_time))
+
+def clear_ready():
+  if os.path.exists(READINESS_FILE):
+    os.remove(READINESS_FILE)
+
+def set_ready():
+  # Readiness probes check for this file
+  global ready
+  ready = True
+  with open(READINESS_FILE, 'w') as f:
+    f.write(str(os.getpid()))
+  log.info('ready')
+
+def init_worker_process():
+  # MongoClient and boto3 clients must not be shared across a fork, so
+  # every worker process opens its own
+  global product_api, object_api, feature_api, image_api
+  global uploader, fetcher
+  product_api, object_api, feature_api, image_api = backend.create_apis()
+  uploader = create_uploader()
+  fetcher = create_fetcher()
+  obj_detector.create_sessions()
+  # What the parent recorded before the fork is reported by the parent
+  metrics.REGISTRY.reset()
+  metrics.start_snapshots(METRICS_DIR)
+
+def start_workers(rconn):
+  # The models are downloaded and parsed once here, and the parsed graphs
+  # are shared copy-on-write with the forked workers
+  ready_r, ready_w = os.pipe()
+  pids = []
+  for i in range(WORKER_PROCESSES):
+    pid = os.fork()
+    if pid == 0:
+      try:
+        os.close(ready_r)
+        init_worker_process()
+        warm_up()
+        os.write(ready_w, b'1')
+        os.close(ready_w)
+        log.info('Start worker process: ' + str(os.getpid()))
+        dispatch_job(rconn)
+      except Exception as e:
+        log.error('worker; ' + str(e))
+      os._exit(1)
+    pids.append(pid)
+
+  # The pod is ready once every worker has warmed up
+  os.close(ready_w)
+  warmed_up = 0
+  while warmed_up < WORKER_PROCESSES:
+    data = os.read(ready_r, WORKER_PROCESSES)
+    if not data:
+      break
+    warmed_up += len(data)
+  os.close(ready_r)
+  if warmed_up == WORKER_PROCESSES:
+    set_ready()
+
+  # Workers never return, so any exit means the pod is in a bad state
+  pid, status = os.wait()
+  log.error('worker process exited: ' + str(pid) + ' status: ' + str(status))
+  for p in pids:
+    if p != pid:
+      try:
+        os.kill(p, signal.SIGTERM)
+      except OSError:
+        pass
+  raise RuntimeError('worker process exited')
 
 def start(rconn):
   global version_id
   global obj_detector
+  clear_ready()
+  start_metrics_server()
   version_id = get_latest_crawl_version()
-  obj_detector = ObjectDetector()
+  create_sessions = WORKER_PROCESSES <= 1
+  obj_detector = create_detector(rconn, create_sessions=create_sessions)
+
+  if WORKER_PROCESSES > 1:
+    start_workers(rconn)
+    return
+
+  # Only start taking products once the sessions are warm
+  warm_up()
+  set_ready()
+  dispatch_job(rconn)
 
+def start_metrics_server():
+  if METRICS_PORT <= 0:
+    return
+  # Snapshots of the worker processes of an earlier run would be merged in
+  shutil.rmtree(METRICS_DIR, ignore_errors=True)
+  server = metrics.MetricsServer(METRICS_PORT,
+                                 ready_check=lambda: ready,
+                                 snapshot_dir=METRICS_DIR if WORKER_PROCESSES > 1 else None)
+  server.start()
+
+def dispatch_job(rconn):
   log.info('Start dispatch_job')
 
   Timer(HEALTH_CHECK_TIME, check_health, ()).start()
+  if WORKER_MODE == WORKER_MODE_PIPELINE:
+    start_pipeline(rconn)
+    return
+
   count = 0
   while True:
-    key, value = rconn.blpop([REDIS_PRODUCT_CLASSIFY_QUEUE])
-    if value is not None:
-      analyze_product(value)
+    if PRODUCT_BATCH_SIZE > 1:
+      values = pop_products(rconn, PRODUCT_BATCH_SIZE)
+      with metrics.timer('product_batch'):
+        analyze_products(values)
+    else:
+      with metrics.timer('queue_wait'):
+        key, value = rconn.blpop([REDIS_PRODUCT_CLASSIFY_QUEUE])
+      if value is not None:
+        with metrics.timer('product'):
+          analyze_product(value)
     global  heart_bit
     heart_bit = True
 
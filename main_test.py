@@ -0,0 +1,120 @@
+"""Smoke tests of the worker entry point on the local backend."""
+
+import os
+import tempfile
+import unittest
+
+# Read when backend and main are imported
+os.environ['BACKEND'] = 'local'
+os.environ['LOCAL_LOG_LEVEL'] = 'ERROR'
+os.environ['LOCAL_STORAGE_DIR'] = tempfile.mkdtemp()
+os.environ['METRICS_DIR'] = tempfile.mkdtemp()
+os.environ['FETCH_HTTP_CACHE'] = 'false'
+
+from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError
+
+import main
+from backend.local import LocalApi, LocalCollection
+
+class SessionRecorder(object):
+  def __init__(self):
+    self.created = 0
+
+  def create_sessions(self):
+    self.created += 1
+
+class FailingCollection(LocalCollection):
+  """Fails every bulk write, or only the operations at failed_indexes."""
+  def __init__(self, failed_indexes=None):
+    LocalCollection.__init__(self)
+    self.failed_indexes = failed_indexes
+
+  def bulk_write(self, requests, ordered=True):
+    if self.failed_indexes is None:
+      raise IOError('connection reset')
+    upserted = []
+    for i, request in enumerate(requests):
+      if i not in self.failed_indexes:
+        upserted.append({'index': i, '_id': LocalCollection.bulk_write(self, [request]).upserted_ids[0]})
+    raise BulkWriteError({'writeErrors': [{'index': i, 'code': 11000, 'errmsg': 'duplicate key'}
+                                          for i in self.failed_indexes],
+                          'upserted': upserted})
+
+def make_product(product_no):
+  return {'_id': ObjectId(),
+          'name': 'product ' + product_no,
+          'product_no': product_no,
+          'product_url': 'http://shop/' + product_no,
+          'main_image': '/nonexistent/' + product_no + '.jpg',
+          'main_image_mobile_full': '/nonexistent/' + product_no + '.jpg',
+          'main_image_mobile_thumb': '/nonexistent/' + product_no + '.jpg',
+          'price': 1000,
+          'host_code': 'host',
+          'host_group': 'group',
+          'host_url': 'http://shop',
+          'host_name': 'shop'}
+
+class SaveProductsTest(unittest.TestCase):
+  def setUp(self):
+    self.image_api = main.image_api
+    self.version_id = main.version_id
+    main.version_id = 'save-products-test-' + str(ObjectId())
+    self.products = [make_product('1'), make_product('2')]
+    for product in self.products:
+      main.product_api.collection.insert_one(product)
+
+  def tearDown(self):
+    main.image_api = self.image_api
+    main.version_id = self.version_id
+
+  def save(self, images):
+    main.image_api = LocalApi('images', images)
+    main.save_products([(product, '1', []) for product in self.products])
+
+  def is_classified(self, product):
+    return main.product_api.collection.find_one({'_id': product['_id']}).get('is_classified', False)
+
+  def test_products_are_marked_done(self):
+    self.save(LocalCollection())
+    for product in self.products:
+      self.assertTrue(main.is_product_done(product))
+      self.assertTrue(self.is_classified(product))
+
+  def test_failed_image_flush(self):
+    self.save(FailingCollection())
+    for product in self.products:
+      self.assertFalse(main.is_product_done(product))
+      self.assertFalse(self.is_classified(product))
+
+  def test_failed_image_write(self):
+    images = FailingCollection(failed_indexes=[1])
+    self.save(images)
+    self.assertEqual(len(images.documents), 1)
+    self.assertTrue(main.is_product_done(self.products[0]))
+    self.assertTrue(self.is_classified(self.products[0]))
+    self.assertFalse(main.is_product_done(self.products[1]))
+    self.assertFalse(self.is_classified(self.products[1]))
+
+class MainTest(unittest.TestCase):
+  def setUp(self):
+    self.obj_detector = main.obj_detector
+    main.obj_detector = SessionRecorder()
+
+  def tearDown(self):
+    main.obj_detector = self.obj_detector
+
+  def test_init_worker_process(self):
+    main.init_worker_process()
+    self.assertEqual(main.obj_detector.created, 1)
+    for api, name in [(main.product_api, 'products'),
+                      (main.object_api, 'objects'),
+                      (main.feature_api, 'features'),
+                      (main.image_api, 'images')]:
+      self.assertTrue(hasattr(api, name))
+
+  def test_get_latest_crawl_version(self):
+    self.assertEqual(main.get_latest_crawl_version(), 'local')
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,161 @@
+from __future__ import print_function
+
+import os
+import queue
+import threading
+import time
+from concurrent import futures
+
+import grpc
+
+from detect import object_detect_pb2
+from detect import object_detect_pb2_grpc
+from detect.object_detect import create_detector
+from detect.micro_batcher import MicroBatcher
+from detect.micro_batcher import BATCH_SIZE
+from detect.micro_batcher import BATCH_LATENCY
+from util import metrics
+import backend
+
+REDIS_SERVER = backend.get_env('REDIS_SERVER')
+REDIS_PASSWORD = backend.get_env('REDIS_PASSWORD')
+
+OD_WARM_UP = os.environ.get('OD_WARM_UP', 'true') == 'true'
+DETECT_GRPC_PORT = int(os.environ.get('DETECT_GRPC_PORT', 50051))
+DETECT_GRPC_WORKERS = int(os.environ.get('DETECT_GRPC_WORKERS', 32))
+DETECT_BATCH_SIZE = int(os.environ.get('DETECT_BATCH_SIZE', BATCH_SIZE))
+DETECT_BATCH_LATENCY = float(os.environ.get('DETECT_BATCH_LATENCY', BATCH_LATENCY))
+# Images of one DetectStream call in flight at once
+DETECT_STREAM_WINDOW = int(os.environ.get('DETECT_STREAM_WINDOW', DETECT_BATCH_SIZE * 2))
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 9102))
+STREAM_POLL_INTERVAL = 1.0
+
+ONE_DAY = 60*60*24
+
+options = {
+  'REDIS_SERVER': REDIS_SERVER,
+  'REDIS_PASSWORD': REDIS_PASSWORD
+}
+log = backend.create_log(options, 'bl-object-detect-server')
+rconn = backend.create_redis(REDIS_SERVER, REDIS_PASSWORD)
+
+def make_reply(obj):
+  location = obj['location']
+  return object_detect_pb2.DetectReply(
+    location=object_detect_pb2.Location(left=location['left'],
+                                        right=location['right'],
+                                        top=location['top'],
+                                        bottom=location['bottom']),
+    class_name=obj['class_name'],
+    class_code=obj['class_code'],
+    score=obj['score'],
+    feature=obj['feature'])
+
+def make_tagged_replies(request_id, future):
+  # The objects of one image, then a reply marking it done, or failed
+  try:
+    objects = future.result()
+  except Exception as e:
+    log.error('detect ' + request_id + ': ' + str(e))
+    yield object_detect_pb2.TaggedDetectReply(request_id=request_id, done=True, error=str(e))
+    return
+  for obj in objects:
+    yield object_detect_pb2.TaggedDetectReply(request_id=request_id, reply=make_reply(obj))
+  yield object_detect_pb2.TaggedDetectReply(request_id=request_id, done=True)
+
+class DetectServicer(object_detect_pb2_grpc.DetectServicer):
+  """Serves ObjectDetector, batching the images of concurrent requests.
+
+  Every call waits on its image in the micro batcher, whose single thread
+  owns the sessions and runs each batch through getObjectsBatch.
+  """
+  def __init__(self, detector, batch_size=DETECT_BATCH_SIZE, batch_latency=DETECT_BATCH_LATENCY):
+    self.detector = detector
+    self.batcher = MicroBatcher(detector.getObjectsBatch,
+                                max_batch_size=batch_size,
+                                max_latency=batch_latency)
+
+  def GetObjects(self, request, context):
+    try:
+      objects = self.batcher.submit(request.file_data).result()
+    except Exception as e:
+      log.error('GetObjects: ' + str(e))
+      context.set_code(grpc.StatusCode.UNKNOWN)
+      context.set_details(str(e))
+      return
+    for obj in objects:
+      yield make_reply(obj)
+
+  def DetectBatch(self, request, context):
+    # Submitted all at once, so the batcher can fill whole batches
+    submitted = [(r.request_id, self.batcher.submit(r.file_data)) for r in request.requests]
+    for request_id, future in submitted:
+      for reply in make_tagged_replies(request_id, future):
+        yield reply
+
+  def DetectStream(self, request_iterator, context):
+    # Requests are read on a thread of their own while replies are sent, in
+    # request order. The bounded queue stops reading once window images are
+    # in flight
+    submitted = queue.Queue(maxsize=DETECT_STREAM_WINDOW)
+
+    def put(item):
+      # Nothing takes from the queue anymore once the client has cancelled,
+      # so the reader gives up rather than block for good
+      while context.is_active():
+        try:
+          submitted.put(item, timeout=STREAM_POLL_INTERVAL)
+          return True
+        except queue.Full:
+          pass
+      return False
+
+    def submit_requests():
+      try:
+        for r in request_iterator:
+          if not put((r.request_id, self.batcher.submit(r.file_data))):
+            return
+      except Exception as e:
+        log.error('DetectStream: ' + str(e))
+      finally:
+        put(None)
+
+    reader = threading.Thread(target=submit_requests)
+    reader.daemon = True
+    reader.start()
+    while True:
+      try:
+        item = submitted.get(timeout=STREAM_POLL_INTERVAL)
+      except queue.Empty:
+        if not context.is_active():
+          break
+        continue
+      if item is None:
+        break
+      request_id, future = item
+      for reply in make_tagged_replies(request_id, future):
+        yield reply
+
+def serve():
+  serving = threading.Event()
+  if METRICS_PORT > 0:
+    metrics.MetricsServer(METRICS_PORT, ready_check=serving.is_set).start()
+
+  detector = create_detector(rconn)
+  if OD_WARM_UP:
+    detector.warm_up()
+
+  server = grpc.server(futures.ThreadPoolExecutor(max_workers=DETECT_GRPC_WORKERS))
+  object_detect_pb2_grpc.add_DetectServicer_to_server(DetectServicer(detector), server)
+  server.add_insecure_port('[::]:' + str(DETECT_GRPC_PORT))
+  server.start()
+  serving.set()
+  log.info('Start serving on ' + str(DETECT_GRPC_PORT))
+  try:
+    while True:
+      time.sleep(ONE_DAY)
+  except KeyboardInterrupt:
+    server.stop(0)
+
+if __name__ == '__main__':
+  serve()
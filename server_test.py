@@ -0,0 +1,160 @@
+"""Tests of the Detect servicer with a stand-in detector."""
+
+import itertools
+import os
+import threading
+import time
+import unittest
+
+# Read when backend and server are imported
+os.environ['BACKEND'] = 'local'
+os.environ['LOCAL_LOG_LEVEL'] = 'ERROR'
+
+from detect import object_detect_pb2
+import server
+
+TIMEOUT = 5.0
+
+class FakeDetector(object):
+  """Finds one object per byte of the image, fails on b'bad'."""
+  def __init__(self):
+    self.batches = []
+
+  def getObjectsBatch(self, image_datas):
+    self.batches.append(list(image_datas))
+    return [ValueError('cannot decode') if image_data == b'bad' else
+            [make_object(image_data, i) for i in range(len(image_data))]
+            for image_data in image_datas]
+
+class FakeContext(object):
+  def __init__(self):
+    self.code = None
+    self.details = None
+    self.active = True
+
+  def is_active(self):
+    return self.active
+
+  def set_code(self, code):
+    self.code = code
+
+  def set_details(self, details):
+    self.details = details
+
+def make_object(image_data, i):
+  return {'location': {'left': i, 'right': i + 1, 'top': 0, 'bottom': 1},
+          'class_name': image_data.decode('utf-8'),
+          'class_code': str(i),
+          'score': 0.5,
+          'feature': image_data}
+
+def make_request(request_id, file_data):
+  return object_detect_pb2.TaggedDetectRequest(request_id=request_id, file_data=file_data)
+
+def summarize(replies):
+  # (request_id, class_name/class_code of an object, or 'done'/the error)
+  summary = []
+  for reply in replies:
+    if reply.done:
+      summary.append((reply.request_id, reply.error or 'done'))
+    else:
+      summary.append((reply.request_id, reply.reply.class_name + '/' + reply.reply.class_code))
+  return summary
+
+class RequestStream(object):
+  """Endless client stream of requests, counting how many were read."""
+  def __init__(self):
+    self.read = 0
+
+  def __iter__(self):
+    for i in itertools.count():
+      self.read += 1
+      yield make_request(str(i), b'x' * (i % 3))
+
+class DetectServicerTest(unittest.TestCase):
+  def setUp(self):
+    self.detector = FakeDetector()
+    self.servicer = server.DetectServicer(self.detector, batch_size=8, batch_latency=0.05)
+    self.context = FakeContext()
+    self.window = server.DETECT_STREAM_WINDOW
+    self.poll_interval = server.STREAM_POLL_INTERVAL
+    server.DETECT_STREAM_WINDOW = 4
+    server.STREAM_POLL_INTERVAL = 0.01
+
+  def tearDown(self):
+    server.DETECT_STREAM_WINDOW = self.window
+    server.STREAM_POLL_INTERVAL = self.poll_interval
+
+  def test_get_objects(self):
+    request = object_detect_pb2.DetectRequest(file_data=b'ab')
+    replies = list(self.servicer.GetObjects(request, self.context))
+    self.assertEqual([(r.class_code, r.location.left, r.feature) for r in replies],
+                     [('0', 0, b'ab'), ('1', 1, b'ab')])
+    self.assertIsNone(self.context.code)
+
+  def test_get_objects_failure(self):
+    request = object_detect_pb2.DetectRequest(file_data=b'bad')
+    self.assertEqual(list(self.servicer.GetObjects(request, self.context)), [])
+    self.assertEqual(self.context.code, server.grpc.StatusCode.UNKNOWN)
+    self.assertEqual(self.context.details, 'cannot decode')
+
+  def test_detect_batch_replies_in_request_order(self):
+    request = object_detect_pb2.DetectBatchRequest(requests=[make_request('1', b'ab'),
+                                                             make_request('2', b'bad'),
+                                                             make_request('3', b''),
+                                                             make_request('4', b'c')])
+    replies = list(self.servicer.DetectBatch(request, self.context))
+    self.assertEqual(summarize(replies), [('1', 'ab/0'), ('1', 'ab/1'), ('1', 'done'),
+                                          ('2', 'cannot decode'),
+                                          ('3', 'done'),
+                                          ('4', 'c/0'), ('4', 'done')])
+    # Every image of the call went through one detector batch
+    self.assertEqual(self.detector.batches, [[b'ab', b'bad', b'', b'c']])
+
+  def test_detect_stream_replies_in_request_order(self):
+    requests = [make_request(str(i), b'x' * (i % 3)) for i in range(20)]
+    requests[7] = make_request('7', b'bad')
+    expected = []
+    for i in range(20):
+      if i == 7:
+        expected.append(('7', 'cannot decode'))
+        continue
+      expected.extend((str(i), 'x' * (i % 3) + '/' + str(j)) for j in range(i % 3))
+      expected.append((str(i), 'done'))
+    replies = list(self.servicer.DetectStream(iter(requests), self.context))
+    self.assertEqual(summarize(replies), expected)
+
+  def test_detect_stream_ends_on_a_broken_request_stream(self):
+    def broken():
+      yield make_request('0', b'x')
+      raise IOError('stream reset')
+    replies = list(self.servicer.DetectStream(broken(), self.context))
+    self.assertEqual(summarize(replies), [('0', 'x/0'), ('0', 'done')])
+
+  def test_detect_stream_cancelled(self):
+    threads = set(threading.enumerate())
+    requests = RequestStream()
+    stream = self.servicer.DetectStream(iter(requests), self.context)
+    self.assertEqual(summarize([next(stream) for i in range(3)]), [('0', 'done'), ('1', 'x/0'), ('1', 'done')])
+
+    # The client is only a few images ahead, the window holds the reader
+    time.sleep(0.1)
+    self.assertLessEqual(requests.read, 2 + server.DETECT_STREAM_WINDOW + 2)
+
+    self.context.active = False
+    # What is still in the window is drained, then the call returns
+    remaining = summarize(stream)
+    self.assertLessEqual(len([reply for reply in remaining if reply[1] == 'done']),
+                         server.DETECT_STREAM_WINDOW + 1)
+
+    # and the reader thread is gone, having stopped reading requests
+    deadline = time.time() + TIMEOUT
+    while set(threading.enumerate()) - threads and time.time() < deadline:
+      time.sleep(0.01)
+    self.assertEqual(set(threading.enumerate()) - threads, set())
+    read = requests.read
+    time.sleep(0.1)
+    self.assertEqual(requests.read, read)
+
+if __name__ == '__main__':
+  unittest.main()
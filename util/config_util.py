@@ -0,0 +1,37 @@
+"""Object detection pipeline config utility functions."""
+
+from google.protobuf import text_format
+from object_detection.protos import pipeline_pb2
+
+
+def load_pipeline_config(path):
+  """Loads a text format TrainEvalPipelineConfig, as written by the exporter.
+
+  Args:
+    path: path to pipeline.config.
+
+  Returns:
+    a TrainEvalPipelineConfig proto.
+  """
+  pipeline_config = pipeline_pb2.TrainEvalPipelineConfig()
+  with open(path, 'r') as fid:
+    text_format.Merge(fid.read(), pipeline_config)
+  return pipeline_config
+
+
+def get_image_resizer_config(pipeline_config):
+  """Returns the ImageResizer of the model, whatever its meta architecture.
+
+  Args:
+    pipeline_config: a TrainEvalPipelineConfig proto.
+
+  Returns:
+    an ImageResizer proto, or None if the model has none.
+  """
+  meta_architecture = pipeline_config.model.WhichOneof('model')
+  if meta_architecture is None:
+    return None
+  model_config = getattr(pipeline_config.model, meta_architecture)
+  if not model_config.HasField('image_resizer'):
+    return None
+  return model_config.image_resizer
@@ -0,0 +1,69 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+def load_image_into_numpy_array(image):
+  """Return the pixels of a PIL image as a HxWx3 uint8 array.
+
+  The array is built straight from PIL's buffer through the array interface,
+  without going through a per-pixel Python sequence, and it is read-only.
+  """
+  if image.mode != 'RGB':
+    image = image.convert('RGB')
+  return np.asarray(image, dtype=np.uint8)
+
+def decode_image(image_bytes, min_size=None):
+  """Decode encoded image bytes into a HxWx3 uint8 array.
+
+  Args:
+    image_bytes: encoded image data.
+    min_size: if set, JPEG images are decoded with a DCT scaling draft to the
+      smallest resolution whose sides are still at least min_size pixels.
+
+  Returns:
+    (image_np, original_size) where original_size is the (width, height) of
+    the image before any draft scaling.
+  """
+  image = Image.open(io.BytesIO(image_bytes))
+  original_size = image.size
+  if min_size:
+    image.draft('RGB', (min_size, min_size))
+  return load_image_into_numpy_array(image), original_size
+
+def get_resized_size(image_size, image_resizer):
+  """Return the (width, height) a model resizes an image of image_size to.
+
+  Mirrors the keep_aspect_ratio_resizer and fixed_shape_resizer of the object
+  detection API, so an image resized to it beforehand reaches the model's
+  feature extractor at the same resolution.
+  """
+  width, height = image_size
+  resizer_type = image_resizer.WhichOneof('image_resizer_oneof')
+  if resizer_type == 'fixed_shape_resizer':
+    config = image_resizer.fixed_shape_resizer
+    return config.width, config.height
+  if resizer_type == 'keep_aspect_ratio_resizer':
+    config = image_resizer.keep_aspect_ratio_resizer
+    scale = min(float(config.min_dimension) / min(width, height),
+                float(config.max_dimension) / max(width, height))
+    return int(round(width * scale)), int(round(height * scale))
+  return width, height
+
+def get_model_input_size(image_size, image_resizers):
+  """Return the smallest (width, height) that still serves every resizer.
+
+  Each side gets the largest size any of the models asks for, and images are
+  only ever shrunk. Boxes are normalized, so they are the same whether the
+  image was resized beforehand or not, even when the aspect ratio changes.
+  """
+  width, height = image_size
+  sizes = [get_resized_size(image_size, image_resizer) for image_resizer in image_resizers]
+  return (min(width, max(size[0] for size in sizes)),
+          min(height, max(size[1] for size in sizes)))
+
+def resize_image(image, size):
+  """Resize a PIL image to size, bilinear like the models' own resizers."""
+  if image.size == tuple(size):
+    return load_image_into_numpy_array(image)
+  return load_image_into_numpy_array(image.resize(size, Image.BILINEAR))
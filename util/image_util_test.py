@@ -0,0 +1,112 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from PIL import Image
+from object_detection.protos import image_resizer_pb2
+
+from util import config_util
+from util import image_util
+
+PIPELINE_CONFIG = """
+model {
+  faster_rcnn {
+    image_resizer {
+      keep_aspect_ratio_resizer {
+        min_dimension: 600
+        max_dimension: 1024
+      }
+    }
+  }
+}
+"""
+
+def keep_aspect_ratio_resizer(min_dimension, max_dimension):
+  image_resizer = image_resizer_pb2.ImageResizer()
+  image_resizer.keep_aspect_ratio_resizer.min_dimension = min_dimension
+  image_resizer.keep_aspect_ratio_resizer.max_dimension = max_dimension
+  return image_resizer
+
+def fixed_shape_resizer(width, height):
+  image_resizer = image_resizer_pb2.ImageResizer()
+  image_resizer.fixed_shape_resizer.width = width
+  image_resizer.fixed_shape_resizer.height = height
+  return image_resizer
+
+def encode(image, format):
+  buf = io.BytesIO()
+  image.save(buf, format=format)
+  return buf.getvalue()
+
+class ResizedSizeTest(unittest.TestCase):
+  def test_keep_aspect_ratio_min_dimension(self):
+    # The short side reaches min_dimension while the long one stays below max
+    resizer = keep_aspect_ratio_resizer(600, 1024)
+    self.assertEqual(image_util.get_resized_size((800, 600), resizer), (800, 600))
+    self.assertEqual(image_util.get_resized_size((1000, 1500), resizer), (600, 900))
+    self.assertEqual(image_util.get_resized_size((300, 200), resizer), (900, 600))
+
+  def test_keep_aspect_ratio_max_dimension(self):
+    # Scaling the short side to min_dimension would make the long one too long
+    resizer = keep_aspect_ratio_resizer(600, 1024)
+    self.assertEqual(image_util.get_resized_size((2000, 1000), resizer), (1024, 512))
+    self.assertEqual(image_util.get_resized_size((333, 1000), resizer), (341, 1024))
+
+  def test_fixed_shape(self):
+    resizer = fixed_shape_resizer(300, 200)
+    self.assertEqual(image_util.get_resized_size((1000, 1500), resizer), (300, 200))
+    self.assertEqual(image_util.get_resized_size((10, 10), resizer), (300, 200))
+
+  def test_without_resizer(self):
+    self.assertEqual(image_util.get_resized_size((640, 480), image_resizer_pb2.ImageResizer()), (640, 480))
+
+  def test_model_input_size_serves_every_model(self):
+    resizers = [keep_aspect_ratio_resizer(600, 1024), fixed_shape_resizer(300, 300)]
+    self.assertEqual(image_util.get_model_input_size((1000, 1500), resizers), (600, 900))
+    resizers = [fixed_shape_resizer(300, 300), fixed_shape_resizer(200, 400)]
+    self.assertEqual(image_util.get_model_input_size((1000, 1500), resizers), (300, 400))
+
+  def test_model_input_size_never_enlarges(self):
+    resizers = [keep_aspect_ratio_resizer(600, 1024)]
+    self.assertEqual(image_util.get_model_input_size((300, 200), resizers), (300, 200))
+    resizers = [fixed_shape_resizer(300, 300)]
+    self.assertEqual(image_util.get_model_input_size((640, 200), resizers), (300, 200))
+
+  def test_resizer_from_pipeline_config(self):
+    config_dir = tempfile.mkdtemp()
+    try:
+      path = os.path.join(config_dir, 'pipeline.config')
+      with open(path, 'w') as f:
+        f.write(PIPELINE_CONFIG)
+      resizer = config_util.get_image_resizer_config(config_util.load_pipeline_config(path))
+    finally:
+      shutil.rmtree(config_dir)
+    self.assertEqual(image_util.get_resized_size((2000, 1000), resizer), (1024, 512))
+
+class DecodeTest(unittest.TestCase):
+  def setUp(self):
+    self.image = Image.fromarray(np.random.RandomState(0).randint(0, 256, (1200, 1600, 3)).astype(np.uint8))
+
+  def test_decode(self):
+    image_np, original_size = image_util.decode_image(encode(self.image, 'PNG'))
+    self.assertEqual(original_size, (1600, 1200))
+    np.testing.assert_array_equal(image_np, np.asarray(self.image))
+
+  def test_draft_decode(self):
+    image_np, original_size = image_util.decode_image(encode(self.image, 'JPEG'), min_size=300)
+    self.assertEqual(original_size, (1600, 1200))
+    self.assertEqual(image_np.shape, (300, 400, 3))
+
+  def test_draft_keeps_min_size(self):
+    image_np, original_size = image_util.decode_image(encode(self.image, 'JPEG'), min_size=301)
+    self.assertEqual(image_np.shape, (600, 800, 3))
+
+  def test_resize_image(self):
+    self.assertEqual(image_util.resize_image(self.image, (400, 300)).shape, (300, 400, 3))
+    np.testing.assert_array_equal(image_util.resize_image(self.image, (1600, 1200)), np.asarray(self.image))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,200 @@
+"""In-process latency histograms exposed as Prometheus text.
+
+Stages are timed with `with metrics.timer('fetch'):` into one histogram per
+stage. A MetricsServer serves them on /metrics next to a /ready probe.
+Forked worker processes each keep their own histograms and dump them into a
+snapshot directory, which the server of the parent process merges in.
+"""
+
+import bisect
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+METRIC_NAME = 'bl_object_classifier_stage_seconds'
+COUNTER_NAME = 'bl_object_classifier_events_total'
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+SNAPSHOT_INTERVAL = 10
+
+class Histogram(object):
+  def __init__(self, buckets=BUCKETS):
+    self.buckets = buckets
+    self.counts = [0] * (len(buckets) + 1)
+    self.sum = 0.0
+
+  def observe(self, value):
+    self.counts[bisect.bisect_left(self.buckets, value)] += 1
+    self.sum += value
+
+  def merge(self, counts, sum):
+    for i, count in enumerate(counts):
+      self.counts[i] += count
+    self.sum += sum
+
+class Registry(object):
+  """Stage histograms and event counters of one process."""
+  def __init__(self, buckets=BUCKETS):
+    self.buckets = buckets
+    self.histograms = {}
+    self.counters = {}
+    self.__lock = threading.Lock()
+
+  def observe(self, stage, value):
+    with self.__lock:
+      histogram = self.histograms.get(stage)
+      if histogram is None:
+        histogram = self.histograms[stage] = Histogram(self.buckets)
+      histogram.observe(value)
+
+  def inc(self, event, value=1):
+    with self.__lock:
+      self.counters[event] = self.counters.get(event, 0) + value
+
+  def reset(self):
+    with self.__lock:
+      self.histograms = {}
+      self.counters = {}
+
+  def snapshot(self):
+    with self.__lock:
+      return {'histograms': dict((stage, [list(h.counts), h.sum]) for stage, h in self.histograms.items()),
+              'counters': dict(self.counters)}
+
+  def merged(self, snapshots):
+    registry = Registry(self.buckets)
+    for snapshot in [self.snapshot()] + snapshots:
+      for stage, (counts, sum) in snapshot['histograms'].items():
+        registry.histograms.setdefault(stage, Histogram(self.buckets)).merge(counts, sum)
+      for event, value in snapshot['counters'].items():
+        registry.counters[event] = registry.counters.get(event, 0) + value
+    return registry
+
+  def render(self):
+    lines = ['# TYPE %s histogram' % METRIC_NAME]
+    for stage in sorted(self.histograms):
+      histogram = self.histograms[stage]
+      cumulative = 0
+      for le, count in zip([str(b) for b in histogram.buckets] + ['+Inf'], histogram.counts):
+        cumulative += count
+        lines.append('%s_bucket{stage="%s",le="%s"} %d' % (METRIC_NAME, stage, le, cumulative))
+      lines.append('%s_sum{stage="%s"} %f' % (METRIC_NAME, stage, histogram.sum))
+      lines.append('%s_count{stage="%s"} %d' % (METRIC_NAME, stage, cumulative))
+    lines.append('# TYPE %s counter' % COUNTER_NAME)
+    for event in sorted(self.counters):
+      lines.append('%s{event="%s"} %d' % (COUNTER_NAME, event, self.counters[event]))
+    return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+def observe(stage, value):
+  REGISTRY.observe(stage, value)
+
+def inc(event, value=1):
+  REGISTRY.inc(event, value)
+
+@contextmanager
+def timer(stage):
+  start_time = time.time()
+  try:
+    yield
+  finally:
+    REGISTRY.observe(stage, time.time() - start_time)
+
+def timed(stage, func):
+  """Return func wrapped in timer(stage), e.g. to submit to an executor."""
+  def wrapper(*args, **kwargs):
+    with timer(stage):
+      return func(*args, **kwargs)
+  return wrapper
+
+class Sampler(object):
+  """Lets a fraction of per item log lines through."""
+  def __init__(self, rate):
+    self.rate = rate
+
+  def __call__(self):
+    return self.rate >= 1.0 or random.random() < self.rate
+
+def read_snapshots(snapshot_dir, exclude_pid=None):
+  snapshots = []
+  if snapshot_dir is None or not os.path.isdir(snapshot_dir):
+    return snapshots
+  for name in os.listdir(snapshot_dir):
+    if not name.endswith('.json') or name == str(exclude_pid) + '.json':
+      continue
+    try:
+      with open(os.path.join(snapshot_dir, name)) as f:
+        snapshots.append(json.load(f))
+    except (IOError, ValueError):
+      pass
+  return snapshots
+
+def write_snapshot(snapshot_dir):
+  if not os.path.isdir(snapshot_dir):
+    os.makedirs(snapshot_dir)
+  path = os.path.join(snapshot_dir, str(os.getpid()) + '.json')
+  tmp_path = path + '.tmp'
+  with open(tmp_path, 'w') as f:
+    json.dump(REGISTRY.snapshot(), f)
+  os.rename(tmp_path, path)
+
+def start_snapshots(snapshot_dir, interval=SNAPSHOT_INTERVAL):
+  """Dump the histograms of this process into snapshot_dir every interval."""
+  def run():
+    while True:
+      time.sleep(interval)
+      try:
+        write_snapshot(snapshot_dir)
+      except (IOError, OSError):
+        pass
+  thread = threading.Thread(target=run)
+  thread.daemon = True
+  thread.start()
+  return thread
+
+class MetricsServer(object):
+  """Serves /metrics and /ready from a daemon thread.
+
+  Args:
+    ready_check: called for /ready, which answers 200 while it returns True.
+    snapshot_dir: directory of worker snapshots merged into /metrics.
+  """
+  def __init__(self, port, ready_check=None, snapshot_dir=None):
+    server = self
+
+    class Handler(BaseHTTPRequestHandler):
+      def do_GET(self):
+        if self.path == '/metrics':
+          snapshots = read_snapshots(server.snapshot_dir, exclude_pid=os.getpid())
+          self.reply(200, REGISTRY.merged(snapshots).render())
+        elif self.path == '/ready':
+          ready = server.ready_check is None or server.ready_check()
+          self.reply(200 if ready else 503, 'ready\n' if ready else 'not ready\n')
+        else:
+          self.reply(404, 'not found\n')
+
+      def reply(self, code, body):
+        body = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, format, *args):
+        # Scrapes and probes would otherwise print a line each
+        pass
+
+    self.ready_check = ready_check
+    self.snapshot_dir = snapshot_dir
+    self.httpd = HTTPServer(('', port), Handler)
+
+  def start(self):
+    thread = threading.Thread(target=self.httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return thread
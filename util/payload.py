@@ -0,0 +1,226 @@
+"""Compact binary encodings for feature vectors and queue payloads.
+
+Vectors are little-endian blobs. Plain float32 blobs carry no header, which
+is what has always been stored, while float16 and int8 blobs start with
+VECTOR_MAGIC and a format byte (int8 also with its float32 scale). A float32
+blob can start with the same bytes, so blobs are decoded by the format stored
+next to them, never by sniffing the header.
+
+Messages are MESSAGE_MAGIC, a schema id and the values of the schema's
+fields in order, each one a type tag followed by its encoding. The generic
+schema holds a whole dict. loads() also reads the pickles queue items used
+to be, through an unpickler that only rebuilds plain data types.
+"""
+
+import _compat_pickle
+import io
+import pickle
+import struct
+import datetime
+from numbers import Integral, Real
+
+import numpy as np
+from bson.objectid import ObjectId
+
+VECTOR_FLOAT32 = 'float32'
+VECTOR_FLOAT16 = 'float16'
+VECTOR_INT8 = 'int8'
+VECTOR_MAGIC = b'\xb1V'
+VECTOR_CODES = {VECTOR_FLOAT16: 2, VECTOR_INT8: 3}
+
+FORMAT_PICKLE = 'pickle'
+FORMAT_BINARY = 'binary'
+MESSAGE_MAGIC = b'\xb1Q'
+
+SCHEMA_GENERIC = 0
+SCHEMA_IMAGE = 1
+# Field order is the wire format, only ever append fields to a schema
+SCHEMAS = {
+  SCHEMA_GENERIC: None,
+  SCHEMA_IMAGE: ['product_id', 'image_id', 'product_name', 'category', 'tags'],
+}
+
+def encode_vector(vector, format=VECTOR_FLOAT32):
+  """Encode a float32 array, or the bytes of one, as a vector blob."""
+  if isinstance(vector, bytes):
+    vector = np.frombuffer(vector, dtype='<f4')
+  vector = np.asarray(vector, dtype='<f4').ravel()
+  if format == VECTOR_FLOAT32:
+    return vector.tobytes()
+  if format == VECTOR_FLOAT16:
+    header = VECTOR_MAGIC + struct.pack('<B', VECTOR_CODES[format])
+    return header + vector.astype('<f2').tobytes()
+  if format == VECTOR_INT8:
+    # Symmetric quantization, one scale for the whole vector
+    scale = float(np.abs(vector).max()) / 127 if len(vector) > 0 else 0.0
+    quantized = np.round(vector / scale) if scale > 0 else np.zeros_like(vector)
+    header = VECTOR_MAGIC + struct.pack('<Bf', VECTOR_CODES[format], scale)
+    return header + quantized.astype('<i1').tobytes()
+  raise ValueError('unknown vector format: ' + str(format))
+
+def decode_vector(blob, format=VECTOR_FLOAT32):
+  """Decode a vector blob of the given format back to a float32 array."""
+  if format == VECTOR_FLOAT32:
+    return np.frombuffer(blob, dtype='<f4').astype(np.float32)
+  if format not in VECTOR_CODES:
+    raise ValueError('unknown vector format: ' + str(format))
+  offset = len(VECTOR_MAGIC)
+  if blob[:offset] != VECTOR_MAGIC or blob[offset:offset + 1] != struct.pack('<B', VECTOR_CODES[format]):
+    raise ValueError('not a %s vector' % format)
+  if format == VECTOR_FLOAT16:
+    return np.frombuffer(blob, dtype='<f2', offset=offset + 1).astype(np.float32)
+  scale, = struct.unpack_from('<f', blob, offset + 1)
+  return np.frombuffer(blob, dtype='<i1', offset=offset + 5).astype(np.float32) * scale
+
+def write_value(out, value):
+  if value is None:
+    out.write(b'N')
+  elif isinstance(value, bool):
+    out.write(b'T' if value else b'F')
+  elif isinstance(value, Integral):
+    out.write(b'i' + struct.pack('<q', value))
+  elif isinstance(value, Real):
+    out.write(b'd' + struct.pack('<d', value))
+  elif isinstance(value, str):
+    data = value.encode('utf-8')
+    out.write(b's' + struct.pack('<I', len(data)) + data)
+  elif isinstance(value, bytes):
+    out.write(b'b' + struct.pack('<I', len(value)) + value)
+  elif isinstance(value, ObjectId):
+    out.write(b'o' + value.binary)
+  elif isinstance(value, datetime.datetime):
+    out.write(b't')
+    write_value(out, value.isoformat())
+  elif isinstance(value, (list, tuple)):
+    out.write(b'l' + struct.pack('<I', len(value)))
+    for item in value:
+      write_value(out, item)
+  elif isinstance(value, dict):
+    out.write(b'm' + struct.pack('<I', len(value)))
+    for key, item in value.items():
+      write_value(out, key)
+      write_value(out, item)
+  else:
+    raise TypeError('cannot encode ' + type(value).__name__)
+
+def read_exactly(inp, size):
+  data = inp.read(size)
+  if len(data) != size:
+    raise ValueError('truncated message')
+  return data
+
+def read_value(inp):
+  tag = read_exactly(inp, 1)
+  if tag == b'N':
+    return None
+  if tag == b'T':
+    return True
+  if tag == b'F':
+    return False
+  if tag == b'i':
+    return struct.unpack('<q', read_exactly(inp, 8))[0]
+  if tag == b'd':
+    return struct.unpack('<d', read_exactly(inp, 8))[0]
+  if tag in (b's', b'b'):
+    size, = struct.unpack('<I', read_exactly(inp, 4))
+    data = read_exactly(inp, size)
+    return data.decode('utf-8') if tag == b's' else data
+  if tag == b'o':
+    return ObjectId(read_exactly(inp, 12))
+  if tag == b't':
+    value = read_value(inp)
+    try:
+      return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f')
+    except ValueError:
+      return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S')
+  if tag == b'l':
+    size, = struct.unpack('<I', read_exactly(inp, 4))
+    return [read_value(inp) for i in range(size)]
+  if tag == b'm':
+    size, = struct.unpack('<I', read_exactly(inp, 4))
+    value = {}
+    for i in range(size):
+      key = read_value(inp)
+      value[key] = read_value(inp)
+    return value
+  raise ValueError('unknown value tag: ' + repr(tag))
+
+def dumps_message(data, schema=SCHEMA_GENERIC):
+  out = io.BytesIO()
+  out.write(MESSAGE_MAGIC + struct.pack('<B', schema))
+  fields = SCHEMAS[schema]
+  if fields is None:
+    write_value(out, data)
+  else:
+    for field in fields:
+      write_value(out, data.get(field))
+  return out.getvalue()
+
+def loads_message(data):
+  inp = io.BytesIO(data)
+  if read_exactly(inp, len(MESSAGE_MAGIC)) != MESSAGE_MAGIC:
+    raise ValueError('not a message')
+  schema, = struct.unpack('<B', read_exactly(inp, 1))
+  if schema not in SCHEMAS:
+    raise ValueError('unknown schema: ' + str(schema))
+  fields = SCHEMAS[schema]
+  if fields is None:
+    return read_value(inp)
+  message = {}
+  for field in fields:
+    # Messages written before a field was appended end early
+    if inp.tell() == len(data):
+      message[field] = None
+    else:
+      message[field] = read_value(inp)
+  return message
+
+# Everything a pickled product or queue item is made of
+SAFE_PICKLE_GLOBALS = {
+  ('bson.objectid', 'ObjectId'),
+  # Scalars pymongo hands back for int64, timestamp, decimal and binary
+  # fields, and the tzinfo of tz aware datetimes
+  ('bson.int64', 'Int64'),
+  ('bson.timestamp', 'Timestamp'),
+  ('bson.decimal128', 'Decimal128'),
+  ('bson.binary', 'Binary'),
+  ('bson.tz_util', 'FixedOffset'),
+  ('datetime', 'datetime'),
+  ('datetime', 'date'),
+  ('datetime', 'time'),
+  ('datetime', 'timedelta'),
+  ('datetime', 'timezone'),
+  ('decimal', 'Decimal'),
+  ('copyreg', '_reconstructor'),
+  ('copyreg', '__newobj__'),
+  ('builtins', 'object'),
+  ('builtins', 'str'),
+  ('builtins', 'int'),
+  ('_codecs', 'encode'),
+}
+
+class SafeUnpickler(pickle.Unpickler):
+  """Unpickler that refuses anything but plain data types."""
+  def find_class(self, module, name):
+    # Protocol 0-2 pickles use the py2 names of globals, which the allow-list
+    # is checked against once mapped like pickle's fix_imports does
+    if (module, name) in _compat_pickle.NAME_MAPPING:
+      module, name = _compat_pickle.NAME_MAPPING[(module, name)]
+    elif module in _compat_pickle.IMPORT_MAPPING:
+      module = _compat_pickle.IMPORT_MAPPING[module]
+    if (module, name) not in SAFE_PICKLE_GLOBALS:
+      raise pickle.UnpicklingError('unsafe pickle global: %s.%s' % (module, name))
+    return pickle.Unpickler.find_class(self, module, name)
+
+def dumps(data, format=FORMAT_PICKLE, schema=SCHEMA_GENERIC):
+  if format == FORMAT_BINARY:
+    return dumps_message(data, schema)
+  if format == FORMAT_PICKLE:
+    return pickle.dumps(data)
+  raise ValueError('unknown payload format: ' + str(format))
+
+def loads(data):
+  """Read a queue item, whether it is a message or a legacy pickle."""
+  if data[:len(MESSAGE_MAGIC)] == MESSAGE_MAGIC:
+    return loads_message(data)
+  return SafeUnpickler(io.BytesIO(data)).load()
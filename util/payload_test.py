@@ -0,0 +1,143 @@
+import datetime
+import os
+import pickle
+import unittest
+
+import numpy as np
+from bson.int64 import Int64
+from bson.objectid import ObjectId
+
+from util import payload
+
+class Exploit(object):
+  def __reduce__(self):
+    return (os.system, ('true',))
+
+class VectorTest(unittest.TestCase):
+  def setUp(self):
+    self.vector = np.random.RandomState(0).randn(2048).astype(np.float32)
+
+  def test_float32_is_the_raw_array(self):
+    blob = payload.encode_vector(self.vector)
+    self.assertEqual(blob, self.vector.tobytes())
+    np.testing.assert_array_equal(payload.decode_vector(blob), self.vector)
+
+  def test_float32_bytes(self):
+    blob = payload.encode_vector(self.vector.tobytes())
+    np.testing.assert_array_equal(payload.decode_vector(blob), self.vector)
+
+  def test_float16(self):
+    blob = payload.encode_vector(self.vector, payload.VECTOR_FLOAT16)
+    self.assertEqual(len(blob), len(payload.VECTOR_MAGIC) + 1 + 2 * len(self.vector))
+    np.testing.assert_allclose(payload.decode_vector(blob, payload.VECTOR_FLOAT16), self.vector,
+                               rtol=1e-3, atol=1e-3)
+
+  def test_int8(self):
+    blob = payload.encode_vector(self.vector, payload.VECTOR_INT8)
+    self.assertEqual(len(blob), len(payload.VECTOR_MAGIC) + 5 + len(self.vector))
+    scale = np.abs(self.vector).max() / 127
+    np.testing.assert_allclose(payload.decode_vector(blob, payload.VECTOR_INT8), self.vector, atol=scale)
+
+  def test_int8_zeros(self):
+    vector = np.zeros(8, dtype=np.float32)
+    blob = payload.encode_vector(vector, payload.VECTOR_INT8)
+    np.testing.assert_array_equal(payload.decode_vector(blob, payload.VECTOR_INT8), vector)
+
+  def test_float32_starting_like_a_header(self):
+    # 0.12826039 is b1 56 03 3e, the magic and int8 code followed by more data
+    vector = self.vector.copy()
+    vector[0] = np.float32(0.12826039)
+    blob = payload.encode_vector(vector)
+    self.assertEqual(blob[:3], payload.VECTOR_MAGIC + b'\x03')
+    np.testing.assert_array_equal(payload.decode_vector(blob), vector)
+    np.testing.assert_array_equal(payload.decode_vector(blob, payload.VECTOR_FLOAT32), vector)
+
+  def test_format_mismatch(self):
+    with self.assertRaises(ValueError):
+      payload.decode_vector(payload.encode_vector(self.vector), payload.VECTOR_INT8)
+    with self.assertRaises(ValueError):
+      payload.decode_vector(payload.encode_vector(self.vector, payload.VECTOR_INT8), payload.VECTOR_FLOAT16)
+
+  def test_unknown_format(self):
+    with self.assertRaises(ValueError):
+      payload.encode_vector(self.vector, 'float64')
+    with self.assertRaises(ValueError):
+      payload.decode_vector(b'', 'float64')
+
+class MessageTest(unittest.TestCase):
+  def test_generic_round_trip(self):
+    data = {'_id': ObjectId(),
+            'name': u'상품',
+            'price': 12000,
+            'rate': 0.5,
+            'tags': ['a', 'b'],
+            'is_available': True,
+            'sale_price': None,
+            'raw': b'\x00\xff',
+            'created': datetime.datetime(2018, 1, 2, 3, 4, 5, 6),
+            'nested': {'k': [1, {'x': False}]}}
+    self.assertEqual(payload.loads(payload.dumps(data, payload.FORMAT_BINARY)), data)
+
+  def test_schema_round_trip(self):
+    data = {'product_id': 'p', 'image_id': 'i', 'product_name': 'n', 'category': None, 'tags': ['t']}
+    message = payload.dumps(data, payload.FORMAT_BINARY, payload.SCHEMA_IMAGE)
+    self.assertEqual(payload.loads(message), data)
+
+  def test_schema_drops_other_fields(self):
+    data = {'product_id': 'p', 'other': 1}
+    message = payload.dumps_message(data, payload.SCHEMA_IMAGE)
+    self.assertNotIn('other', payload.loads_message(message))
+
+  def test_message_without_appended_fields(self):
+    message = payload.dumps_message({'product_id': 'p', 'image_id': 'i'}, payload.SCHEMA_IMAGE)
+    # Cut off what the last three fields were encoded as
+    message = message[:-3]
+    self.assertEqual(payload.loads_message(message),
+                     {'product_id': 'p', 'image_id': 'i', 'product_name': None, 'category': None, 'tags': None})
+
+  def test_truncated_message(self):
+    message = payload.dumps_message({'name': 'product'})
+    with self.assertRaises(ValueError):
+      payload.loads_message(message[:-2])
+
+  def test_unknown_schema(self):
+    with self.assertRaises(ValueError):
+      payload.loads_message(payload.MESSAGE_MAGIC + b'\xff')
+
+  def test_unencodable_value(self):
+    with self.assertRaises(TypeError):
+      payload.dumps_message({'value': object()})
+
+class PickleTest(unittest.TestCase):
+  def test_product_pickle(self):
+    product = {'_id': ObjectId(),
+               'name': 'product',
+               'price': Int64(2 ** 40),
+               'created': datetime.datetime(2018, 1, 2),
+               'tags': ['a']}
+    for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+      self.assertEqual(payload.loads(pickle.dumps(product, protocol)), product)
+
+  def test_dumps_pickle(self):
+    data = {'product_id': 'p'}
+    self.assertEqual(pickle.loads(payload.dumps(data)), data)
+
+  def test_rejects_other_globals(self):
+    with self.assertRaises(pickle.UnpicklingError):
+      payload.loads(pickle.dumps(Exploit()))
+
+  def test_py2_names(self):
+    # What a py2 producer's protocol 2 pickle of {u'name': 1L} references
+    data = (b'\x80\x02}q\x00X\x04\x00\x00\x00nameq\x01c__builtin__\nlong\nq\x02K\x01\x85q\x03Rq\x04s.')
+    self.assertEqual(payload.loads(data), {'name': 1})
+
+  def test_rejects_py2_names_of_other_globals(self):
+    with self.assertRaises(pickle.UnpicklingError):
+      payload.loads(b'\x80\x02c__builtin__\neval\nq\x00X\x01\x00\x00\x001q\x01\x85q\x02Rq\x03.')
+
+  def test_rejects_other_classes(self):
+    with self.assertRaises(pickle.UnpicklingError):
+      payload.loads(pickle.dumps({'values': set([1])}, 2))
+
+if __name__ == '__main__':
+  unittest.main()
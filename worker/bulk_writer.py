@@ -0,0 +1,64 @@
+from __future__ import print_function
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+class Update(UpdateOne):
+  """UpdateOne that keeps its arguments where they can be read.
+
+  pymongo keeps them in private attributes only, so collections that aren't
+  pymongo's, like the local backend's, read them from here instead.
+  """
+  def __init__(self, query, document, upsert):
+    UpdateOne.__init__(self, query, document, upsert=upsert)
+    self.query = query
+    self.document = document
+    self.upsert = upsert
+
+class BulkWriter(object):
+  """Queues update operations on one collection and runs them as one bulk_write.
+
+  Used as a write-behind buffer: callers add operations for a whole batch of
+  products and flush() sends them in a single round trip.
+  """
+  def __init__(self, collection):
+    self.__collection = collection
+    self.__requests = []
+    self.write_errors = []
+
+  def update(self, query, doc, insert_id=None, upsert=True):
+    """Queue a $set of doc on the document matching query.
+
+    Args:
+      insert_id: _id to give the document if the update inserts it, so the
+        caller knows the id before the write happens.
+
+    Returns:
+      the index of the operation in the next flush().
+    """
+    update = {'$set': doc}
+    if insert_id is not None:
+      update['$setOnInsert'] = {'_id': insert_id}
+    self.__requests.append(Update(query, update, upsert))
+    return len(self.__requests) - 1
+
+  def flush(self):
+    """Run every queued operation.
+
+    Returns:
+      dict of {operation index: _id} for the operations that inserted a new
+      document. On a partial failure it holds the ones that went through, and
+      the failures are left in write_errors.
+    """
+    requests = self.__requests
+    self.__requests = []
+    self.write_errors = []
+    if len(requests) == 0:
+      return {}
+
+    try:
+      r = self.__collection.bulk_write(requests, ordered=False)
+      return r.upserted_ids
+    except BulkWriteError as e:
+      self.write_errors = e.details.get('writeErrors', [])
+      return dict((u['index'], u['_id']) for u in e.details.get('upserted', []))
@@ -0,0 +1,93 @@
+import os
+import unittest
+
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+# Read when backend is imported
+os.environ['BACKEND'] = 'local'
+os.environ['LOCAL_LOG_LEVEL'] = 'ERROR'
+
+from backend.local import LocalCollection
+from worker.bulk_writer import BulkWriter, Update
+
+class RecordingCollection(LocalCollection):
+  def __init__(self):
+    LocalCollection.__init__(self)
+    self.calls = []
+
+  def bulk_write(self, requests, ordered=True):
+    self.calls.append((requests, ordered))
+    return LocalCollection.bulk_write(self, requests, ordered)
+
+class FailingCollection(object):
+  """Fails the second of two operations, like a duplicate key would."""
+  def __init__(self, inserted_id):
+    self.inserted_id = inserted_id
+
+  def bulk_write(self, requests, ordered=True):
+    raise BulkWriteError({'writeErrors': [{'index': 1, 'code': 11000, 'errmsg': 'duplicate key'}],
+                          'upserted': [{'index': 0, '_id': self.inserted_id}]})
+
+class BulkWriterTest(unittest.TestCase):
+  def setUp(self):
+    self.collection = RecordingCollection()
+    self.writer = BulkWriter(self.collection)
+
+  def test_operations_are_sent_in_one_bulk_write(self):
+    for i in range(3):
+      self.assertEqual(self.writer.update({'name': str(i)}, {'value': i}), i)
+    self.assertEqual(self.collection.calls, [])
+    self.writer.flush()
+    self.assertEqual([(len(requests), ordered) for requests, ordered in self.collection.calls], [(3, False)])
+
+  def test_operations_are_pymongo_updates(self):
+    self.writer.update({'name': 'a'}, {'value': 1}, insert_id='id', upsert=False)
+    self.writer.flush()
+    request, = self.collection.calls[0][0]
+    self.assertIsInstance(request, Update)
+    self.assertIsInstance(request, UpdateOne)
+    self.assertEqual((request.query, request.document, request.upsert),
+                     ({'name': 'a'}, {'$set': {'value': 1}, '$setOnInsert': {'_id': 'id'}}, False))
+
+  def test_local_collection_rejects_other_operations(self):
+    with self.assertRaises(TypeError):
+      self.collection.bulk_write([UpdateOne({'name': 'a'}, {'$set': {'value': 1}})])
+    self.assertIsNone(self.collection.find_one({'name': 'a'}))
+
+  def test_upserted_ids_by_operation_index(self):
+    existing = self.collection.insert_one({'name': 'b', 'value': 0})
+    ids = [ObjectId(), ObjectId()]
+    self.writer.update({'name': 'a'}, {'value': 1}, insert_id=ids[0])
+    self.writer.update({'name': 'b'}, {'value': 2}, insert_id=ObjectId())
+    self.writer.update({'name': 'c'}, {'value': 3}, insert_id=ids[1])
+    self.assertEqual(self.writer.flush(), {0: ids[0], 2: ids[1]})
+    self.assertEqual(self.collection.find_one({'name': 'a'}), {'_id': ids[0], 'name': 'a', 'value': 1})
+    self.assertEqual(self.collection.find_one({'name': 'b'}), {'_id': existing, 'name': 'b', 'value': 2})
+
+  def test_update_without_upsert(self):
+    self.writer.update({'name': 'a'}, {'value': 1}, upsert=False)
+    self.assertEqual(self.writer.flush(), {})
+    self.assertIsNone(self.collection.find_one({'name': 'a'}))
+
+  def test_flush_clears_the_queue(self):
+    self.writer.update({'name': 'a'}, {'value': 1})
+    self.writer.flush()
+    self.assertEqual(self.writer.flush(), {})
+    self.assertEqual(len(self.collection.calls), 1)
+
+  def test_partial_failure(self):
+    inserted_id = ObjectId()
+    writer = BulkWriter(FailingCollection(inserted_id))
+    writer.update({'name': 'a'}, {'value': 1})
+    writer.update({'name': 'b'}, {'value': 2})
+    self.assertEqual(writer.flush(), {0: inserted_id})
+    self.assertEqual([error['index'] for error in writer.write_errors], [1])
+
+    # Errors only describe the last flush
+    writer.flush()
+    self.assertEqual(writer.write_errors, [])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,81 @@
+from __future__ import print_function
+
+import hashlib
+import os
+import tempfile
+import threading
+
+from util import payload
+
+HTTP_CACHE_DIR = '/tmp/bl-image-cache'
+HTTP_CACHE_SIZE = 2000
+HTTP_CACHE_PRUNE_INTERVAL = 100
+
+class HttpCache(object):
+  """Downloaded images with their ETag/Last-Modified, kept on disk per URL.
+
+  Entries are single files written with a rename, so threads and forked
+  worker processes can share the directory. Reading an entry touches it, and
+  once more than max_entries are stored the least recently used ones are
+  removed. Mount a node volume at the cache dir to keep it across pods.
+  Entries are payload messages rather than pickles, so whatever else can
+  write to a shared volume can't run code in the workers.
+  """
+  def __init__(self, cache_dir=HTTP_CACHE_DIR, max_entries=HTTP_CACHE_SIZE):
+    self.cache_dir = cache_dir
+    self.max_entries = max_entries
+    self.__puts = 0
+    self.__lock = threading.Lock()
+    if not os.path.exists(cache_dir):
+      try:
+        os.makedirs(cache_dir)
+      except OSError:
+        # Created by another worker meanwhile
+        pass
+
+  def get_path(self, url):
+    return os.path.join(self.cache_dir, hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+  def get(self, url):
+    """Return (etag, last_modified, data) stored for url, or None."""
+    path = self.get_path(url)
+    try:
+      with open(path, 'rb') as f:
+        entry = payload.loads_message(f.read())
+      os.utime(path, None)
+      return entry['etag'], entry['last_modified'], entry['data']
+    except Exception:
+      return None
+
+  def put(self, url, etag, last_modified, data):
+    fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        f.write(payload.dumps_message({'etag': etag, 'last_modified': last_modified, 'data': data}))
+      os.rename(tmp_path, self.get_path(url))
+    finally:
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    with self.__lock:
+      self.__puts += 1
+      prune = self.__puts % HTTP_CACHE_PRUNE_INTERVAL == 0
+    if prune:
+      self.prune()
+
+  def prune(self):
+    entries = []
+    for name in os.listdir(self.cache_dir):
+      path = os.path.join(self.cache_dir, name)
+      try:
+        entries.append((os.path.getmtime(path), path))
+      except OSError:
+        pass
+    if len(entries) <= self.max_entries:
+      return
+    entries.sort()
+    for mtime, path in entries[:len(entries) - self.max_entries]:
+      try:
+        os.remove(path)
+      except OSError:
+        pass
@@ -0,0 +1,139 @@
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from worker import http_cache
+from worker.http_cache import HttpCache
+from worker.image_fetcher import ImageFetcher
+
+IMAGE = b'\xff\xd8 not really a jpeg \xff\xd9'
+ETAG = '"v1"'
+
+class ImageServer(object):
+  """Serves IMAGE with an ETag, answering 304 to a matching If-None-Match."""
+  def __init__(self):
+    server = self
+    self.requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+      def do_GET(self):
+        server.requests.append(self.headers.get('If-None-Match'))
+        if self.headers.get('If-None-Match') == ETAG:
+          self.send_response(304)
+          self.end_headers()
+          return
+        self.send_response(200)
+        self.send_header('ETag', ETAG)
+        self.send_header('Content-Length', str(len(IMAGE)))
+        self.end_headers()
+        self.wfile.write(IMAGE)
+
+      def log_message(self, format, *args):
+        pass
+
+    self.httpd = HTTPServer(('127.0.0.1', 0), Handler)
+    self.url = 'http://127.0.0.1:%d/image.jpg' % self.httpd.server_address[1]
+    thread = threading.Thread(target=self.httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+  def stop(self):
+    self.httpd.shutdown()
+    self.httpd.server_close()
+
+class Exploit(object):
+  def __reduce__(self):
+    return (os.system, ('touch exploited',))
+
+class HttpCacheTest(unittest.TestCase):
+  def setUp(self):
+    self.cache_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.cache_dir)
+
+  def test_put_get(self):
+    cache = HttpCache(self.cache_dir)
+    self.assertIsNone(cache.get('http://a/1.jpg'))
+    cache.put('http://a/1.jpg', ETAG, 'Mon, 01 Jan 2018 00:00:00 GMT', IMAGE)
+    self.assertEqual(cache.get('http://a/1.jpg'), (ETAG, 'Mon, 01 Jan 2018 00:00:00 GMT', IMAGE))
+    self.assertIsNone(cache.get('http://a/2.jpg'))
+
+  def test_put_replaces(self):
+    cache = HttpCache(self.cache_dir)
+    cache.put('http://a/1.jpg', '"v1"', None, b'1')
+    cache.put('http://a/1.jpg', '"v2"', None, b'2')
+    self.assertEqual(cache.get('http://a/1.jpg'), ('"v2"', None, b'2'))
+    self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+  def test_corrupt_entry_is_a_miss(self):
+    cache = HttpCache(self.cache_dir)
+    with open(cache.get_path('http://a/1.jpg'), 'wb') as f:
+      f.write(b'garbage')
+    self.assertIsNone(cache.get('http://a/1.jpg'))
+
+  def test_pickle_is_not_loaded(self):
+    cache = HttpCache(self.cache_dir)
+    with open(cache.get_path('http://a/1.jpg'), 'wb') as f:
+      pickle.dump(Exploit(), f)
+    cwd = os.getcwd()
+    os.chdir(self.cache_dir)
+    try:
+      self.assertIsNone(cache.get('http://a/1.jpg'))
+    finally:
+      os.chdir(cwd)
+    self.assertFalse(os.path.exists(os.path.join(self.cache_dir, 'exploited')))
+
+  def test_prune_removes_least_recently_used(self):
+    cache = HttpCache(self.cache_dir, max_entries=2)
+    urls = ['http://a/%d.jpg' % i for i in range(4)]
+    for i, url in enumerate(urls):
+      cache.put(url, None, None, b'x')
+      # mtime resolution can be coarse, so every entry gets its own second
+      os.utime(cache.get_path(url), (1000000000 + i, 1000000000 + i))
+    # Reading touches the oldest entry, which makes it the most recent
+    self.assertIsNotNone(cache.get(urls[0]))
+    cache.prune()
+    self.assertIsNotNone(cache.get(urls[0]))
+    self.assertIsNone(cache.get(urls[1]))
+    self.assertIsNone(cache.get(urls[2]))
+    self.assertIsNotNone(cache.get(urls[3]))
+
+  def test_put_prunes_periodically(self):
+    cache = HttpCache(self.cache_dir, max_entries=10)
+    for i in range(http_cache.HTTP_CACHE_PRUNE_INTERVAL):
+      cache.put('http://a/%d.jpg' % i, None, None, b'x')
+    self.assertEqual(len(os.listdir(self.cache_dir)), 10)
+
+class ConditionalFetchTest(unittest.TestCase):
+  def setUp(self):
+    self.cache_dir = tempfile.mkdtemp()
+    self.server = ImageServer()
+
+  def tearDown(self):
+    self.server.stop()
+    shutil.rmtree(self.cache_dir)
+
+  def test_etag_hit(self):
+    cache = HttpCache(self.cache_dir)
+    fetcher = ImageFetcher(retries=0, http_cache=cache)
+    self.assertEqual(fetcher.download(self.server.url), IMAGE)
+    self.assertEqual(cache.get(self.server.url), (ETAG, None, IMAGE))
+
+    # A new fetcher has nothing in memory, so only the cache can answer
+    fetcher = ImageFetcher(retries=0, http_cache=cache)
+    self.assertEqual(fetcher.download(self.server.url), IMAGE)
+    self.assertEqual(self.server.requests, [None, ETAG])
+
+  def test_without_cache(self):
+    fetcher = ImageFetcher(retries=0)
+    self.assertEqual(fetcher.download(self.server.url), IMAGE)
+    self.assertEqual(fetcher.download(self.server.url), IMAGE)
+    self.assertEqual(self.server.requests, [None, None])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,110 @@
+from __future__ import print_function
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import certifi
+import urllib3
+
+from util import metrics
+
+FETCH_TIMEOUT = 10.0
+FETCH_RETRIES = 2
+FETCH_BACKOFF = 0.2
+FETCH_POOL_SIZE = 8
+FETCH_CACHE_SIZE = 64
+FETCH_RETRY_STATUS = [500, 502, 503, 504]
+
+class ImageFetcher(object):
+  """Downloads product images over pooled keep-alive connections.
+
+  Connections are pooled per host by urllib3, so fetching several images from
+  the same shop CDN reuses the socket. Images can be prefetched in the
+  background; fetch() then waits on the download already in flight instead
+  of starting a new one. Results stay around until release() is called or
+  until they are pushed out by newer ones, so a product whose two image
+  fields point to the same file only downloads it once.
+
+  With an HttpCache, images are downloaded with a conditional request on
+  their stored ETag/Last-Modified, and a 304 returns the stored bytes.
+  """
+  def __init__(self,
+               timeout=FETCH_TIMEOUT,
+               retries=FETCH_RETRIES,
+               pool_size=FETCH_POOL_SIZE,
+               cache_size=FETCH_CACHE_SIZE,
+               http_cache=None):
+    retry = urllib3.Retry(total=retries,
+                          backoff_factor=FETCH_BACKOFF,
+                          status_forcelist=FETCH_RETRY_STATUS,
+                          raise_on_status=False)
+    self.__http = urllib3.PoolManager(num_pools=pool_size * 4,
+                                      maxsize=pool_size,
+                                      timeout=urllib3.Timeout(total=timeout),
+                                      retries=retry,
+                                      cert_reqs='CERT_REQUIRED',
+                                      ca_certs=certifi.where())
+    self.__executor = ThreadPoolExecutor(max_workers=pool_size)
+    self.__cache_size = cache_size
+    self.__http_cache = http_cache
+    self.__futures = OrderedDict()
+    self.__lock = threading.Lock()
+
+  def download(self, url):
+    with metrics.timer('download'):
+      return self.request(url)
+
+  def request(self, url):
+    if self.__http_cache is None:
+      r = self.__http.request('GET', url)
+      if r.status != 200:
+        raise IOError('fetch ' + url + ': HTTP ' + str(r.status))
+      return r.data
+
+    headers = {}
+    entry = self.__http_cache.get(url)
+    if entry is not None:
+      etag, last_modified, data = entry
+      if etag:
+        headers['If-None-Match'] = etag
+      if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    r = self.__http.request('GET', url, headers=headers)
+    if r.status == 304 and entry is not None:
+      metrics.inc('http_cache_hit')
+      return data
+    if r.status != 200:
+      raise IOError('fetch ' + url + ': HTTP ' + str(r.status))
+
+    etag = r.headers.get('ETag')
+    last_modified = r.headers.get('Last-Modified')
+    if etag or last_modified:
+      self.__http_cache.put(url, etag, last_modified, r.data)
+    return r.data
+
+  def submit(self, url):
+    with self.__lock:
+      future = self.__futures.get(url)
+      if future is None:
+        future = self.__executor.submit(self.download, url)
+        self.__futures[url] = future
+        while len(self.__futures) > self.__cache_size:
+          self.__futures.popitem(last=False)
+      return future
+
+  def prefetch(self, urls):
+    for url in urls:
+      if url:
+        self.submit(url)
+
+  def fetch(self, url):
+    # Only the time spent waiting here, downloads are timed on their own
+    with metrics.timer('fetch'):
+      return self.submit(url).result()
+
+  def release(self, urls):
+    with self.__lock:
+      for url in urls:
+        self.__futures.pop(url, None)
@@ -0,0 +1,53 @@
+from __future__ import print_function
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+
+from util import metrics
+
+UPLOAD_POOL_SIZE = 8
+UPLOAD_CONTENT_TYPE = 'image/jpeg'
+
+class ImageUploader(object):
+  """Uploads in-memory images to S3 from a bounded pool of threads.
+
+  One boto3 client, and so one pool of HTTP connections, is shared by all
+  uploads. upload() returns a future resolving to the public URL of the
+  object, in the same format stylelens_s3 returns.
+  """
+  def __init__(self, aws_access_key, aws_secret_access_key, pool_size=UPLOAD_POOL_SIZE):
+    config = Config(max_pool_connections=pool_size)
+    self.__s3 = boto3.client('s3',
+                             aws_access_key_id=aws_access_key,
+                             aws_secret_access_key=aws_secret_access_key,
+                             config=config)
+    self.__executor = ThreadPoolExecutor(max_workers=pool_size)
+    self.__locations = {}
+    self.__lock = threading.Lock()
+
+  def get_bucket_location(self, bucket):
+    with self.__lock:
+      location = self.__locations.get(bucket)
+    if location is None:
+      location = self.__s3.get_bucket_location(Bucket=bucket)['LocationConstraint']
+      with self.__lock:
+        self.__locations[bucket] = location
+    return location
+
+  def put(self, bucket, key, data, is_public):
+    args = {}
+    if is_public:
+      # Setting the ACL with the upload saves the put_object_acl round trip
+      args['ACL'] = 'public-read'
+    with metrics.timer('upload'):
+      self.__s3.put_object(Bucket=bucket, Key=key, Body=data, ContentType=UPLOAD_CONTENT_TYPE, **args)
+    return "https://s3-{0}.amazonaws.com/{1}/{2}".format(
+      self.get_bucket_location(bucket),
+      bucket,
+      key)
+
+  def upload(self, bucket, key, data, is_public=False):
+    return self.__executor.submit(self.put, bucket, key, data, is_public)
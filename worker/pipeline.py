@@ -0,0 +1,98 @@
+from __future__ import print_function
+
+import queue
+import threading
+import time
+
+from util import metrics
+
+PIPELINE_QUEUE_SIZE = 16
+
+class Stage(object):
+  """One step of a Pipeline.
+
+  Args:
+    name: used when reporting errors.
+    func: called with one item (or with a list of items when batch_size is
+      set). Whatever it returns is passed on to the next stage; returning None
+      drops the item. With batch_size it returns a list with the result of
+      every item instead, or None to drop them all.
+    workers: number of threads running func.
+    batch_size: if set, func gets lists of up to batch_size items, waiting at
+      most linger seconds after the first one for the list to fill up and
+      then taking whatever else is already queued.
+  """
+  def __init__(self, name, func, workers=1, batch_size=None, linger=0.0):
+    self.name = name
+    self.func = func
+    self.workers = workers
+    self.batch_size = batch_size
+    self.linger = linger
+
+class Pipeline(object):
+  """Runs items through stages connected by bounded queues.
+
+  Every stage reads from its own queue of at most queue_size items, so a slow
+  stage eventually blocks the ones before it and, through put(), the producer
+  feeding the pipeline.
+  """
+  def __init__(self, stages, queue_size=PIPELINE_QUEUE_SIZE, on_error=None):
+    self.stages = stages
+    self.queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    self.on_error = on_error
+    self.threads = []
+
+  def start(self):
+    for i, stage in enumerate(self.stages):
+      for n in range(stage.workers):
+        t = threading.Thread(target=self.run_stage, args=(i,), name=stage.name + '-' + str(n))
+        t.daemon = True
+        t.start()
+        self.threads.append(t)
+
+  def put(self, item):
+    # Blocks while the first stage is backed up
+    self.queues[0].put(item)
+
+  def get_items(self, i):
+    stage = self.stages[i]
+    items = [self.queues[i].get()]
+    if stage.batch_size is None:
+      return items
+
+    deadline = time.time() + stage.linger
+    while len(items) < stage.batch_size:
+      timeout = deadline - time.time()
+      try:
+        if timeout > 0:
+          items.append(self.queues[i].get(timeout=timeout))
+        else:
+          items.append(self.queues[i].get_nowait())
+      except queue.Empty:
+        break
+    return items
+
+  def run_stage(self, i):
+    stage = self.stages[i]
+    while True:
+      items = self.get_items(i)
+      try:
+        with metrics.timer('pipeline_' + stage.name):
+          if stage.batch_size is None:
+            results = [stage.func(items[0])]
+          else:
+            results = stage.func(items) or []
+      except Exception as e:
+        self.report_error(stage, e)
+        continue
+
+      if i + 1 < len(self.stages):
+        for result in results:
+          if result is not None:
+            self.queues[i + 1].put(result)
+
+  def report_error(self, stage, e):
+    if self.on_error is not None:
+      self.on_error(stage.name, e)
+    else:
+      print(stage.name + ': ' + str(e))
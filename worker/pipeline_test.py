@@ -0,0 +1,116 @@
+import threading
+import time
+import unittest
+
+from worker.pipeline import Pipeline, Stage
+
+TIMEOUT = 5.0
+
+class Collector(object):
+  """Last stage that records what reaches it and signals once expected have."""
+  def __init__(self, expected):
+    self.items = []
+    self.expected = expected
+    self.done = threading.Event()
+    self.__lock = threading.Lock()
+
+  def __call__(self, item):
+    with self.__lock:
+      self.items.append(item)
+      if len(self.items) >= self.expected:
+        self.done.set()
+
+class PipelineTest(unittest.TestCase):
+  def run_pipeline(self, stages, items, on_error=None, queue_size=4):
+    pipeline = Pipeline(stages, queue_size=queue_size, on_error=on_error)
+    pipeline.start()
+    for item in items:
+      pipeline.put(item)
+    return pipeline
+
+  def test_items_pass_every_stage(self):
+    collector = Collector(20)
+    self.run_pipeline([Stage('double', lambda x: x * 2, workers=3),
+                       Stage('inc', lambda x: x + 1),
+                       Stage('collect', collector)], range(20))
+    self.assertTrue(collector.done.wait(TIMEOUT))
+    self.assertEqual(sorted(collector.items), [x * 2 + 1 for x in range(20)])
+
+  def test_none_drops_the_item(self):
+    collector = Collector(5)
+    self.run_pipeline([Stage('odd', lambda x: x if x % 2 else None),
+                       Stage('collect', collector)], range(10))
+    self.assertTrue(collector.done.wait(TIMEOUT))
+    self.assertEqual(sorted(collector.items), [1, 3, 5, 7, 9])
+
+  def test_errors_are_reported_and_drop_only_their_item(self):
+    errors = []
+
+    def fail_on_three(x):
+      if x == 3:
+        raise ValueError('three')
+      return x
+
+    collector = Collector(4)
+    self.run_pipeline([Stage('check', fail_on_three, workers=2),
+                       Stage('collect', collector)], range(5),
+                      on_error=lambda stage, e: errors.append((stage, str(e))))
+    self.assertTrue(collector.done.wait(TIMEOUT))
+    self.assertEqual(sorted(collector.items), [0, 1, 2, 4])
+    self.assertEqual(errors, [('check', 'three')])
+
+  def test_batched_stage_forwards_every_result(self):
+    batches = []
+
+    def keep_even(items):
+      batches.append(list(items))
+      return [x if x % 2 == 0 else None for x in items]
+
+    collector = Collector(5)
+    self.run_pipeline([Stage('even', keep_even, batch_size=4, linger=0.05),
+                       Stage('collect', collector)], range(10), queue_size=10)
+    self.assertTrue(collector.done.wait(TIMEOUT))
+    self.assertEqual(sorted(collector.items), [0, 2, 4, 6, 8])
+    self.assertEqual(sorted(x for batch in batches for x in batch), list(range(10)))
+    self.assertTrue(all(len(batch) <= 4 for batch in batches))
+    self.assertLess(len(batches), 10)
+
+  def test_batched_stage_returning_none(self):
+    batches = []
+    done = threading.Event()
+
+    def persist(items):
+      batches.extend(items)
+      if len(batches) == 6:
+        done.set()
+
+    self.run_pipeline([Stage('persist', persist, batch_size=4)], range(6))
+    self.assertTrue(done.wait(TIMEOUT))
+    self.assertEqual(sorted(batches), list(range(6)))
+
+  def test_put_blocks_while_full(self):
+    release = threading.Event()
+    pipeline = Pipeline([Stage('wait', lambda x: release.wait())], queue_size=1)
+    pipeline.start()
+    pipeline.put(0)
+    pipeline.put(1)
+
+    # One item is being worked on and one is queued, so the next one waits
+    putter = threading.Thread(target=pipeline.put, args=(2,))
+    putter.daemon = True
+    putter.start()
+    time.sleep(0.1)
+    self.assertTrue(putter.is_alive())
+    release.set()
+    putter.join(TIMEOUT)
+    self.assertFalse(putter.is_alive())
+
+  def test_workers_do_not_block_shutdown(self):
+    # Stage threads run forever, so they must be daemons the process can
+    # exit without
+    pipeline = self.run_pipeline([Stage('a', lambda x: x, workers=2), Stage('b', lambda x: None)], [])
+    self.assertEqual(len(pipeline.threads), 3)
+    self.assertTrue(all(t.daemon and t.is_alive() for t in pipeline.threads))
+
+if __name__ == '__main__':
+  unittest.main()
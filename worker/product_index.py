@@ -0,0 +1,43 @@
+from __future__ import print_function
+
+PRODUCT_INDEX_PREFIX = 'bl:object:classifier:done:'
+PRODUCT_INDEX_EXPIRE = 60*60*24*7
+
+class ProductIndex(object):
+  """Redis sets of the product ids already persisted, one per crawl version.
+
+  Products are requeued whenever a pod is deleted with work in flight, so a
+  product is looked up here before its images are fetched and only marked
+  once its results were written. Sets expire with their crawl version.
+  """
+  def __init__(self, rconn, prefix=PRODUCT_INDEX_PREFIX, expire=PRODUCT_INDEX_EXPIRE):
+    self.__rconn = rconn
+    self.prefix = prefix
+    self.expire = expire
+
+  def get_key(self, version_id):
+    return self.prefix + str(version_id)
+
+  def filter_done(self, version_id, product_ids):
+    """Return the set of product_ids already done for version_id."""
+    product_ids = list(product_ids)
+    if len(product_ids) == 0:
+      return set()
+    key = self.get_key(version_id)
+    pipe = self.__rconn.pipeline(transaction=False)
+    for product_id in product_ids:
+      pipe.sismember(key, product_id)
+    return set(product_id for product_id, done in zip(product_ids, pipe.execute()) if done)
+
+  def is_done(self, version_id, product_id):
+    return self.__rconn.sismember(self.get_key(version_id), product_id)
+
+  def mark_done(self, version_id, product_ids):
+    product_ids = list(product_ids)
+    if len(product_ids) == 0:
+      return
+    key = self.get_key(version_id)
+    pipe = self.__rconn.pipeline(transaction=False)
+    pipe.sadd(key, *product_ids)
+    pipe.expire(key, self.expire)
+    pipe.execute()